@@ -20,17 +20,24 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import hashlib
 import json
 import os
 import socket
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from importlib import util
 from datetime import datetime
 from pathlib import Path
+from urllib.error import HTTPError
 from urllib.request import urlopen, Request
 
 # Include the code for downloading IN this file, to have a single installable file (easy to install):
 CODE_ENDPOINT = 'https://api.github.com/repos/yourapi/server-to-sitekick/releases'
+AUTOUPDATE_MANIFEST = '.autoupdate.json'  # the listing of the last update, in the root of the code
+AUTOUPDATE_JOURNAL = '.autoupdate.swap'  # the verified files being swapped in, in the root of the code
+AUTOUPDATE_TIMEOUT = 30  # seconds, for the listing and for every file
+AUTOUPDATE_WORKERS = 4  # files downloaded at the same time
 
 try:
     __file__
@@ -38,34 +45,163 @@ except NameError:
     __file__ = os.path.abspath('domains-to-sitekick.py')
 
 
+def _read_manifest(path):
+    """Return the manifest of the last update: the validators of the release listing and the files it contained."""
+    try:
+        manifest = json.loads(path.read_text())
+        if isinstance(manifest, dict) and isinstance(manifest.get('files'), dict):
+            return manifest
+    except Exception:
+        pass
+    return {'files': {}}
+
+
+def _write_atomic(path, content):
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temp_path.write_bytes(content)
+    os.replace(str(temp_path), str(path))
+
+
+def complete_swap(root_path):
+    """Swap in the verified files of an update listed in the journal, and write the manifest of the update. The journal
+    is written before the first file is replaced and removed after the last one, so an update which was interrupted
+    while swapping (a crash, a reboot) is completed by the next run, before the code is imported. Return True when a
+    journal was found."""
+    journal_path = Path(root_path) / AUTOUPDATE_JOURNAL
+    try:
+        journal = json.loads(journal_path.read_text())
+    except OSError:
+        return False
+    except ValueError:
+        # The journal is written atomically, a corrupt journal was not written by this code:
+        journal_path.unlink()
+        return False
+    for temp_name, name in journal['files']:
+        temp_path = Path(root_path, temp_name)
+        # A missing temporary file was swapped in before the interruption:
+        if temp_path.exists():
+            os.replace(str(temp_path), str(Path(root_path, name)))
+            print('Downloaded', Path(root_path, name))
+    _write_atomic(Path(root_path) / AUTOUPDATE_MANIFEST, json.dumps(journal['manifest'], indent=1).encode('utf-8'))
+    journal_path.unlink()
+    return True
+
+
+def _release_seconds(timestamp):
+    # Split the time zone; Python 3.5 has no %z parse field:
+    timestamp, offset = timestamp.split('+')
+    offset = datetime.strptime(offset, '%H:%M')
+    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f').timestamp() + offset.hour * 3600 + offset.minute * 60
+
+
+def _download(file, filename):
+    """Download the file to a temporary file next to `filename` and verify it: the length (Content-Length and the
+    `size` of the listing), the `sha256` of the listing and, for Python files, that it compiles. Return the temporary
+    file, which replaces `filename` when the whole set is verified."""
+    response = urlopen(Request(file['content']), timeout=AUTOUPDATE_TIMEOUT)
+    content = response.read()
+    length = getattr(response, 'headers', {}).get('Content-Length')
+    if length is not None and int(length) != len(content):
+        raise ValueError(f"incomplete download, {len(content)} of {length} bytes")
+    if file.get('size') is not None and int(file['size']) != len(content):
+        raise ValueError(f"size {len(content)} differs from the listed size {file['size']}")
+    if file.get('sha256') and hashlib.sha256(content).hexdigest() != file['sha256']:
+        raise ValueError('sha256 differs from the listed sha256')
+    if filename.suffix == '.py':
+        compile(content, str(filename), 'exec')
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = filename.with_name(f".{filename.name}.{os.getpid()}.autoupdate")
+    temp_path.write_bytes(content)
+    return temp_path
+
+
 def load_code(root_path=None):
-    """CHANGE THIS to loading the code from github and extracting it, comparing the timestamp of the current files to
-    that of the last release. Use ONLY github for code download, for maximum transparency!"""
+    """Update the code from the github releases (use ONLY github for code download, for maximum transparency!).
+    The listing of the last release is kept in a manifest with its ETag and Last-Modified, so the listing is requested
+    conditionally: when nothing changed, the update costs a single 304. Changed files are downloaded in parallel (at
+    most `AUTOUPDATE_WORKERS` at the same time) to temporary files and verified. Only when all of them are verified,
+    they replace the current files, so a failed download never leaves a mix of old and new code behind. The files are
+    replaced through a journal (see `complete_swap`): a swap which is interrupted is completed by the next run, before
+    the code is imported."""
     if not root_path:
         root_path = Path(__file__).parent.parent
         # The root path of the server-to-sitekick code, this code is in level 1
     if '145-131-8-226' in socket.gethostname():  # Local testing preventing overwriting of local code
         return
+    root_path = Path(root_path)
+    if root_path.is_file():
+        print(f"Running from the archive {root_path}: build a new archive to update the code")
+        return
+    try:
+        complete_swap(root_path)
+    except Exception as e:
+        print(f"Completing the interrupted update in {root_path} failed with exception: {e}")
+        return
+    manifest_path = root_path / AUTOUPDATE_MANIFEST
+    manifest = _read_manifest(manifest_path)
     req = Request(CODE_ENDPOINT)
-    files = json.loads(urlopen(req).read())
+    # The validators only apply when the files of the last update are still present:
+    if all(Path(root_path, name).exists() for name in manifest['files']):
+        if manifest.get('etag'):
+            req.add_header('If-None-Match', manifest['etag'])
+        if manifest.get('last_modified'):
+            req.add_header('If-Modified-Since', manifest['last_modified'])
+    try:
+        response = urlopen(req, timeout=AUTOUPDATE_TIMEOUT)
+        files = json.loads(response.read())
+    except HTTPError as e:
+        if e.code != 304:
+            print(f"Download of {CODE_ENDPOINT} failed with exception: {e}")
+        return
+    except Exception as e:
+        print(f"Download of {CODE_ENDPOINT} failed with exception: {e}")
+        return
+    headers = getattr(response, 'headers', {})
+    listed, changed = {}, []
     for file in files:
         try:
-            filename = Path(root_path, file['path'], file['name'])
-            # Split the time zone; Python 3.5 has no %z parse field:
-            timestamp, offset = file['_timestamp_'].split('+')
-            offset = datetime.strptime(offset, '%H:%M')
-            seconds = datetime.strptime(timestamp,
-                                        '%Y-%m-%dT%H:%M:%S.%f').timestamp() + offset.hour * 3600 + offset.minute * 60
-            if (filename.exists()
-                    and filename.stat().st_mtime > seconds):
+            name = str(Path(file['path'], file['name']))
+            filename = Path(root_path, name)
+            known = manifest['files'].get(name)
+            # Without a manifest entry (the first update), the file is current when it is newer than the release:
+            if filename.exists() and (known.get('timestamp') == file['_timestamp_'] if known is not None
+                                      else filename.stat().st_mtime > _release_seconds(file['_timestamp_'])):
+                listed[name] = {'timestamp': file['_timestamp_']}
                 continue
-            content = urlopen(Request(file['content'])).read()
-            filename.parent.mkdir(parents=True, exist_ok=True)
-            filename.write_bytes(content)
-            print('Downloaded', filename)
+            changed.append((file, filename))
+            listed[name] = {'timestamp': file['_timestamp_']}
         except Exception as e:
-            print(f"Download of {file['content']} failed with exception: {e}")
-            continue
+            print(f"Download of {file.get('content')} failed with exception: {e}")
+    downloads, failed = [], False
+    if changed:
+        with ThreadPoolExecutor(max_workers=min(AUTOUPDATE_WORKERS, len(changed))) as executor:
+            futures = [(file, filename, executor.submit(_download, file, filename)) for file, filename in changed]
+        for file, filename, future in futures:
+            try:
+                downloads.append((future.result(), filename))
+            except Exception as e:
+                print(f"Download of {file['content']} failed with exception: {e}")
+                failed = True
+    if failed:
+        # Keep the current code and manifest, the next run tries again:
+        for temp_path, filename in downloads:
+            temp_path.unlink()
+        return
+    manifest = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'), 'files': listed}
+    journal = {'files': [[str(temp_path.relative_to(root_path)), str(filename.relative_to(root_path))]
+                         for temp_path, filename in downloads], 'manifest': manifest}
+    try:
+        _write_atomic(root_path / AUTOUPDATE_JOURNAL, json.dumps(journal, indent=1).encode('utf-8'))
+    except Exception as e:
+        print(f"Writing {root_path / AUTOUPDATE_JOURNAL} failed with exception: {e}")
+        for temp_path, filename in downloads:
+            temp_path.unlink()
+        return
+    try:
+        complete_swap(root_path)
+    except Exception as e:
+        # The journal is kept, the next run completes the update:
+        print(f"Swapping in the update in {root_path} failed with exception: {e}")
 
 
 # Now, set the python path dynamically to enable loading of modules:
@@ -77,6 +213,13 @@ if os.getenv('PYTHONPATH'):
 else:
     os.environ['PYTHONPATH'] = current_path
 
+# Complete an update which was interrupted while its files were swapped in, before the code is imported:
+if __name__ == '__main__':
+    try:
+        complete_swap(Path(__file__).parent)
+    except Exception as e:
+        print(f"Completing the interrupted update failed with exception: {e}")
+
 # Now the code is bootstrapped, execute the supplied or default command. The command is executed in the commandline
 # module, which dispatches the command to the relevant module/function:
 from sitekick import config
@@ -108,28 +251,48 @@ def _load_config_from_path(config_path):
         return False
     module = util.module_from_spec(spec)
     spec.loader.exec_module(module)
-    for name in ('QUEUE_PATH', 'SITEKICK_PUSH_URL', 'ENABLE_AUTOUPDATE', 'SYSTEM_INFO', 'GDPR_COMPLIANT', 'GDPR_PSK'):
+    for name in ('QUEUE_PATH', 'SITEKICK_PUSH_URL', 'ENABLE_AUTOUPDATE', 'SYSTEM_INFO', 'GDPR_COMPLIANT', 'GDPR_PSK',
+                 'GDPR_FIELDS', 'COLLECT_WORKERS', 'DELTA_MODE', 'DELTA_RESEND_DAYS', 'PUSH_COMPRESSION',
+                 'PUSH_COMPRESSION_DICTIONARY', 'PUSH_CONNECT_TIMEOUT', 'PUSH_READ_TIMEOUT', 'PUSH_BATCH_BYTES',
+                 'PUSH_MAX_BATCH_COUNT', 'PUSH_TARGET_LATENCY', 'PUSH_BACKOFF_BASE', 'PUSH_BACKOFF_MAX',
+                 'PUSH_MAX_RETRY_AFTER', 'PUSH_MIN_RATE', 'PUSH_RATE_INCREASE', 'PUSH_MAX_REQUESTS_PER_SECOND',
+                 'PUSH_MAX_BYTES_PER_SECOND', 'PUSH_BURST_SECONDS', 'CHANNEL_SIZE', 'PARALLEL_PROVIDERS',
+                 'MAX_CONCURRENCY', 'PUSH_IN_FLIGHT', 'METRICS_PATH', 'PROVIDER_REGISTRY_TTL', 'RESOLVER_TIMEOUT',
+                 'IDENTITY_REFRESH', 'CHECKPOINT_MAX_AGE', 'FINGERPRINT_MAX_AGE', 'SHARDS', 'SHARD', 'PLESK_BULK_SQL',
+                 'PLESK_PARSED_INFO', 'GOVERNOR_MAX_LOAD', 'GOVERNOR_MAX_IO_PRESSURE', 'GOVERNOR_INTERVAL',
+                 'GOVERNOR_PAUSE', 'GOVERNOR_MAX_PAUSE', 'CHILD_NICE', 'CHILD_IONICE_CLASS', 'CHILD_IONICE_LEVEL'):
         if hasattr(module, name):
             setattr(config, name, getattr(module, name))
     config.CONFIG_PATH = str(config_dir)
     return True
 
 
-config_path = _get_config_path(sys.argv[1:], config.CONFIG_PATH)
-_load_config_from_path(config_path)
-parser.set_defaults(
-    config_path=config.CONFIG_PATH,
-    queue_path=config.QUEUE_PATH,
-    sitekick_url=config.SITEKICK_PUSH_URL,
-    enable_autoupdate=config.ENABLE_AUTOUPDATE,
-    system_info=config.SYSTEM_INFO,
-    gdpr_compliant=config.GDPR_COMPLIANT,
-    gdpr_psk=config.GDPR_PSK,
-)
-
-args = parser.parse_args()
-if args.enable_autoupdate:
-    load_code(Path(__file__).parent)
-
-# Now execute the command:
-execute(args)
+if __name__ == '__main__':
+    config_path = _get_config_path(sys.argv[1:], config.CONFIG_PATH)
+    _load_config_from_path(config_path)
+    parser.set_defaults(
+        config_path=config.CONFIG_PATH,
+        queue_path=config.QUEUE_PATH,
+        sitekick_url=config.SITEKICK_PUSH_URL,
+        collect_workers=config.COLLECT_WORKERS,
+        push_compression=config.PUSH_COMPRESSION,
+        parallel_providers=config.PARALLEL_PROVIDERS,
+        max_concurrency=config.MAX_CONCURRENCY,
+        push_in_flight=config.PUSH_IN_FLIGHT,
+        metrics_path=config.METRICS_PATH,
+        max_load=config.GOVERNOR_MAX_LOAD,
+        shards=config.SHARDS,
+        shard=config.SHARD,
+        enable_autoupdate=config.ENABLE_AUTOUPDATE,
+        system_info=config.SYSTEM_INFO,
+        gdpr_compliant=config.GDPR_COMPLIANT,
+        gdpr_psk=config.GDPR_PSK,
+        delta_mode=config.DELTA_MODE,
+    )
+
+    args = parser.parse_args()
+    if args.enable_autoupdate:
+        load_code(Path(__file__).parent)
+
+    # Now execute the command:
+    execute(args)
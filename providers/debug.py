@@ -8,9 +8,10 @@ from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 
 from sitekick.config import SITEKICK_DEBUG_URL
-from sitekick.utils import now, hostname, ip_address, mac_address, cli
+from sitekick.utils import identity, cli
 
 EXECUTE_PARALLEL = False
+SHARDED = False  # every run executes all debug commands
 DOMAIN_COUNT_PER_POST = 10  # Count and interval are optionally specified per module
 DOMAIN_POST_INTERVAL = 1
 
@@ -22,7 +23,7 @@ def is_server_type():
 def get_domains():
     """Get the intended info to retrieve. The command is retrieved from the Sitekick service, is retrieved according
     to the cron schedule, default every 5 minutes so commands can be changed and the result can be retrieved quite fast."""
-    params = {'hostname': hostname or ip_address or mac_address}
+    params = {'hostname': identity.hostname or identity.ip_address or identity.mac_address}
     sitekick_url = SITEKICK_DEBUG_URL + '?' + urlencode(params)
     print(sitekick_url)
     req = Request(sitekick_url, method='GET')
@@ -33,7 +34,8 @@ def get_domains():
     print(data)
     total_commands = []
     for regex, commands in data.items():
-        if any(re.fullmatch(regex, identifier, re.I) for identifier in (hostname, ip_address, mac_address)):
+        identifiers = (identity.hostname, identity.ip_address, identity.mac_address)
+        if any(re.fullmatch(regex, identifier, re.I) for identifier in identifiers):
             total_commands.extend(commands)
     return [urllib.parse.quote(json.dumps(item), safe='') for item in total_commands]
 
@@ -5,16 +5,22 @@ but does not contain all information. The CLI is also callable through the API,
 The cli is used to retrieve a complete list of domains and to get detailed information about a domain.
 The text information is converted to json format, so it can be sent easily.
 """
+import datetime
+import hashlib
+import os
 import re
+import threading
 
 from sitekick import config
-from sitekick.utils import hostname, ip_address, mac_address, cli, obfuscate
+from sitekick.utils import identity, cli, get_redactor
 
 tokens = dict()
 
 DOMAIN_COUNT_PER_POST = 10  # number of detailed domain info packages to send per post
 DOMAIN_POST_INTERVAL = 5  # seconds
+COLLECT_WORKERS = 4  # every domain runs several plesk subprocesses, which mostly wait on I/O
 VERSION = '260712'
+VHOSTS_PATH = '/var/www/vhosts'
 
 plesk = cli(['which', 'plesk']).strip()
 if not plesk or ' ' in plesk:  # When no result, or some error which always contains at least one space.
@@ -27,8 +33,95 @@ def is_server_type():
     return re.search(r'version.*\d+\.\d+', result, re.I + re.DOTALL)
 
 
-def convert_domain_text_to_json(domain_info_lines: list) -> dict:
-    """Get the domain info as a number of lines and convert it to Python dict structure. An example of the text output:
+SECTION_UNDERLINE = re.compile(r'^(=|\*){3,}\s*$')
+WP_TOOLKIT_FIELD = re.compile(r'^(\S(?:.*?\S)?)(\s{2,})(.*)$')
+
+
+def _parse_sectioned(text, redact, split_field, item_separator):
+    """Parse Plesk's sectioned text in a single pass over the lines. A section starts with a title, underlined with
+    `===` or `***`. `split_field(line)` returns (key, value, value_start) for a field line, or None for a line which
+    continues the value of the previous field (or is free text when there is no previous field). With `item_separator`,
+    blank lines separate the items of a section (e.g. the plugins of a WordPress installation): such a section is a list
+    of dicts. A repeated field or section replaces the earlier one (the last wins), so every field is a string. Free
+    text is collected under the key 'text'. `redact(key, value)` is applied to every value, the returned text is the
+    input with the redacted values. A field line which is taken for a continuation line (e.g. because its
+    value is not aligned) is still redacted: continuation lines and free text pass `redact.redact_text` when the
+    redactor has it (see `sitekick.utils.Redactor`), a continuation line which it does not change passes
+    `redact(key, value)`. Every value is redacted once.
+    Return the structure and the (redacted) text."""
+    redact_text = getattr(redact, 'redact_text', None)
+    result = {}
+    output = []
+    current = result  # the dict the fields are added to
+    section = None  # the list of items of the current section, with item_separator
+    field = None  # the key of the last field of the current item, for continuation lines
+    lines = text.split('\n')
+    # Look one line ahead, to see whether a line is a section title:
+    for line, next_line in zip(lines, lines[1:] + ['']):
+        if SECTION_UNDERLINE.match(line):
+            output.append(line)
+            continue
+        if SECTION_UNDERLINE.match(next_line) and line.strip():
+            title = line.strip()
+            output.append(line)
+            current = {}
+            if item_separator:
+                section = []
+                result[title] = section
+            else:
+                result[title] = current
+            field = None
+            continue
+        if not line.strip():
+            output.append(line)
+            if item_separator and section is not None and current:
+                # The item is complete, the next field starts a new item:
+                section.append(current)
+                current = {}
+            field = None
+            continue
+        parsed = split_field(line)
+        if parsed is None:
+            redacted = redact_text(line) if redact_text is not None else line
+            if field is not None:
+                # A multi-line value, or a field line which does not look like one (fail-safe). The line is redacted
+                # once, so its pseudonyms are the same as in the text:
+                value = redacted if redacted != line or not redact else redact(field, line)
+                current[field] += '\n' + value
+                output.append(value)
+            else:
+                text_value = current.get('text')
+                current['text'] = redacted.strip() if text_value is None else text_value + '\n' + redacted.strip()
+                output.append(redacted)
+            continue
+        key, value, value_start = parsed
+        if redact:
+            # Pseudonymize the rest of the line, trailing whitespace included, like `Redactor.redact_text` does:
+            raw_value = line[value_start:]
+            redacted = redact(key, raw_value)
+            if redacted != raw_value:
+                line = line[:value_start] + redacted
+                value = redacted
+        current[key] = value
+        field = key
+        output.append(line)
+    if item_separator and section is not None and current:
+        section.append(current)
+    return result, '\n'.join(output)
+
+
+def _split_domain_info_field(line):
+    """`Key:   value` lines of `plesk bin domain --info`."""
+    key, separator, value = line.partition(':')
+    if not separator:
+        return None
+    value_start = len(key) + 1 + len(value) - len(value.lstrip())
+    return key.strip(), value.strip(), value_start
+
+
+def parse_domain_info(text, redact=None):
+    """Parse the output of `plesk bin domain --info` into a dict of sections, each a dict of fields. An example of the
+    text output:
 General
 =============================
 Domain name:                            sitekick.eu
@@ -38,15 +131,8 @@ Hosting
 =============================
 Hosting type:                           Physical hosting
 IP Address:                             145.131.8.226
-FTP Login:                              sitekick.eu_34gqrbu1k9m
-
-Web Users
-=============================
-Total :                                 0
-PHP support:                            0
 
-
-Must be converted to JSON:
+Is converted to:
 {
     "General": {
         "Domain name": "sitekick.eu",
@@ -56,19 +142,50 @@ Must be converted to JSON:
         "Hosting type": "Physical hosting",
         "IP Address": "..."
     }
-}"""
-    result = {}
-    current_section = None
-    prev_line = None
-    for line in domain_info_lines:
-        if line.startswith('==='):
-            current_section = prev_line
-            result[current_section] = {}
-        elif current_section and line and ':' in line:
-            key, value = line.split(':', 1)
-            result[current_section][key.strip()] = value.strip()
-        prev_line = line
-    return result
+}
+    A repeated field or section replaces the earlier one, free text lines (like the subscription information) are
+    joined under the key 'text'. Return the structure and the text, both with the values redacted by
+    `redact(key, value)`."""
+    return _parse_sectioned(text, redact, _split_domain_info_field, item_separator=False)
+
+
+def parse_wp_toolkit_raw(text, redact=None):
+    """Parse the raw output of `plesk ext wp-toolkit --info -format raw` into a dict with the fields of the installation
+    and a list of dicts per section (Plugins, Themes), one per plugin or theme:
+ID                                 2
+Name                               Sitekick
+
+Plugins
+***********************************
+Name                               akismet
+Status                             inactive
+
+Name                               hello
+Status                             active
+
+Is converted to:
+{"ID": "2", "Name": "Sitekick", "Plugins": [{"Name": "akismet", "Status": "inactive"}, {"Name": "hello", ...}]}
+    Lines which do not start at the key column continue the value of the previous field (like a plugin description).
+    Return the structure and the text, both with the values redacted by `redact(key, value)`."""
+    value_column = []
+
+    def split_field(line):
+        match = WP_TOOLKIT_FIELD.match(line)
+        if match is None:
+            return None
+        if not value_column:
+            value_column.append(match.start(3))
+        elif match.start(3) != value_column[0] and match.group(3):
+            # Not aligned to the value column: a continuation line with a double space in it:
+            return None
+        return match.group(1), match.group(3).rstrip(), match.start(3)
+
+    return _parse_sectioned(text, redact, split_field, item_separator=True)
+
+
+def convert_domain_text_to_json(domain_info_lines: list) -> dict:
+    """Get the domain info as a number of lines and convert it to Python dict structure, see `parse_domain_info`."""
+    return parse_domain_info('\n'.join(domain_info_lines))[0]
 
 
 def get_domains():
@@ -76,72 +193,259 @@ def get_domains():
     return [line.strip() for line in cli([plesk, 'bin', 'site', '--list']).split('\n') if line.strip()]
 
 
+# Bulk mode (config.PLESK_BULK_SQL): the info of all domains is read from the Plesk database with a few queries, instead
+# of starting `plesk bin domain --info` (a PHP runtime) for every domain. The columns are mapped to the fields of
+# `plesk bin domain --info`, with the same labels and value formats, but only a subset of the fields is in the database
+# tables read here: the General section, the hosting type, FTP login, PHP and SSL/TLS support of the Hosting section and
+# the document root. The result is marked with 'provider-mode': 'bulk-sql', so the server can tell it apart.
+BULK_QUERIES = {
+    'domains': "SELECT d.id, d.name, d.displayName, d.status, d.cr_date, d.htype, d.real_size, c.pname, c.login,"
+               " h.www_root, h.php_handler_id, h.php, h.ssl, s.login FROM domains d"
+               " LEFT JOIN clients c ON c.id = d.cl_id LEFT JOIN hosting h ON h.dom_id = d.id"
+               " LEFT JOIN sys_users s ON s.id = h.sys_user_id ORDER BY d.name",
+    'limits': "SELECT d.name, l.limit_name, l.value FROM domains d JOIN Limits l ON l.id = d.limits_id"
+              " WHERE l.limit_name IN ('expiration', 'disk_space', 'max_traffic') ORDER BY d.name, l.limit_name",
+}
+BULK_MODE = 'bulk-sql'
+HOSTING_TYPES = {'vrt_hst': 'Physical hosting', 'std_fwd': 'Standard forwarding', 'frm_fwd': 'Frame forwarding',
+                 'none': 'No hosting'}
+# The status is a bit mask, the first matching bit is shown:
+DOMAIN_STATUSES = {0: 'OK', 2: 'Disabled by backup/restore', 4: 'Under backup/restore',
+                   16: 'Suspended by administrator', 32: 'Suspended by reseller', 64: 'Suspended by customer',
+                   256: 'Expired'}
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+_bulk_info = None
+_bulk_lock = threading.Lock()
+
+
+def _unescape(value):
+    """Undo the escaping of `mysql --batch` output: a tab, newline and backslash in a value are written as \\t, \\n and
+    \\\\, NULL is None."""
+    if value == 'NULL':
+        return None
+    if '\\' not in value:
+        return value
+    return re.sub(r'\\(.)', lambda match: {'t': '\t', 'n': '\n', '0': '\0'}.get(match.group(1), match.group(1)),
+                  value)
+
+
+def query(sql):
+    """Run the query on the Plesk database and return the rows as lists of values."""
+    output = cli([plesk, 'db', '-sNe', sql], include_stderr=False)
+    return [[_unescape(value) for value in line.split('\t')] for line in output.split('\n') if line]
+
+
+def format_size(size):
+    """Format a number of bytes like Plesk: `0 B`, `5.13 KB`, `121 MB`."""
+    size = float(size or 0)
+    for unit in SIZE_UNITS:
+        if abs(size) < 1024 or unit == SIZE_UNITS[-1]:
+            break
+        size /= 1024
+    return f"{size:.2f}".rstrip('0').rstrip('.') + f" {unit}"
+
+
+def format_date(value):
+    """Format a date (`2023-10-20`, `2023-10-20 12:00:00` or a unix timestamp) like Plesk: `Oct 20, 2023`. The month
+    names do not depend on the locale."""
+    try:
+        if re.match(r'^\d+$', value):
+            date = datetime.datetime.utcfromtimestamp(int(value))
+        else:
+            date = datetime.datetime.strptime(value[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return value
+    return f"{MONTHS[date.month - 1]} {date.day}, {date.year}"
+
+
+def format_status(status):
+    """The text of the Plesk domain status bit mask."""
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return status
+    for bit, text in DOMAIN_STATUSES.items():
+        if bit and status & bit:
+            return text
+    return DOMAIN_STATUSES[0] if status == 0 else str(status)
+
+
+def _limit_value(name, value):
+    if value in (None, '-1'):
+        return 'Unlimited'
+    return format_date(value) if name == 'expiration' else format_size(value)
+
+
+def parse_bulk_info(domain_rows, limit_rows):
+    """Convert the rows of the `BULK_QUERIES` to the info of every domain, by domain name: the fields of
+    `plesk bin domain --info` which are in these tables (see `BULK_QUERIES`) and the PHP handler."""
+    limits = {}
+    for name, limit_name, value in limit_rows:
+        limits.setdefault(name, {})[limit_name] = value
+    domains = {}
+    for (domain_id, name, display_name, status, created, hosting_type, size, owner_name, owner_login,
+         www_root, php_handler, php, ssl, system_user) in domain_rows:
+        general = {
+            'Domain ID': domain_id,
+            'Domain name': display_name or name,
+            "Owner's contact name": f"{owner_name} ({owner_login})" if owner_login else owner_name,
+            'Domain status': format_status(status),
+            'Creation date': format_date(created),
+            'Expiration date': _limit_value('expiration', limits.get(name, {}).get('expiration')),
+            'Disk space limit': _limit_value('disk_space', limits.get(name, {}).get('disk_space')),
+            'Size': format_size(size),
+            'Traffic limit': _limit_value('max_traffic', limits.get(name, {}).get('max_traffic')),
+        }
+        info = {'General': general, 'Hosting': {'Hosting type': HOSTING_TYPES.get(hosting_type, hosting_type)}}
+        if www_root:
+            info['Hosting'].update({'FTP Login': system_user,
+                                    'SSL/TLS support': 'On' if ssl == 'true' else 'Off',
+                                    'PHP support': 'Yes' if php == 'true' else 'No'})
+            info['Logrotation info'] = {'--WWW-Root--': www_root}
+        domains[name] = {'info': info, 'php_handler': php_handler}
+    return domains
+
+
+def format_domain_info(info):
+    """Return the info as the text of `plesk bin domain --info`, the inverse of `parse_domain_info`."""
+    sections = []
+    for title, fields in info.items():
+        lines = [title, '=' * 29]
+        lines.extend(f"{key + ':':<40}{'' if value is None else value}" for key, value in fields.items())
+        sections.append('\n'.join(lines))
+    return '\n\n'.join(sections) + '\n'
+
+
+def get_bulk_info():
+    """Return the info of all domains, read from the Plesk database once per process (shared by the collect
+    workers)."""
+    global _bulk_info
+    with _bulk_lock:
+        if _bulk_info is None:
+            _bulk_info = parse_bulk_info(query(BULK_QUERIES['domains']), query(BULK_QUERIES['limits']))
+        return _bulk_info
+
+
+def reset_bulk_info():
+    """Forget the info read from the database, the next call of `get_bulk_info` reads it again."""
+    global _bulk_info
+    with _bulk_lock:
+        _bulk_info = None
+
+
+_plesk_version = None
+
+
+def get_plesk_version():
+    """The output of `plesk version`, which is the same for every domain."""
+    global _plesk_version
+    if _plesk_version is None:
+        _plesk_version = cli([plesk, 'version'])
+    return _plesk_version
+
+
+def _add_wp_toolkit(result, domain, domain_info, redact):
+    """Add the WordPress installation of the domain, from `plesk ext wp-toolkit`."""
+    domain_id = domain_info.get('General', {}).get('Domain ID')
+    absolute_path = domain_info.get('Logrotation info', {}).get('--WWW-Root--')
+    path = absolute_path.split(domain)[-1] if absolute_path else None
+    if domain_id and path:
+        domain_wp_plugin_info = cli(
+            [plesk, 'ext', 'wp-toolkit', '--info', '-main-domain-id', domain_id, '-path', path, '-format', 'raw'])
+        wp_toolkit, domain_wp_plugin_info = parse_wp_toolkit_raw(domain_wp_plugin_info, redact)
+        result['wp_plugins'] = domain_wp_plugin_info
+        if config.PLESK_PARSED_INFO:
+            result['wp-toolkit'] = wp_toolkit
+    return result
+
+
+def get_domain_info_bulk(domain):
+    """Get the information of the domain from the bulk queries, see `get_domain_info`. A domain which is not in the
+    bulk info (e.g. created during the run) is read with `plesk bin domain --info`."""
+    bulk = get_bulk_info().get(domain)
+    if bulk is None:
+        return _get_domain_info_cli(domain)
+    redact = get_redactor() if config.GDPR_COMPLIANT else None
+    domain_info = redact.redact(bulk['info']) if redact else bulk['info']
+    result = {
+        'Server': {'Hostname': identity.hostname, 'IP-address': identity.ip_address,
+                   'MAC-address': identity.mac_address},
+        'provider': 'plesk',
+        'provider-version': VERSION,
+        'provider-mode': BULK_MODE,
+        'plesk-version': get_plesk_version(),
+        'php-version': f"{domain}\t{bulk['php_handler']}\n" if bulk['php_handler'] else '',
+        'domain': domain,
+        'info': format_domain_info(domain_info),
+    }
+    if config.PLESK_PARSED_INFO:
+        result['info-parsed'] = domain_info
+    return _add_wp_toolkit(result, domain, domain_info, redact)
+
+
+def fingerprint_paths(domain):
+    """The files and directories which change when the domain changes: the web server and PHP configuration generated
+    by Plesk, and the WordPress core, plugins and themes."""
+    document_root = os.path.join(VHOSTS_PATH, domain, 'httpdocs')
+    return [os.path.join(VHOSTS_PATH, 'system', domain, 'conf'),
+            os.path.join(VHOSTS_PATH, 'system', domain, 'etc', 'php.ini'),
+            document_root,
+            os.path.join(document_root, 'wp-includes', 'version.php'),
+            os.path.join(document_root, 'wp-content', 'plugins'),
+            os.path.join(document_root, 'wp-content', 'themes')]
+
+
+def get_domain_fingerprint(domain):
+    """Return a change stamp of the domain from the modification times of its configuration files, without starting
+    `plesk`. Changes in Plesk which do not touch these files (like the limits) are picked up when the cached info
+    expires, see config.FINGERPRINT_MAX_AGE. None when the domain has no configuration files."""
+    stamps = []
+    for path in fingerprint_paths(domain):
+        try:
+            if os.path.isdir(path):
+                # A directory changes when a file in it is added, removed or replaced (like the generated configs):
+                entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+                stamps.extend(f"{entry.path}:{entry.stat().st_mtime_ns}:{entry.stat().st_size}" for entry in entries
+                              if entry.is_file())
+            stat = os.stat(path)
+            stamps.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        except OSError:
+            continue
+    if not stamps:
+        return None
+    return hashlib.sha256('\n'.join([VERSION] + stamps).encode('utf-8')).hexdigest()
+
+
 def get_domain_info(domain):
     """Get detailed information about the specified domain from the local Plesk server.
     When additional or different info is needed, change this function."""
+    if config.PLESK_BULK_SQL:
+        return get_domain_info_bulk(domain)
+    return _get_domain_info_cli(domain)
+
+
+def _get_domain_info_cli(domain):
     domain_info_text = cli([plesk, 'bin', 'domain', '--info', domain])
     # Add plesk info, quite ad hoc!!!
     domain_php_info = cli([plesk, 'db', '-sNe', "SELECT d.name, h.php_handler_id FROM domains d JOIN hosting h ON h.dom_id=d.id WHERE d.name='" + domain + "'"])
     plesk_version = cli([plesk, 'version'])
-    if config.GDPR_COMPLIANT:
-        def obfuscate_contact_name(match):
-            value = match.group(2)
-            if not value:
-                return match.group(1)
-            return match.group(1) + obfuscate(value, config.GDPR_PSK)
-
-        def obfuscate_admin_email(match):
-            value = match.group(2)
-            if not value:
-                return match.group(1)
-            return match.group(1) + obfuscate(value, config.GDPR_PSK)
-
-        domain_info_output = re.sub(
-            r"(Owner's contact name\s*:\s*)(.+)",
-            obfuscate_contact_name,
-            domain_info_text,
-            flags=re.IGNORECASE,
-        )
-        domain_info_output = re.sub(
-            r"(Administrator's email\s*:?\s*)(.+)",
-            obfuscate_admin_email,
-            domain_info_output,
-            flags=re.IGNORECASE,
-        )
-    else:
-        domain_info_output = domain_info_text
+    # Parse the text and pseudonymize the personal data in the same pass:
+    redact = get_redactor() if config.GDPR_COMPLIANT else None
+    domain_info, domain_info_output = parse_domain_info(domain_info_text, redact)
     result = {
-        'Server': {'Hostname': hostname, 'IP-address': ip_address, 'MAC-address': mac_address},
+        'Server': {'Hostname': identity.hostname, 'IP-address': identity.ip_address,
+                   'MAC-address': identity.mac_address},
         'provider': 'plesk',
         'provider-version': VERSION,
         'plesk-version': plesk_version,
         'php-version': domain_php_info,
         'domain': domain,
-        'info': domain_info_output
+        'info': domain_info_output,
     }
-    # Convert the text info to a valid JSON string:
-    domain_info = convert_domain_text_to_json(domain_info_text.split('\n'))
-    domain_id = domain_info.get('General', {}).get('Domain ID')
-    absolute_path = domain_info.get('Logrotation info', {}).get('--WWW-Root--')
-    path = absolute_path.split(domain)[-1] if absolute_path else None
-    if domain_id and path:
-        domain_wp_plugin_info = cli(
-            [plesk, 'ext', 'wp-toolkit', '--info', '-main-domain-id', domain_id, '-path', path, '-format', 'raw'])
-        if config.GDPR_COMPLIANT:
-            domain_wp_plugin_info = re.sub(
-                r"(Owner's contact name\s*:\s*)(.+)",
-                obfuscate_contact_name,
-                domain_wp_plugin_info,
-                flags=re.IGNORECASE,
-            )
-            domain_wp_plugin_info = re.sub(
-                r"(Administrator's email\s*:?\s*)(.+)",
-                obfuscate_admin_email,
-                domain_wp_plugin_info,
-                flags=re.IGNORECASE,
-            )
-        result['wp_plugins'] = domain_wp_plugin_info
-    return result
+    if config.PLESK_PARSED_INFO:
+        result['info-parsed'] = domain_info
+    return _add_wp_toolkit(result, domain, domain_info, redact)
 
 
 if __name__ == '__main__':
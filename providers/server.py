@@ -4,7 +4,7 @@ import subprocess
 import sys
 
 from sitekick import config
-from sitekick.utils import now, hostname, ip_address, mac_address
+from sitekick.utils import now, identity
 
 EXECUTE_PARALLEL = False
 DOMAIN_COUNT_PER_POST = 10
@@ -17,7 +17,7 @@ def is_server_type():
 
 def get_domains():
     """This is not a domain module, but only the data about this server."""
-    return [ip_address]
+    return [identity.ip_address]
 
 
 def get_domain_info(domain):
@@ -30,5 +30,6 @@ def get_domain_info(domain):
                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             result[command] = proc.stdout.decode().strip()
 
-    result.update({'ip': ip_address, 'mac': mac_address, 'hostname': hostname, 'now': now()})
+    result.update({'ip': identity.ip_address, 'mac': identity.mac_address, 'hostname': identity.hostname,
+                   'now': now()})
     return result
@@ -3,7 +3,9 @@ directory, and change the functions to suit your needs. The functions are:
 is_server_type()    Returns True-ish if the server on which the server is running, is of the appropriate type.
                     Returns False-ish or raise an error if not the specified type, so you can just call any function
                     to determine whether the server is of the appropriate type.
-get_domains()       Get all domains from the local hosting server. Return a complete list of domain names.
+get_domains()       Get all domains from the local hosting server. Return a list of domain names, or an iterator
+                    (e.g. a generator) when enumerating takes long, like paging through a control panel API. The
+                    info of the first domains is then collected while the enumeration continues.
 get_domain_info()   Get detailed information about the specified domain from the local hosting server.
                     Return a dictionary with the domain info. The domain name is added to the dictionary under the
                     key 'domain'. When additional or different info is needed, change this function.
@@ -12,11 +14,15 @@ It can also contain a number of optional constants, which can be used to change
 code. The constants are:
 EXECUTE_PARALLEL        Whether to execute the get_domains_info() and push_domains_info() calls in parallel. True when
                         not specified.
-DOMAIN_COUNT_PER_POST   Number of detailed domain info packages to send per post. Defaults to
-                        sitekick.send.DOMAIN_COUNT_PER_POST
-DOMAIN_POST_INTERVAL    Seconds, interval between posts. Defaults to sitekick.send.DOMAIN_POST_INTERVAL
+DOMAIN_COUNT_PER_POST   Number of detailed domain info packages to send in the first post. Defaults to
+                        sitekick.send.DOMAIN_COUNT_PER_POST. Later posts are limited by config.PUSH_BATCH_BYTES and
+                        adapted to the response time of the Sitekick server.
+DOMAIN_POST_INTERVAL    Seconds, interval between the starts of two posts, the first post waits for the slot of
+                        this server within it. Defaults to sitekick.send.DEFAULT_DOMAIN_POST_INTERVAL
+COLLECT_WORKERS         Number of domains for which get_domain_info() is called concurrently. Useful when a call mostly
+                        waits on subprocesses or I/O. 1 (serial) when not specified, overridden by --collect-workers.
 """
-from sitekick.utils import now, hostname, ip_address, mac_address
+from sitekick.utils import now, identity
 
 EXECUTE_PARALLEL = False
 DOMAIN_COUNT_PER_POST = 20  # Count and interval are optionally specified per module
@@ -27,7 +33,7 @@ def is_server_type():
     Any non-False suffices, but extra information (like the server type and version) can be returned.
     E.g. when on a plesk-server the code `providers.plesk.is_server_type() is called, it returns a string with
     the version info."""
-    return hostname == 'zh-dev-omni-001'
+    return identity.hostname == 'zh-dev-omni-001'
 
 
 def get_domains():
@@ -293,4 +299,5 @@ def get_domain_info(domain):
     return data
     import time
     # time.sleep(0.01)
-    return {'domain': domain, 'ip': ip_address, 'mac': mac_address, 'hostname': hostname, 'now': now()}
+    return {'domain': domain, 'ip': identity.ip_address, 'mac': identity.mac_address, 'hostname': identity.hostname,
+            'now': now()}
@@ -0,0 +1,40 @@
+"""Adaptive batch sizes for pushing domain info packages. The size of a package varies from a few KB to several hundred
+KB, so a fixed number of packages per POST is either too small for small packages or too large for large ones.
+The batcher limits a batch by a byte budget and adjusts the number of packages to the measured response time:
+a fast response grows the batch by one package, a slow response shrinks it by a quarter and an error halves it.
+A package that exceeds the byte budget on its own is sent in a batch of one.
+"""
+from sitekick import config
+
+
+class AdaptiveBatcher:
+    """Select the number of packages for the next POST and adjust it with `record()` after every POST."""
+
+    def __init__(self, count, byte_budget=None, target_latency=None, max_count=None):
+        self.byte_budget = byte_budget or config.PUSH_BATCH_BYTES
+        self.target_latency = target_latency or config.PUSH_TARGET_LATENCY
+        self.max_count = max(max_count or config.PUSH_MAX_BATCH_COUNT, 1)
+        self.count = min(max(int(count), 1), self.max_count)
+        self.bytes = self.byte_budget
+
+    def select(self, sizes):
+        """Return the number of leading packages with the given sizes (in bytes) which fit in the next batch. At least
+        one package is selected when there is one, so a single huge package is sent on its own."""
+        total = 0
+        for size_count, size in enumerate(sizes[:self.count]):
+            total += size
+            if size_count and total > self.bytes:
+                return size_count
+        return min(len(sizes), self.count)
+
+    def record(self, latency, ok=True):
+        """Adjust the batch to the result of the last POST, which took `latency` seconds."""
+        if not ok:
+            self.count = max(self.count // 2, 1)
+            self.bytes = max(self.bytes // 2, 1)
+        elif latency > self.target_latency:
+            self.count = max(self.count * 3 // 4, 1)
+            self.bytes = max(self.bytes * 3 // 4, 1)
+        elif latency < self.target_latency / 2:
+            self.count = min(self.count + 1, self.max_count)
+            self.bytes = min(self.bytes * 5 // 4 + 1, self.byte_budget)
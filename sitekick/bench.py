@@ -0,0 +1,166 @@
+"""End-to-end benchmark of the pipeline: collect the synthetic domain info of `providers.test_body` into a temporary
+queue, then push it to a local copy of the echo server in `test_server.py`. Reports the domains/sec per stage, the bytes
+on disk and on the wire, the POST latency percentiles and the peak RSS, so settings (collect workers, batch size, POSTs
+in flight, compression, queue backend) can be compared before rolling them out. The pacing of the POSTs and the
+governor are turned off during the bench, so it measures the collector and the pusher rather than their caps.
+"""
+import contextlib
+import io
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows:
+    resource = None
+
+from sitekick import config
+from sitekick.metrics import metrics
+from sitekick.queues import split_queue_path
+from sitekick.send import get_domains_info, push_domains_info
+from sitekick.throttle import governor
+from sitekick.utils import now
+from providers import test_body
+from test_server import EchoHandler
+
+# The settings during the bench: no caps on the POSTs and the collection, and the digests of the real runs are kept:
+BENCH_CONFIG = {'DELTA_MODE': False, 'PUSH_MAX_REQUESTS_PER_SECOND': None, 'PUSH_MAX_BYTES_PER_SECOND': None,
+                'GOVERNOR_MAX_LOAD': None, 'GOVERNOR_MAX_IO_PRESSURE': None}
+
+class BenchHandler(EchoHandler):
+    """The echo handler with keep-alive and without output, which counts the POSTs and their bytes on the wire."""
+    protocol_version = 'HTTP/1.1'
+    quiet = True
+
+    def _read_body(self):
+        body = super()._read_body()
+        with self.server.lock:
+            self.server.post_count += 1
+            self.server.wire_bytes += len(body)
+        return body
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is not available before Python 3.7:
+    daemon_threads = True
+
+
+class BenchServer(_Server):
+    def __init__(self):
+        self.post_count = 0
+        self.wire_bytes = 0
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), BenchHandler)
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes, None when it cannot be determined."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes:
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def disk_usage(queue_path):
+    """Return the number of bytes used by the queue: the files in the queue directory, or the database files."""
+    scheme, path = split_queue_path(queue_path)
+    if scheme == 'sqlite':
+        files = path.parent.glob(f"{path.name}*")
+    else:
+        files = path.rglob('*')
+    return sum(filename.stat().st_size for filename in files if filename.is_file())
+
+
+def parse_flag(value):
+    """Return the flag from the command line (e.g. `1`, `yes`, `0`, `false`) as a boolean."""
+    if isinstance(value, str):
+        return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+    return bool(value)
+
+
+def run_bench(domain_count=1000, concurrency=None, batch_size=20, verbose=False):
+    """Collect and push `domain_count` synthetic domains, with `concurrency` collect workers (default: the configured
+    collect workers) and a first batch of `batch_size` domains. The other settings are taken from the config, except
+    for the pacing and the governor, which are turned off (see `BENCH_CONFIG`). The queue backend of the configured
+    queue path is used in a temporary location. With `verbose`, the output of the pipeline is shown. Return the report
+    as a dictionary."""
+    domain_count = int(domain_count)
+    workers = int(concurrency or config.COLLECT_WORKERS or 1)
+    batch_size = int(batch_size)
+    verbose = parse_flag(verbose)
+    domains = [f"bench-{i:06}.example" for i in range(domain_count)]
+    server = BenchServer()
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True).start()
+    temp_dir = Path(tempfile.mkdtemp(prefix='sitekick-bench-'))
+    scheme = split_queue_path(config.QUEUE_PATH)[0]
+    queue_path = f"sqlite://{temp_dir / 'queue.db'}" if scheme == 'sqlite' else str(temp_dir / 'domains')
+    # Push to the local server, with the settings of the bench:
+    saved = {name: getattr(config, name) for name in ('SITEKICK_PUSH_URL', *BENCH_CONFIG)}
+    config.SITEKICK_PUSH_URL = f"http://127.0.0.1:{server.server_address[1]}/push"
+    for name, value in BENCH_CONFIG.items():
+        setattr(config, name, value)
+    governor.reset()
+    metrics.reset()
+    output = sys.stdout if verbose else io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            started = time.time()
+            get_domains_info(domains, test_body.get_domain_info, queue_path=queue_path, show_progress=False,
+                             workers=workers, limit=None)
+            collected = time.time()
+            disk_bytes = disk_usage(queue_path)
+            push_domains_info(queue_path=queue_path, count=batch_size)
+            pushed = time.time()
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+        governor.reset()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(str(temp_dir), ignore_errors=True)
+    latency = metrics.timer_stats('post') or {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    report = {
+        'domains': domain_count,
+        'collect_workers': workers,
+        'batch_size': batch_size,
+        'push_in_flight': config.PUSH_IN_FLIGHT,
+        'compression': config.PUSH_COMPRESSION,
+        'queue': scheme or 'directory',
+        'collect_seconds': collected - started,
+        'push_seconds': pushed - collected,
+        'collect_domains_per_second': domain_count / max(collected - started, 1e-9),
+        'push_domains_per_second': domain_count / max(pushed - collected, 1e-9),
+        'total_domains_per_second': domain_count / max(pushed - started, 1e-9),
+        'disk_bytes': disk_bytes,
+        'wire_bytes': server.wire_bytes,
+        'posts': server.post_count,
+        'latency_p50': latency['p50'],
+        'latency_p95': latency['p95'],
+        'latency_p99': latency['p99'],
+        'peak_rss': peak_rss(),
+    }
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    print(f"{now()} Sitekick bench: {report['domains']} domains, {report['collect_workers']} collect workers,"
+          f" first batch {report['batch_size']}, {report['push_in_flight']} POSTs in flight,"
+          f" compression {report['compression'] or 'none'}, {report['queue']} queue")
+    print(f"  collect: {report['collect_domains_per_second']:10.1f} domains/sec ({report['collect_seconds']:.2f} s)")
+    print(f"  push:    {report['push_domains_per_second']:10.1f} domains/sec ({report['push_seconds']:.2f} s)")
+    print(f"  total:   {report['total_domains_per_second']:10.1f} domains/sec")
+    print(f"  bytes on disk: {report['disk_bytes']}, bytes on the wire: {report['wire_bytes']}"
+          f" in {report['posts']} POSTs")
+    print(f"  POST latency: p50 {report['latency_p50'] * 1000:.1f} ms, p95 {report['latency_p95'] * 1000:.1f} ms,"
+          f" p99 {report['latency_p99'] * 1000:.1f} ms")
+    if report['peak_rss'] is not None:
+        print(f"  peak RSS: {report['peak_rss'] / 1048576:.1f} MB")
@@ -0,0 +1,49 @@
+"""Build the script as a single file: a zipapp (`python3 -m zipapp`) with the script as `__main__.py`, the `sitekick`
+and `providers` packages and the echo server of the `bench` command. Every module is added with its bytecode, compiled
+at build time, so a run from the archive does not compile anything, also when the code is on a read-only or noexec file
+system where no `.pyc` files can be written. Build with the `python3` of the servers: the bytecode of another Python
+version is ignored (the module is then compiled in memory on every run, as without the bytecode).
+"""
+import py_compile
+import shutil
+import tempfile
+import zipapp
+from pathlib import Path
+
+BUILD_FILENAME = 'domains-to-sitekick.pyz'
+SCRIPT_FILENAME = 'domains-to-sitekick.py'
+PACKAGES = ('sitekick', 'providers')
+MODULES = ('test_server.py',)  # the echo server, used by the `bench` command
+INTERPRETER = '/usr/bin/env python3'
+
+
+def compile_module(source, dfile):
+    """Compile the module to a `.pyc` next to the source, where zipimport looks for it. The bytecode is not checked
+    against the source (which cannot change inside the archive), so the timestamps in the archive do not matter.
+    `dfile` is the file name in tracebacks: the path in the archive, not the temporary build directory."""
+    options = {}
+    if hasattr(py_compile, 'PycInvalidationMode'):
+        options['invalidation_mode'] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    py_compile.compile(str(source), cfile=str(source.with_suffix('.pyc')), dfile=dfile, doraise=True, **options)
+
+
+def build_zipapp(target=None):
+    """Build the zipapp at `target` (default: `domains-to-sitekick.pyz` next to the script) and return its path. Run
+    it like the script: `python3 domains-to-sitekick.pyz send`."""
+    root = Path(__file__).parent.parent
+    target = Path(target) if target else root / BUILD_FILENAME
+    with tempfile.TemporaryDirectory() as temp_dir:
+        staging = Path(temp_dir)
+        shutil.copyfile(str(root / SCRIPT_FILENAME), str(staging / '__main__.py'))
+        for package in PACKAGES:
+            (staging / package).mkdir()
+            for source in sorted((root / package).glob('*.py')):
+                shutil.copyfile(str(source), str(staging / package / source.name))
+        for module in MODULES:
+            shutil.copyfile(str(root / module), str(staging / module))
+        for source in sorted(staging.rglob('*.py')):
+            compile_module(source, f"{target.name}/{source.relative_to(staging).as_posix()}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        zipapp.create_archive(str(staging), str(target), interpreter=INTERPRETER)
+    print(f"Built {target}")
+    return target
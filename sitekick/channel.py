@@ -0,0 +1,80 @@
+"""In-memory handoff of domain info records from the collector to the pusher, when both run in parallel. Records go
+straight from the collector to the pusher without touching the disk. The channel is bounded: when it is full, or when
+the pusher marked the Sitekick server as unreachable, the collector spills the record to the on-disk queue instead, so
+the collector never waits for the pusher. The collector closes the channel to signal the end of the stream.
+A record is only stored once it is written to the queue or accepted by the Sitekick server, not while it is in the
+channel or waiting to be pushed: `on_stored(record)` is called at that moment (e.g. to complete it in the checkpoint).
+"""
+import queue
+import threading
+
+
+class Channel:
+    """A bounded channel of `sitekick.queues.Record`s from one collector to one pusher."""
+
+    def __init__(self, maxsize=200, on_stored=None):
+        self._records = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self.unreachable = threading.Event()
+        self.spilled = 0
+        self.on_stored = on_stored
+
+    def _stored(self, record):
+        if self.on_stored is not None:
+            self.on_stored(record)
+
+    def put(self, record, spill):
+        """Hand the record to the pusher. When the channel is full or the pusher cannot reach the Sitekick server,
+        call `spill(record)` to store it on disk instead. Return True when the record was handed over."""
+        if not self.unreachable.is_set():
+            try:
+                self._records.put_nowait(record)
+                return True
+            except queue.Full:
+                pass
+        spill(record)
+        self._stored(record)
+        self.spilled += 1
+        return False
+
+    def acknowledged(self, records):
+        """The pusher pushed the records: those taken from the channel (without a queue key) are stored now."""
+        for record in records:
+            if record.key is None:
+                self._stored(record)
+
+    def close(self):
+        """Signal the end of the stream: no more records will be put."""
+        self._closed.set()
+
+    @property
+    def finished(self):
+        """True when the channel is closed and all records have been taken."""
+        return self._closed.is_set() and self._records.empty()
+
+    def get(self, count, block=True):
+        """Take at most `count` records. With `block`, wait for the first record until the channel is finished.
+        Return an empty list at the end of the stream (or when not blocking and no record is available)."""
+        records = []
+        while block and not records and not self.finished:
+            try:
+                records.append(self._records.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        while len(records) < count:
+            try:
+                records.append(self._records.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def spill_remaining(self, records, spill):
+        """The Sitekick server is unreachable: let the collector spill from now on, and spill the records taken from the
+        channel but not pushed (those without a queue key), followed by all records still in the channel."""
+        self.unreachable.set()
+        records = [record for record in records if record.key is None]
+        while records:
+            for record in records:
+                spill(record)
+                self._stored(record)
+            records = self.get(100)
@@ -0,0 +1,103 @@
+"""Checkpoints of a collection run, so a run which is killed (out of memory, a reboot, the next cron run) continues
+where it stopped instead of collecting every domain again.
+The checkpoint is a file next to the queue (`domains.checkpoint` for the queue directory `domains`). The first line
+holds the run id, the fingerprint of the domain list and the start of the run, every next line a completed domain. Lines
+are only appended, so a crash while writing loses at most the last (partial) line.
+A run resumes the checkpoint when the domain list has the same fingerprint and the checkpoint is younger than
+`config.CHECKPOINT_MAX_AGE` seconds. The domains keep their index in the domain list, so their queue files have the same
+names as in the interrupted run. The checkpoint is removed when the run completes.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from sitekick import config
+from sitekick.queues import queue_location
+
+
+def checkpoint_path(queue_path=None):
+    """Return the path of the checkpoint of the queue at `queue_path`."""
+    location = queue_location(queue_path)
+    return location.with_name(f"{location.name}.checkpoint")
+
+
+def domains_fingerprint(domains, salt=''):
+    """Return the fingerprint of the domain list, which changes when a domain is added, removed or moved. The `salt`
+    distinguishes runs over the same list which collect different domains (like another shard)."""
+    digest = hashlib.sha256(salt.encode('utf-8'))
+    for domain in domains:
+        digest.update(str(domain).strip().lower().encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """The completed domains of a run. Use `Checkpoint.start()` to resume or start a checkpoint."""
+
+    def __init__(self, path, run_id, fingerprint, created, completed=()):
+        self.path = path
+        self.run_id = run_id
+        self.fingerprint = fingerprint
+        self.created = created
+        self.completed = set(completed)
+        self.resumed = bool(self.completed)
+        self._file = None
+        # The pusher completes the records it pushed from a channel, in its own thread:
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """Return the checkpoint stored at `path`, None when there is none or it cannot be read."""
+        try:
+            with path.open(encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                lines = f.read().split('\n')
+        except Exception:
+            return None
+        if not isinstance(header, dict) or not {'run_id', 'fingerprint', 'created'} <= set(header):
+            return None
+        # The last line is only complete when it ends with a newline:
+        return cls(path, header['run_id'], header['fingerprint'], header['created'], lines[:-1])
+
+    @classmethod
+    def start(cls, queue_path, domains, max_age=None, resume=True, salt=''):
+        """Resume the checkpoint of the queue when it is for the same domain list (and `salt`) and not older than
+        `max_age` seconds (default: `config.CHECKPOINT_MAX_AGE`), else start a new checkpoint."""
+        path = checkpoint_path(queue_path)
+        max_age = config.CHECKPOINT_MAX_AGE if max_age is None else max_age
+        fingerprint = domains_fingerprint(domains, salt)
+        checkpoint = cls.load(path) if resume else None
+        if checkpoint is None or checkpoint.fingerprint != fingerprint or time.time() - checkpoint.created > max_age:
+            checkpoint = cls(path, uuid.uuid4().hex, fingerprint, time.time())
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open('w', encoding='utf-8') as f:
+                f.write(json.dumps({'run_id': checkpoint.run_id, 'fingerprint': fingerprint,
+                                    'created': checkpoint.created}) + '\n')
+        checkpoint._file = path.open('a', encoding='utf-8')
+        return checkpoint
+
+    def complete(self, domain):
+        """Record that the domain is collected (queued, pushed, or skipped because it did not change). Ignored when the
+        checkpoint is closed."""
+        with self._lock:
+            if self._file is None:
+                return
+            self.completed.add(domain)
+            self._file.write(domain + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Close the checkpoint and keep it, for a next run to resume."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        """The run is complete: remove the checkpoint."""
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
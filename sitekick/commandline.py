@@ -11,15 +11,39 @@ parser = argparse.ArgumentParser(
     description='Domains to Sitekick commandline interface',
     epilog='For more information, see https://github.com/yourapi/server-to-sitekick#readme')
 parser.add_argument('command', action='store', nargs='?', default='send', help='Command to execute',
-                    choices=['send', 'install', 'test', 'debug'])
+                    choices=['send', 'install', 'test', 'debug', 'bench', 'build'])
 parser.add_argument('args', action='store', nargs='*', help='Arguments for the specified command')
 parser.add_argument('--version', action='version', version='%(prog)s 0.2')
 parser.add_argument('--config-path', default=config.CONFIG_PATH, 
                     help=f'Path to configuration directory (default: {config.CONFIG_PATH})')
 parser.add_argument('--queue-path', default=config.QUEUE_PATH,
-                    help=f'Path to queue directory (default: {config.QUEUE_PATH})')
+                    help=f'Path to queue directory, or sqlite:///path/to/queue.db for a SQLite queue '
+                         f'(default: {config.QUEUE_PATH})')
 parser.add_argument('--sitekick-url', default=config.SITEKICK_PUSH_URL,
                     help=f'Sitekick push URL (default: {config.SITEKICK_PUSH_URL})')
+parser.add_argument('--collect-workers', type=int, default=config.COLLECT_WORKERS,
+                    help='Number of domains to collect concurrently '
+                         '(default: the COLLECT_WORKERS of the provider, or 1)')
+parser.add_argument('--push-compression', choices=['none', 'gzip', 'deflate'], default=config.PUSH_COMPRESSION,
+                    help='Compress the POST bodies (default: none). Falls back to uncompressed when not supported')
+parser.add_argument('--parallel-providers', action='store_true', default=config.PARALLEL_PROVIDERS,
+                    help='Run all valid providers concurrently (default: one after another)')
+parser.add_argument('--max-concurrency', type=int, default=config.MAX_CONCURRENCY,
+                    help=f'Maximum number of concurrent get_domain_info calls over all concurrently running providers '
+                         f'(default: {config.MAX_CONCURRENCY})')
+parser.add_argument('--push-in-flight', type=int, default=config.PUSH_IN_FLIGHT,
+                    help=f'Number of POSTs to the Sitekick server in flight at the same time '
+                         f'(default: {config.PUSH_IN_FLIGHT})')
+parser.add_argument('--metrics-path', default=config.METRICS_PATH,
+                    help='Directory for the JSON run report and the Prometheus textfile (default: next to the queue)')
+parser.add_argument('--max-load', type=float, default=config.GOVERNOR_MAX_LOAD,
+                    help=f'Load average per CPU above which the collection slows down, 0 to never slow down '
+                         f'(default: {config.GOVERNOR_MAX_LOAD})')
+parser.add_argument('--shards', type=int, default=config.SHARDS,
+                    help=f'Split the domains in this number of shards and collect one shard per run '
+                         f'(default: {config.SHARDS})')
+parser.add_argument('--shard', type=int, default=config.SHARD,
+                    help='The shard to collect (default: the shard of the current hour)')
 parser.add_argument('--enable-autoupdate', action='store_true', default=config.ENABLE_AUTOUPDATE,
                     help='Enable automatic updates (default: disabled)')
 gdpr_group = parser.add_mutually_exclusive_group()
@@ -29,6 +53,11 @@ gdpr_group.add_argument('--no-gdpr-compliant', dest='gdpr_compliant', action='st
                         help='Disable GDPR compliant behavior')
 parser.add_argument('--gdpr-psk', default=config.GDPR_PSK,
                     help='Pre-shared key used for GDPR HMAC (default: configured value)')
+delta_group = parser.add_mutually_exclusive_group()
+delta_group.add_argument('--delta', dest='delta_mode', action='store_true',
+                         help='Only push domains whose info changed since the last accepted push (default: disabled)')
+delta_group.add_argument('--no-delta', dest='delta_mode', action='store_false',
+                         help='Push all domains')
 system_info_group = parser.add_mutually_exclusive_group()
 system_info_group.add_argument('--system-info', dest='system_info', action='store_true',
                                help='Enable system info collection (default: enabled)')
@@ -36,6 +65,7 @@ system_info_group.add_argument('--no-system-info', dest='system_info', action='s
                                help='Disable system info collection')
 parser.set_defaults(system_info=config.SYSTEM_INFO)
 parser.set_defaults(gdpr_compliant=config.GDPR_COMPLIANT)
+parser.set_defaults(delta_mode=config.DELTA_MODE)
 
 
 def send(*args):
@@ -54,13 +84,36 @@ def debug(*args):
     """Debug the send-domains-to-sitekick script."""
     send_domains(*args, filter_modules=lambda name: name == 'debug')
 
+def bench(*args):
+    """Benchmark the pipeline end to end with synthetic domains and a local server. Arguments: the number of domains,
+    the number of collect workers and the number of domains in the first batch."""
+    # The bench uses the test provider and the echo server, only import them when benchmarking:
+    from sitekick.bench import run_bench
+    run_bench(*args)
+
+def build(*args):
+    """Build the script with its packages as a single file, a zipapp with precompiled bytecode. Argument: the path of
+    the archive."""
+    from sitekick.build import build_zipapp
+    build_zipapp(*args)
+
 def execute(args):
     """Execute the specified command."""
     config.CONFIG_PATH = args.config_path
     config.QUEUE_PATH = args.queue_path
     config.SITEKICK_PUSH_URL = args.sitekick_url
+    config.COLLECT_WORKERS = args.collect_workers
+    config.PARALLEL_PROVIDERS = args.parallel_providers
+    config.MAX_CONCURRENCY = args.max_concurrency
+    config.PUSH_IN_FLIGHT = args.push_in_flight
+    config.METRICS_PATH = args.metrics_path
+    config.GOVERNOR_MAX_LOAD = args.max_load
+    config.SHARDS = args.shards
+    config.SHARD = args.shard
+    config.PUSH_COMPRESSION = None if args.push_compression == 'none' else args.push_compression
     config.ENABLE_AUTOUPDATE = args.enable_autoupdate
     config.SYSTEM_INFO = args.system_info
     config.GDPR_COMPLIANT = args.gdpr_compliant
     config.GDPR_PSK = args.gdpr_psk
+    config.DELTA_MODE = args.delta_mode
     exec(f"{args.command}(*{args.args})")
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Compression of the POST bodies sent to the Sitekick server. The `plesk domain --info` text and the raw wp-toolkit
+output are very repetitive, so they compress well. Two content encodings are supported:
+gzip        Standard gzip (RFC 1952).
+deflate     zlib format (RFC 1950). Optionally with a preset dictionary of text that occurs in nearly every Plesk domain
+            info package, which helps most for small batches. The dictionary is identified by the header
+            `X-Sitekick-Dictionary`, so the server can select the same dictionary for decompression.
+"""
+import gzip
+import hashlib
+import json
+import zlib
+
+ENCODINGS = ('gzip', 'deflate')
+DICTIONARY_HEADER = 'X-Sitekick-Dictionary'
+
+
+def _build_plesk_dictionary():
+    """Build the preset dictionary from the fixed parts of a typical Plesk domain info package, as they appear in the
+    JSON body (with escaped newlines). zlib reaches the end of the dictionary with the shortest distances, so the most
+    frequent strings are placed last."""
+    info_sections = {
+        'Logrotation info': ['Log rotation status', 'Log rotation condition', 'Maximum number of log files',
+                             'Compress log files', 'Send processed log files to email'],
+        'Mailing Lists': ['Mailing list service', 'Total ', 'Total size'],
+        'Mail Accounts': ['Mail service', 'Total ', 'Access to Plesk', 'Mailboxes', 'Mail forwardings',
+                          'Auto-replies', 'Total size', 'Mail autodiscover'],
+        'Web Users': ['Total ', 'SSI support', 'PHP support', 'CGI support', 'Perl support', 'Python support',
+                      'FastCGI support', 'Total size'],
+        'Hosting': ['Hosting type', 'IP Address', 'FTP Login', 'FTP Password', 'Hard disk quota',
+                    'Disk space used by httpdocs', 'Certificate', 'SSL/TLS support', 'SSI support', 'PHP support',
+                    'CGI support', 'Perl support', 'Python support', 'FastCGI support', 'Custom error documents',
+                    'Web statistics', 'Anonymous FTP', 'Disk space used by Anonymous FTP'],
+        'General': ['Domain ID', 'Domain name', "Owner's contact name", 'Domain status', 'Creation date',
+                    'Expiration date', 'Disk space limit', 'Size', 'Traffic limit', 'Traffic', 'Description',
+                    'Description for the administrator', 'External ID'],
+    }
+    wp_sections = {
+        'Themes': ['Name', 'Status', 'Version', 'Title', 'Description', 'Autoupdates', 'Source identity'],
+        'Plugins': ['Name', 'Status', 'Version', 'Title', 'Description', 'Latest Version', 'Autoupdates',
+                    'Source identity', 'Blocked'],
+    }
+    wp_main = ['ID', 'Main Domain ID', 'Installation Path', 'Owner ID', 'GUID', 'State', 'Website URL', 'Login URL',
+               'Name', 'Version', "Administrator's email", 'Automatic updates', 'Search Engine Indexing',
+               'Security Status', 'SSL/TLS', 'Full Path']
+    lines = ['Subscription Information', '=' * 30, '--WWW-Root--: /var/www/vhosts/', 'Unlimited', 'SUCCESS: Gathering '
+             "information for '' completed.", 'active', 'inactive', 'true', 'false']
+    for section, keys in info_sections.items():
+        lines += ['', section, '=' * 29] + [f"{key}:".ljust(40) for key in keys]
+    lines += [key.ljust(35) for key in wp_main]
+    for section, keys in wp_sections.items():
+        lines += ['', section, '*' * 35] + [key.ljust(35) for key in keys]
+    text = json.dumps('\n'.join(lines))[1:-1]
+    envelope = ('{"data": [{"Server": {"Hostname": "", "IP-address": "", "MAC-address": ""}, "provider": "plesk", '
+                '"provider-version": "", "plesk-version": "", "php-version": "", "domain": "", "info": "", '
+                '"wp_plugins": "", "meta": {"type": "plesk", "domain": "", "hostname": "", "ip": "", '
+                '"timestamp": "", "mac": ""}}')
+    return (text + envelope).encode('utf-8')
+
+
+PLESK_DICTIONARY = _build_plesk_dictionary()
+DICTIONARY_ID = 'plesk-' + hashlib.sha256(PLESK_DICTIONARY).hexdigest()[:12]
+DICTIONARIES = {DICTIONARY_ID: PLESK_DICTIONARY}
+
+
+def compress_body(body, encoding=None, dictionary=False):
+    """Compress the body with the content encoding. Return the (compressed) body and the extra headers for the request.
+    No or an unknown encoding returns the body unchanged, without extra headers."""
+    if encoding == 'gzip':
+        return gzip.compress(body), {'Content-Encoding': 'gzip'}
+    if encoding == 'deflate':
+        if dictionary:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, zlib.MAX_WBITS,
+                                          zdict=PLESK_DICTIONARY)
+            return (compressor.compress(body) + compressor.flush(),
+                    {'Content-Encoding': 'deflate', DICTIONARY_HEADER: DICTIONARY_ID})
+        return zlib.compress(body), {'Content-Encoding': 'deflate'}
+    return body, {}
+
+
+def decompress_body(body, encoding=None, dictionary_id=None):
+    """Decompress a body compressed by `compress_body`. Raise ValueError for an unknown encoding or dictionary."""
+    if not encoding or encoding == 'identity':
+        return body
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        if dictionary_id:
+            if dictionary_id not in DICTIONARIES:
+                raise ValueError(f"Unknown compression dictionary {dictionary_id}")
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=DICTIONARIES[dictionary_id])
+            return decompressor.decompress(body) + decompressor.flush()
+        return zlib.decompress(body)
+    raise ValueError(f"Unknown content encoding {encoding}")
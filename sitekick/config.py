@@ -8,4 +8,81 @@ ENABLE_AUTOUPDATE = False
 SYSTEM_INFO = False
 GDPR_COMPLIANT = False
 GDPR_PSK="your-very-secret-psk-for-hmac"
+# Fields with personal data in the output of the control panels, pseudonymized when GDPR_COMPLIANT is set:
+GDPR_FIELDS = ["Owner's contact name", "Administrator's email"]
+# Number of domains to collect concurrently. None: use the COLLECT_WORKERS of the provider, or 1 (serial):
+COLLECT_WORKERS = None
+# Delta mode: only push domains whose info changed since the last accepted push, but resend all every N days:
+DELTA_MODE = False
+DELTA_RESEND_DAYS = 7
+# Compression of the POST bodies: None, 'gzip' or 'deflate'. The preset dictionary is only used with 'deflate':
+PUSH_COMPRESSION = None
+PUSH_COMPRESSION_DICTIONARY = False
+# Timeouts in seconds for connecting to the Sitekick server and for waiting for its response:
+PUSH_CONNECT_TIMEOUT = 10
+PUSH_READ_TIMEOUT = 120
+# Adaptive batches: at most this many bytes (uncompressed) and domains per POST, adapted to the response time:
+PUSH_BATCH_BYTES = 1000000
+PUSH_MAX_BATCH_COUNT = 100
+PUSH_TARGET_LATENCY = 5.0
+# Number of domain info records kept in memory between a parallel collector and pusher, before spilling to the queue:
+CHANNEL_SIZE = 200
+# Run the valid providers concurrently, with at most MAX_CONCURRENCY get_domain_info calls at the same time:
+PARALLEL_PROVIDERS = False
+MAX_CONCURRENCY = 8
+# Backoff between the attempts of a POST: a random time up to PUSH_BACKOFF_BASE seconds, doubled per attempt, at most
+# PUSH_BACKOFF_MAX seconds. A Retry-After of the Sitekick server is honored up to PUSH_MAX_RETRY_AFTER seconds:
+PUSH_BACKOFF_BASE = 1
+PUSH_BACKOFF_MAX = 60
+PUSH_MAX_RETRY_AFTER = 900
+# After a 429 or 503 response, the POSTs per second are halved (at least PUSH_MIN_RATE) and increased by
+# PUSH_RATE_INCREASE for every accepted POST:
+PUSH_MIN_RATE = 0.01
+PUSH_RATE_INCREASE = 0.05
+# Caps of the POSTs per second and the bytes per second to the Sitekick server (None: no cap). Unused budget is carried
+# over, up to PUSH_BURST_SECONDS seconds of budget:
+PUSH_MAX_REQUESTS_PER_SECOND = 5
+PUSH_MAX_BYTES_PER_SECOND = 2000000
+PUSH_BURST_SECONDS = 10
+# Number of POSTs to the Sitekick server in flight at the same time. Above 1, the asynchronous push engine is used:
+PUSH_IN_FLIGHT = 1
+# Directory for the JSON run report and the Prometheus textfile (e.g. the textfile collector directory of the node
+# exporter). None: next to the queue:
+METRICS_PATH = None
+# Seconds to trust the cached list of providers which match this host (the provider registry), 0 disables the cache:
+PROVIDER_REGISTRY_TTL = 3600
+# Seconds to wait for the resolver when determining the IP address of this host, and seconds after which the cached
+# host identity (host name, IP and MAC address) is determined again:
+RESOLVER_TIMEOUT = 2.0
+IDENTITY_REFRESH = 86400
+# Ceilings of the load average per CPU and of the I/O pressure (% of time some tasks waited for I/O, Linux only) above
+# which the collection slows down, checked every GOVERNOR_INTERVAL seconds. None disables a ceiling:
+GOVERNOR_MAX_LOAD = 1.5
+GOVERNOR_MAX_IO_PRESSURE = 40.0
+GOVERNOR_INTERVAL = 5
+# Pause before every domain and subprocess when one domain at a time is still too much, doubled up to the maximum:
+GOVERNOR_PAUSE = 0.5
+GOVERNOR_MAX_PAUSE = 30
+# Priority of the subprocesses (like `plesk`): nice value and ionice class (1 realtime, 2 best-effort, 3 idle, None
+# for no ionice) and level (0 highest, 7 lowest):
+CHILD_NICE = 10
+CHILD_IONICE_CLASS = 2
+CHILD_IONICE_LEVEL = 7
+# Split the domains in SHARDS shards by a hash of the domain name and collect one shard per run: the shard SHARD, or
+# when None the shard of the current hour (see sitekick.shards):
+SHARDS = 1
+SHARD = None
+# Seconds to reuse the last collected info of a domain whose fingerprint (see get_domain_fingerprint in
+# providers/template.py) did not change, 0 disables the cache. The reused info may be stale for the fields which the
+# fingerprint does not cover, like the disk usage and traffic (keep it at most one collection cycle, e.g. 86400):
+FINGERPRINT_MAX_AGE = 0
+# Seconds after which the checkpoint of an interrupted collection run is discarded instead of resumed, 0 disables the
+# checkpoints:
+CHECKPOINT_MAX_AGE = 43200
+# Read the info of all Plesk domains from the Plesk database with a few queries, instead of running
+# `plesk bin domain --info` for every domain. Only a subset of the fields is read, see the README:
+PLESK_BULK_SQL = False
+# Also send the parsed info of the Plesk domains ('info-parsed' and 'wp-toolkit'), next to the text of the plesk
+# commands. This about doubles the size of the payloads:
+PLESK_PARSED_INFO = False
 PLESK_BINARY = '/usr/sbin/plesk'
\ No newline at end of file
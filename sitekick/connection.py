@@ -0,0 +1,130 @@
+"""Persistent HTTP(S) connections for pushing to the Sitekick server. Opening a new connection for every batch costs a
+TCP and TLS handshake each time; the pool keeps the connections open between requests (HTTP keep-alive) and resumes the
+TLS session when a connection has to be opened again.
+"""
+import http.client
+import ssl
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+from sitekick import config
+
+Response = namedtuple('Response', ['status', 'reason', 'headers', 'body'])
+
+# Errors which indicate that a kept-alive connection was closed by the server (or a proxy) while it was idle:
+STALE_CONNECTION_ERRORS = (ConnectionError, http.client.BadStatusLine, http.client.CannotSendRequest)
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    """HTTP connection with a separate timeout for connecting and for reading the response."""
+    read_timeout = None
+
+    def connect(self):
+        super().connect()
+        if self.read_timeout:
+            self.sock.settimeout(self.read_timeout)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection with a separate connect and read timeout, which offers the TLS session of a previous connection
+    to the same host, so the server can resume it instead of doing a full handshake."""
+    read_timeout = None
+    tls_session = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=self.tls_session)
+        if self.read_timeout:
+            self.sock.settimeout(self.read_timeout)
+
+
+class ConnectionPool:
+    """A pool of kept-alive connections per (scheme, host, port). Thread-safe: a connection is used by one request at a
+    time, concurrent requests get their own connection. At most `max_idle` idle connections are kept per host."""
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_idle=4):
+        self.connect_timeout = connect_timeout if connect_timeout is not None else config.PUSH_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout if read_timeout is not None else config.PUSH_READ_TIMEOUT
+        self.max_idle = max_idle
+        self.context = ssl.create_default_context()
+        self._idle = {}
+        self._tls_sessions = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme, host, port):
+        """Open a connection to the host, through the proxy from the environment (like urllib) when configured."""
+        proxy = getproxies().get(scheme)
+        if proxy and proxy_bypass(host):
+            proxy = None
+        target_host, target_port = host, port
+        if proxy:
+            proxy_parts = urlsplit(proxy if '://' in proxy else f"http://{proxy}")
+            target_host, target_port = proxy_parts.hostname, proxy_parts.port or 8080
+        if scheme == 'https':
+            connection = _HTTPSConnection(target_host, target_port, timeout=self.connect_timeout, context=self.context)
+            connection.tls_session = self._tls_sessions.get((host, port))
+            if proxy:
+                connection.set_tunnel(host, port)
+        else:
+            connection = _HTTPConnection(target_host, target_port, timeout=self.connect_timeout)
+        connection.read_timeout = self.read_timeout
+        # A plain HTTP proxy needs the absolute URL in the request line:
+        connection.absolute_url = bool(proxy) and scheme == 'http'
+        return connection
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return self._new_connection(*key)
+
+    def _put(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send the request and read the complete response. A kept-alive connection which turns out to be closed by
+        the server is replaced by a new connection once. Other errors (including timeouts) are raised."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        for attempt in range(2):
+            connection = self._get(key)
+            reused = connection.sock is not None
+            try:
+                connection.request(method, url if connection.absolute_url else path, body=body,
+                                   headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if key[0] == 'https' and connection.sock is not None:
+                # Remember the session (TLS 1.3 sends the session ticket after the handshake) for a next connection:
+                self._tls_sessions[key[1:]] = connection.sock.session
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(key, connection)
+            return Response(response.status, response.reason, response.headers, data)
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
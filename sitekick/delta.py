@@ -0,0 +1,167 @@
+"""Change detection for domain info packages. When delta mode is enabled, a digest of every domain info package that
+was accepted by the Sitekick server is stored locally. A package with the same digest as the last accepted one is not
+queued again, until the last accepted push is older than `config.DELTA_RESEND_DAYS`, so every domain is still sent
+regularly.
+Providers with a cheap change stamp per domain (`get_domain_fingerprint(domain)`, e.g. the modification times of the
+configuration files of the domain) can skip the collection itself: the last collected info is kept per domain in a
+`PayloadCache` with its fingerprint, and reused while the fingerprint and the configuration of the collection (like the
+GDPR settings) are the same, for at most `config.FINGERPRINT_MAX_AGE` seconds.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from sitekick import config
+from sitekick.utils import state_path
+
+DIGEST_FILENAME = 'digests.json'
+PAYLOAD_CACHE_DIRNAME = 'payloads'
+# The settings which change the collected info: cached info collected with other settings is not reused:
+COLLECTION_CONFIG = ('GDPR_COMPLIANT', 'GDPR_PSK', 'GDPR_FIELDS', 'PLESK_BULK_SQL', 'PLESK_PARSED_INFO',
+                     'SYSTEM_INFO')
+_save_lock = threading.Lock()
+
+
+def payload_digest(domain_info):
+    """Return a digest of the domain info, leaving out the volatile `meta.timestamp`, so two collections of an unchanged
+    domain have the same digest."""
+    meta = domain_info.get('meta')
+    if isinstance(meta, dict) and 'timestamp' in meta:
+        domain_info = dict(domain_info, meta={key: value for key, value in meta.items() if key != 'timestamp'})
+    text = json.dumps(domain_info, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def digest_key(domain_info):
+    """Return the key of the domain info in the digest store: the provider type and the domain name."""
+    meta = domain_info.get('meta') or {}
+    return f"{meta.get('type')}/{meta.get('domain') or domain_info.get('domain')}"
+
+
+def load_digests(path=None):
+    """Load the digests of the accepted domain info packages. A missing or corrupt store is an empty store, so
+    everything is sent again."""
+    path = Path(path or state_path(DIGEST_FILENAME))
+    try:
+        with path.open() as f:
+            digests = json.loads(f.read())
+        return digests if isinstance(digests, dict) else {}
+    except Exception:
+        return {}
+
+
+def save_digests(digests, path=None):
+    """Merge the digests into the stored digests. Pass only the digests acknowledged in this run (start from an empty
+    dict), so pushers of concurrently running providers do not put back each other's old digests. The store is written
+    atomically, a crash while writing leaves the previous store intact."""
+    path = Path(path or state_path(DIGEST_FILENAME))
+    with _save_lock:
+        stored = load_digests(path)
+        stored.update(digests)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with temp_path.open('w') as f:
+            f.write(json.dumps(stored))
+        os.replace(str(temp_path), str(path))
+
+
+def is_unchanged(digests, domain_info, resend_days=None):
+    """Return True when the domain info equals the last accepted one and that push is not older than `resend_days`."""
+    if resend_days is None:
+        resend_days = config.DELTA_RESEND_DAYS
+    entry = digests.get(digest_key(domain_info))
+    if not entry or entry.get('digest') != payload_digest(domain_info):
+        return False
+    return time.time() - entry.get('acknowledged', 0) < resend_days * 86400
+
+
+def acknowledge(digests, data):
+    """Record the digests of the domain info packages in `data`, which were accepted by the Sitekick server."""
+    acknowledged = time.time()
+    for domain_info in data:
+        digests[digest_key(domain_info)] = {'digest': payload_digest(domain_info), 'acknowledged': acknowledged}
+
+
+def config_digest(names=COLLECTION_CONFIG):
+    """Return a digest of the settings which change the collected info (the psk is only stored as part of the
+    digest)."""
+    values = {name: getattr(config, name, None) for name in names}
+    text = json.dumps(values, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PayloadCache:
+    """The last collected info of every domain of a provider, with the fingerprint of the domain at that time. The
+    info is kept in a file per domain (`payloads/<provider>/<domain>.json` next to the queue), so only the info of the
+    collected domains is read. Every entry holds the digest of the collection settings (see `config_digest`), an
+    entry with other settings is not reused."""
+
+    def __init__(self, provider, get_domain_fingerprint, path=None, max_age=None):
+        self.path = Path(path or state_path(PAYLOAD_CACHE_DIRNAME)) / provider
+        self.get_domain_fingerprint = get_domain_fingerprint
+        self.max_age = config.FINGERPRINT_MAX_AGE if max_age is None else max_age
+        self.config = config_digest()
+
+    def _filename(self, domain):
+        return self.path / f"{domain}.json"
+
+    def fingerprint(self, domain):
+        """Return the fingerprint of the domain as a string, None when the provider cannot determine it."""
+        try:
+            fingerprint = self.get_domain_fingerprint(domain)
+        except Exception as e:
+            print(f"get_domain_fingerprint for {domain} failed with exception: {e}")
+            return None
+        return None if fingerprint is None else str(fingerprint)
+
+    def get(self, domain, fingerprint):
+        """Return the cached info of the domain when it was collected with the same fingerprint, not longer than
+        `max_age` seconds ago. Else None."""
+        if fingerprint is None:
+            return None
+        try:
+            with self._filename(domain).open() as f:
+                entry = json.loads(f.read())
+        except Exception:
+            return None
+        if (entry.get('fingerprint') != fingerprint or entry.get('config') != self.config
+                or time.time() - entry.get('collected', 0) >= self.max_age):
+            return None
+        return entry.get('payload')
+
+    def put(self, domain, fingerprint, payload):
+        """Keep the collected info of the domain with its fingerprint. The file is written atomically."""
+        if fingerprint is None:
+            return
+        filename = self._filename(domain)
+        try:
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = filename.with_name(f".{filename.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with temp_path.open('w') as f:
+                f.write(json.dumps({'fingerprint': fingerprint, 'config': self.config, 'collected': time.time(),
+                                    'payload': payload}))
+            os.replace(str(temp_path), str(filename))
+        except Exception as e:
+            # Not being able to cache the info is no reason to stop, it is collected again next time:
+            print(f"Info of {domain} could not be cached: {e}")
+
+    def prune(self):
+        """Remove the entries which are older than `max_age` seconds: they are never reused, and the entries of removed
+        domains would otherwise be kept forever. Return the number of removed entries."""
+        removed = 0
+        expired = time.time() - self.max_age
+        try:
+            entries = list(os.scandir(str(self.path)))
+        except OSError:
+            return removed
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < expired:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
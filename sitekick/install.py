@@ -3,23 +3,37 @@ import random
 import subprocess
 from pathlib import Path
 
-from sitekick.utils import hostname, ip_address
+from sitekick.utils import identity
 
 
-def install_script(mode='daily'):
+DEFAULT_SHARDS = 24  # shards of the hourly mode: every domain is collected once a day
+
+
+def install_script(mode='daily', shards=None):
     """Make the script run daily by setting a cron file in the `/etc/cron.d` directory. This is picked up by the cron
-    daemon if it is valid and does not affect any other existing cron jobs."""
-    # Get the path to the script:
-    script_path = Path(__file__).parent.parent / 'domains-to-sitekick.py'
+    daemon if it is valid and does not affect any other existing cron jobs.
+    In the `hourly` mode, the script runs every hour and collects one of `shards` shards of the domains per run (see
+    `sitekick.shards`), so the load is spread over the day."""
+    # Get the path to the script, or to the zipapp when running from one (see sitekick.build):
+    script_path = Path(__file__).parent.parent
+    if not script_path.is_file():
+        script_path = script_path / 'domains-to-sitekick.py'
     # Get the path to the cron file:
     cron_path = Path('/etc/cron.d/domains-to-sitekick')
     text = None
     if mode == 'daily':
         # Write the cron file. Set the time between 3 and 4 AM, by selecting a random minute, based on the hostname:
-        random.seed(hostname + ip_address + 'cron')
+        random.seed(identity.hostname + identity.ip_address + 'cron')
         minute = random.randint(0, 59)
         text = "# Run the domains-to-sitekick script daily at a random minute between 3 and 4 AM.\n" \
                f"{minute} 3 * * * root python3 {script_path}\n"
+    elif mode == 'hourly':
+        # Every hour at a random minute, based on the hostname. The shard of a run follows from the hour:
+        random.seed(identity.hostname + identity.ip_address + 'cron')
+        minute = random.randint(0, 59)
+        shards = int(shards or DEFAULT_SHARDS)
+        text = f"# Run the domains-to-sitekick script hourly, one of {shards} shards of the domains per run.\n" \
+               f"{minute} * * * * root python3 {script_path} --shards {shards}\n"
     elif mode == 'debug':
         # Get command to execute and POST the result every 5 minutes for debugging
         text = "# Debug the domains-to-sitekick script every 5 minutes.\n" \
@@ -0,0 +1,177 @@
+"""Counters and timers of a run, to find out which part of a run is slow. The pipeline records them in the process-wide
+`metrics` registry: the time per provider call, per subprocess, for serialization, queue writes and POSTs, and the
+number of retries and bytes. At the end of a run they are written as a JSON report and as a file for the textfile
+collector of the Prometheus node exporter.
+Recording is cheap: a dictionary update under a lock. Timers keep their count, sum and maximum, and a bounded sample of
+the latest durations for the percentiles.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+REPORT_FILENAME = 'sitekick-run.json'
+PROMETHEUS_FILENAME = 'sitekick.prom'
+SAMPLE_SIZE = 10000  # durations kept per timer for the percentiles
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(values, fraction):
+    """Return the `fraction` percentile (nearest rank) of the values, 0 when there are no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
+
+
+class _Timer:
+    __slots__ = ('count', 'sum', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def stats(self):
+        samples = list(self.samples)
+        stats = {'count': self.count, 'sum': self.sum, 'max': self.max}
+        for fraction in PERCENTILES:
+            stats[f"p{int(fraction * 100)}"] = percentile(samples, fraction)
+        return stats
+
+
+class Metrics:
+    """A thread-safe registry of counters and timers. A metric is identified by its name and its labels, keep the number
+    of label values small (e.g. a provider or a command name, not a domain)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all metrics and start a new run."""
+        with self._lock:
+            self.started = time.time()
+            self._counters = {}
+            self._timers = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name, value=1, **labels):
+        """Add `value` to the counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration of the timer."""
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = _Timer()
+            timer.count += 1
+            timer.sum += seconds
+            timer.max = max(timer.max, seconds)
+            timer.samples.append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Record the duration of the enclosed code, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def counter(self, name, **labels):
+        """Return the value of the counter, 0 when it was not counted."""
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def timer_stats(self, name, **labels):
+        """Return the count, sum, max and percentiles of the timer, None when it was not recorded."""
+        with self._lock:
+            timer = self._timers.get(self._key(name, labels))
+            return timer.stats() if timer is not None else None
+
+    def report(self, **run):
+        """Return all metrics as a dictionary, with the start, end and duration of the run and the `run` items."""
+        finished = time.time()
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            timers = [dict({'name': name, 'labels': dict(labels)}, **timer.stats())
+                      for (name, labels), timer in sorted(self._timers.items())]
+            started = self.started
+        return {'run': dict({'started': started, 'finished': finished, 'duration': finished - started}, **run),
+                'counters': counters, 'timers': timers}
+
+    def prometheus(self, report=None):
+        """Return the metrics in the Prometheus text exposition format: counters as `sitekick_<name>_total` and timers
+        as summaries `sitekick_<name>_seconds`."""
+        report = report or self.report()
+        lines = ['# TYPE sitekick_last_run_timestamp_seconds gauge',
+                 f"sitekick_last_run_timestamp_seconds {report['run']['finished']:.3f}",
+                 '# TYPE sitekick_run_duration_seconds gauge',
+                 f"sitekick_run_duration_seconds {report['run']['duration']:.6f}"]
+        typed = set()
+        for counter in report['counters']:
+            metric = f"sitekick_{counter['name']}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(counter['labels'])} {counter['value']}")
+        for timer in report['timers']:
+            metric = f"sitekick_{timer['name']}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            for fraction in PERCENTILES:
+                labels = dict(timer['labels'], quantile=str(fraction))
+                lines.append(f"{metric}{_labels(labels)} {timer[f'p{int(fraction * 100)}']:.6f}")
+            lines.append(f"{metric}_sum{_labels(timer['labels'])} {timer['sum']:.6f}")
+            lines.append(f"{metric}_count{_labels(timer['labels'])} {timer['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _write_atomic(path, text):
+    """Write the file through a temporary file, so readers (like the node exporter) never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with temp_path.open('w') as f:
+        f.write(text)
+    os.replace(str(temp_path), str(path))
+
+
+metrics = Metrics()
+
+
+def write_run_report(directory=None, **run):
+    """Write the metrics of the run to `directory` (default: `config.METRICS_PATH`, or next to the queue) as a JSON
+    report and a Prometheus textfile. Return the paths of both files."""
+    from sitekick import config
+    from sitekick.utils import identity, state_path
+    if directory is None:
+        directory = config.METRICS_PATH
+    report_path = Path(directory) / REPORT_FILENAME if directory else state_path(REPORT_FILENAME)
+    prometheus_path = report_path.with_name(PROMETHEUS_FILENAME)
+    report = metrics.report(hostname=identity.hostname, **run)
+    _write_atomic(report_path, json.dumps(report, indent=2))
+    _write_atomic(prometheus_path, metrics.prometheus(report))
+    return report_path, prometheus_path
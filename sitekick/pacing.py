@@ -0,0 +1,86 @@
+"""Pacing of the POSTs to the Sitekick server, so thousands of servers can push in the same hour without bursts at the
+same moment. Every host has its own slot within the post interval, derived from its host name and IP address, so the
+slot is the same on every run and differs between hosts. The first POST of a run waits for this slot, the next POSTs
+start the post interval after the previous one. On top of that, token buckets cap the POSTs per second and the bytes
+per second. Budget which is not used (e.g. while collecting) is carried over, up to `config.PUSH_BURST_SECONDS` seconds
+of budget.
+"""
+import hashlib
+import time
+
+from sitekick import config
+from sitekick.metrics import metrics
+
+
+def host_slot(interval, seed=None):
+    """Return the offset of this host within the `interval` (0 up to `interval` seconds). The offset is derived from
+    the `seed`, by default the host name and IP address, so it is deterministic per host and spread over the hosts."""
+    if not interval:
+        return 0.0
+    if seed is None:
+        from sitekick.utils import identity
+        seed = identity.hostname + identity.ip_address + 'push'
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 * interval
+
+
+def slot_delay(interval, offset, now=None):
+    """Return the seconds until the next start of the slot at `offset` within every `interval` seconds."""
+    if not interval:
+        return 0.0
+    now = time.time() if now is None else now
+    start = (now // interval) * interval + offset
+    if start < now:
+        start += interval
+    return start - now
+
+
+class TokenBucket:
+    """Tokens are added at `rate` per second, up to `capacity`. A reservation takes its tokens immediately, also when
+    they are not available yet (a single POST can be larger than the capacity): the caller waits the returned time."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate * config.PUSH_BURST_SECONDS)
+        self.tokens = self.capacity
+        self._clock = clock
+        self.updated = clock()
+
+    def reserve(self, amount=1):
+        """Take `amount` tokens, return the seconds to wait until they are available."""
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(-self.tokens / self.rate, 0.0)
+
+
+class Pacer:
+    """Start the POSTs at least `interval` seconds apart, and cap the POSTs per second and the bytes per second
+    (default: `config.PUSH_MAX_REQUESTS_PER_SECOND` and `config.PUSH_MAX_BYTES_PER_SECOND`, None for no cap)."""
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None, interval=0, clock=time.monotonic):
+        requests_per_second = requests_per_second or config.PUSH_MAX_REQUESTS_PER_SECOND
+        bytes_per_second = bytes_per_second or config.PUSH_MAX_BYTES_PER_SECOND
+        self.requests = TokenBucket(requests_per_second, clock=clock) if requests_per_second else None
+        self.bytes = TokenBucket(bytes_per_second, clock=clock) if bytes_per_second else None
+        self.interval = interval or 0
+        self._clock = clock
+        # The earliest start of the next POST:
+        self.next_start = None
+
+    def reserve(self, size):
+        """Reserve a POST of `size` bytes, return the seconds to wait before sending it."""
+        now = self._clock()
+        delay = 0.0
+        if self.next_start is not None:
+            delay = max(self.next_start - now, 0.0)
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve())
+        if self.bytes is not None:
+            delay = max(delay, self.bytes.reserve(size))
+        if self.interval:
+            self.next_start = now + delay + self.interval
+        if delay:
+            metrics.observe('pacing_wait', delay)
+        return delay
@@ -0,0 +1,296 @@
+"""Asynchronous push engine: keeps up to `config.PUSH_IN_FLIGHT` POSTs to the Sitekick server in flight at the same
+time, on a single thread with asyncio (standard library only). With a high round trip time to the Sitekick server, one
+POST at a time leaves the connection idle most of the time; several POSTs in flight keep it busy.
+The number of POSTs in flight is halved when the Sitekick server answers 429 or 503 (see
+`sitekick.throttle.RateController`).
+Every batch is acknowledged on its own: its files are removed from the queue as soon as the Sitekick server accepted
+that batch, regardless of the other batches in flight. A batch which fails all attempts is left in the queue.
+Proxies from the environment are not supported by this engine, `sitekick.send.push_domains_info` uses the synchronous
+engine when a proxy is configured.
+"""
+import asyncio
+import email.parser
+import http.client
+import json
+import ssl
+import time
+from urllib.parse import urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+from sitekick import config
+from sitekick.batching import AdaptiveBatcher
+from sitekick.compression import compress_body
+from sitekick.connection import Response
+from sitekick.delta import save_digests, acknowledge
+from sitekick.metrics import metrics
+from sitekick.pacing import Pacer
+from sitekick.queues import open_queue
+from sitekick.throttle import BACKPRESSURE_STATUSES, RateController, backoff_delay, parse_retry_after
+from sitekick.utils import now
+
+
+def uses_proxy(url):
+    """Return True when requests to the url go through a proxy from the environment."""
+    parts = urlsplit(url)
+    proxy = getproxies().get(parts.scheme.lower())
+    return bool(proxy) and not proxy_bypass(parts.hostname)
+
+
+async def _read_response(reader):
+    """Read a complete HTTP/1.x response. Return the response and whether the connection can be kept alive."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('Connection closed by the server')
+        version, status, reason = (line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        status = int(status)
+        header_lines = []
+        while True:
+            header_line = await reader.readline()
+            if header_line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(header_line)
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(
+            b''.join(header_lines).decode('iso-8859-1'))
+        # Skip informational responses (like 100 Continue):
+        if status >= 200:
+            break
+    keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        # Skip the trailer:
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = b''.join(chunks)
+    elif headers.get('Content-Length') is not None:
+        body = await reader.readexactly(int(headers['Content-Length']))
+    elif status in (204, 304):
+        body = b''
+    else:
+        # The body ends when the server closes the connection:
+        body = await reader.read()
+        keep_alive = False
+    return Response(status, reason, headers, body), keep_alive
+
+
+class AsyncConnectionPool:
+    """A pool of kept-alive connections per (scheme, host, port) for asyncio, like `sitekick.connection.ConnectionPool`.
+    A connection is used by one request at a time, concurrent requests get their own connection."""
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_idle=4):
+        self.connect_timeout = connect_timeout if connect_timeout is not None else config.PUSH_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout if read_timeout is not None else config.PUSH_READ_TIMEOUT
+        self.max_idle = max_idle
+        self.context = ssl.create_default_context()
+        self._idle = {}
+
+    async def _open(self, scheme, host, port):
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self.context if scheme == 'https' else None),
+            self.connect_timeout)
+
+    async def request(self, method, url, body=None, headers=None):
+        """Send the request and read the complete response. A kept-alive connection which turns out to be closed by
+        the server is replaced by a new connection once. Other errors (including timeouts) are raised."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        default_port = 443 if scheme == 'https' else 80
+        key = (scheme, parts.hostname, parts.port or default_port)
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        body = body or b''
+        host = parts.hostname if key[2] == default_port else f"{parts.hostname}:{key[2]}"
+        head_lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", 'Accept-Encoding: identity',
+                      f"Content-Length: {len(body)}"]
+        head_lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        message = ('\r\n'.join(head_lines) + '\r\n\r\n').encode('iso-8859-1') + body
+        for attempt in range(2):
+            idle = self._idle.get(key)
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._open(*key)
+            try:
+                writer.write(message)
+                await writer.drain()
+                response, keep_alive = await asyncio.wait_for(_read_response(reader), self.read_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            idle = self._idle.setdefault(key, [])
+            if keep_alive and len(idle) < self.max_idle:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    def close(self):
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncPusher:
+    """Push the records from the queue (and the channel of a parallel collector) with up to `in_flight` POSTs at the
+    same time. The batches are selected by the shared `AdaptiveBatcher`."""
+
+    def __init__(self, queue, count, attempts=10, in_flight=None, channel=None, digests=None, interval=0):
+        self.queue = queue
+        self.url = config.SITEKICK_PUSH_URL
+        self.compression = config.PUSH_COMPRESSION
+        self.attempts = attempts
+        self.in_flight = max(int(in_flight or config.PUSH_IN_FLIGHT), 1)
+        self.channel = channel
+        self.digests = digests
+        self.batcher = AdaptiveBatcher(count)
+        self.pool = AsyncConnectionPool(max_idle=self.in_flight)
+        # Fewer POSTs in flight and per second when the Sitekick server answers 429 or 503:
+        self.rate = RateController(self.in_flight)
+        # The interval between the POSTs and the caps of the POSTs and bytes per second:
+        self.pacer = Pacer(interval=interval)
+        # Claimed records which are not pushed yet, with their serialized data:
+        self.pending = []
+        # Set when a batch failed all attempts, no new batches are started (the batches in flight keep retrying):
+        self.failed = False
+        self.total_count = 0
+
+    def _next_batch(self, block):
+        """Take records from the channel or the queue and return the next batch. Only wait for the collector when
+        `block` is set, i.e. when no POST is in flight."""
+        if len(self.pending) < self.batcher.count:
+            records = []
+            if self.channel is not None and not self.channel.finished:
+                records = self.channel.get(self.batcher.count - len(self.pending), block=block and not self.pending)
+            if not records and (self.channel is None or self.channel.finished):
+                records = self.queue.claim(self.batcher.count - len(self.pending))
+            with metrics.timer('json_serialization'):
+                self.pending.extend((record, json.dumps(record.data)) for record in records)
+        batch = self.pending[:self.batcher.select([len(part) for record, part in self.pending])]
+        del self.pending[:len(batch)]
+        return batch
+
+    async def _push_batch(self, batch):
+        """Push the batch with a maximum `attempts` number of attempts. Return True when it was accepted."""
+        body = ('{"data": [' + ', '.join(part for record, part in batch) + ']}').encode()
+        for attempt in range(self.attempts):
+            with metrics.timer('compression'):
+                payload, payload_headers = compress_body(body, self.compression, config.PUSH_COMPRESSION_DICTIONARY)
+            headers = {'Content-Type': 'application/json', 'Accept': 'application/json', **payload_headers}
+            metrics.count('bytes_uncompressed', len(body))
+            metrics.count('bytes_sent', len(payload))
+            retry_after = None
+            delay = max(self.rate.reserve(), self.pacer.reserve(len(payload)))
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.time()
+            try:
+                response = await self.pool.request('POST', self.url, body=payload, headers=headers)
+                metrics.observe('post', time.time() - started)
+                metrics.count('posts', status=str(response.status))
+                if 200 <= response.status < 300:
+                    self.batcher.record(time.time() - started)
+                    self.rate.success()
+                    # Remove the files of this batch from the queue:
+                    self.queue.ack([record for record, part in batch])
+                    if self.channel is not None:
+                        self.channel.acknowledged([record for record, part in batch])
+                    if self.digests is not None:
+                        acknowledge(self.digests, [record.data for record, part in batch])
+                    self.total_count += len(batch)
+                    metrics.count('domains_pushed', len(batch))
+                    print(
+                        f"{now()} Sitekick pushed another {len(batch)} of {self.total_count} files so far"
+                        f" ({len(body)} bytes) to {self.url}")
+                    return True
+                if response.status == 415 and payload is not body:
+                    # The endpoint does not accept compressed bodies, send plain bodies from now on:
+                    if self.compression is not None:
+                        print(f"{now()} Sitekick push to {self.url} does not support {self.compression}"
+                              f" compression, sending uncompressed bodies")
+                    self.compression = None
+                    continue
+                self.batcher.record(time.time() - started, ok=False)
+                if response.status in BACKPRESSURE_STATUSES:
+                    # The Sitekick server is overloaded, slow down:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.rate.backpressure(retry_after)
+                print(
+                    f"{now()} Sitekick push attempt {attempt + 1} of {self.attempts} to {self.url}"
+                    f" failed with code {response.status}: {response.body}"
+                    f"{f' (retry after {retry_after:.0f} s)' if retry_after is not None else ''}")
+            except Exception as e:
+                self.batcher.record(time.time() - started, ok=False)
+                metrics.observe('post', time.time() - started)
+                metrics.count('post_errors')
+                print(
+                    f"{now()} Sitekick push attempt {attempt + 1} of {self.attempts} to {self.url}"
+                    f" failed with exception: {e}")
+            if attempt == self.attempts - 1:
+                break
+            metrics.count('post_retries')
+            # Exponential backoff with full jitter, so the servers do not retry in lockstep, or the Retry-After:
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+        self.failed = True
+        metrics.count('push_failures')
+        self.pending[:0] = batch
+        return False
+
+    async def run(self, interval_offset=0):
+        """Push until no more records are found or a batch failed all attempts, the batches in flight then finish their
+        attempts. The first POST is sent `interval_offset` seconds after the start, to spread the load of many servers
+        pushing at the same time."""
+        if interval_offset:
+            await asyncio.sleep(interval_offset)
+        tasks = set()
+        try:
+            while True:
+                while not self.failed and len(tasks) < self.rate.allowed():
+                    batch = self._next_batch(block=not tasks)
+                    if not batch:
+                        break
+                    tasks.add(asyncio.ensure_future(self._push_batch(batch)))
+                if not tasks:
+                    break
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            self.pool.close()
+        if self.failed or self.pending:
+            # Leave the unsent files in the queue for the next run:
+            records = [record for record, part in self.pending]
+            self.queue.release(records)
+            if self.channel is not None:
+                # Let the collector spill to the queue from now on, and spill the records in memory:
+                self.channel.spill_remaining(records, lambda record: self.queue.put(record.index, record.domain,
+                                                                                    record.data))
+
+
+def push_domains_info_async(queue_path=None, count=20, interval_offset=0, attempts=10, channel=None, in_flight=None,
+                            interval=0):
+    """Push the files from the queue at `queue_path` (and the records from the `channel`) to the Sitekick server, with
+    up to `in_flight` POSTs at the same time. See `sitekick.send.push_domains_info` for the other arguments."""
+    if queue_path is None:
+        queue_path = config.QUEUE_PATH
+    queue = open_queue(queue_path)
+    pusher = AsyncPusher(queue, count, attempts, in_flight, channel,
+                         digests={} if config.DELTA_MODE else None, interval=interval)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(pusher.run(interval_offset))
+    finally:
+        loop.close()
+        queue.close()
+    if pusher.digests is not None:
+        save_digests(pusher.digests)
+    print(f"{now()} Sitekick pushed total {pusher.total_count} files to {pusher.url}"
+          f" with up to {pusher.in_flight} POSTs in flight")
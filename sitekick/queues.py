@@ -0,0 +1,195 @@
+"""Queue backends for the domain info packages. The collector puts the info per domain in the queue, the pusher claims
+batches from the queue and acknowledges (removes) them once the Sitekick server accepted them.
+The backend is selected by the scheme of the queue path:
+/tmp/sitekick/domains               A directory with one JSON file per domain, named `{index:08}-{domain}.json`. This is
+                                    the default.
+sqlite:///tmp/sitekick/queue.db     A SQLite database in WAL mode. Batches are claimed in a transaction using an index,
+                                    so the queue does not have to be scanned for every batch.
+"""
+import json
+import os
+import sqlite3
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+from sitekick import config
+
+# A queued domain info package. The key identifies the package in the backend, it is None when not (yet) queued:
+Record = namedtuple('Record', ['index', 'domain', 'data', 'key'])
+
+
+def split_queue_path(queue_path=None):
+    """Split the queue path in the scheme and the file system path. A plain path has an empty scheme."""
+    queue_path = str(queue_path or config.QUEUE_PATH)
+    if '://' not in queue_path:
+        return '', Path(queue_path)
+    scheme, path = queue_path.split('://', 1)
+    return scheme.lower(), Path(path)
+
+
+def queue_location(queue_path=None):
+    """Return the file system location of the queue: the directory or the database file."""
+    return split_queue_path(queue_path)[1]
+
+
+def provider_queue_path(queue_path, provider):
+    """Return the queue path for a single provider, when providers run concurrently: a subdirectory of the queue
+    directory, or a separate database next to the queue database."""
+    scheme, path = split_queue_path(queue_path)
+    if scheme == 'sqlite':
+        path = path.with_name(f"{path.stem}-{provider}{path.suffix}")
+    else:
+        path = path / provider
+    return f"{scheme}://{path}" if scheme else str(path)
+
+
+def open_queue(queue_path=None):
+    """Open the queue for the specified path, the scheme of the path determines the backend. A queue object must only
+    be used from the thread that opened it."""
+    scheme, path = split_queue_path(queue_path)
+    if scheme in ('', 'file'):
+        return DirectoryQueue(path)
+    if scheme == 'sqlite':
+        return SqliteQueue(path)
+    raise ValueError(f"Unknown queue scheme '{scheme}' in queue path {queue_path}")
+
+
+class DirectoryQueue:
+    """A directory with one JSON file per domain. The files are sorted by name, which starts with the index of the
+    domain. The directory is only scanned again when all files of the previous scan have been claimed."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._backlog = deque()
+        self._claimed = set()
+
+    def put(self, index, domain, data):
+        """Write the domain info to its file. The file is written under a temporary name first, so a concurrent pusher
+        never reads a partially written file."""
+        filename = self.path / f"{index:08}-{domain}.json"
+        temp_filename = filename.with_name(filename.name + '.tmp')
+        with temp_filename.open('w') as f:
+            f.write(json.dumps(data, indent=4))
+        os.replace(str(temp_filename), str(filename))
+
+    def claim(self, count):
+        """Return at most `count` records, in the order of the file names."""
+        if not self._backlog:
+            self._backlog.extend(sorted((filename for filename in self.path.glob('*.json')
+                                         if filename not in self._claimed), key=lambda filename: filename.name))
+        records = []
+        while self._backlog and len(records) < count:
+            filename = self._backlog.popleft()
+            try:
+                with filename.open() as f:
+                    data = json.loads(f.read())
+                index, domain = filename.stem.split('-', 1)
+                index = int(index)
+            except FileNotFoundError:
+                # Removed by another process in the meantime:
+                continue
+            except ValueError as e:
+                print(f"Skipping invalid queue file {filename}: {e}")
+                continue
+            records.append(Record(index, domain, data, filename))
+            self._claimed.add(filename)
+        return records
+
+    def ack(self, records):
+        """Remove the files of the records, they have been accepted."""
+        for record in records:
+            if record.key is None:
+                continue
+            try:
+                record.key.unlink()
+            except FileNotFoundError:
+                pass
+            self._claimed.discard(record.key)
+
+    def release(self, records):
+        """Return the records to the queue, in front of the unclaimed files."""
+        for record in reversed(records):
+            if record.key is None:
+                continue
+            self._claimed.discard(record.key)
+            self._backlog.appendleft(record.key)
+
+    def clear(self):
+        """Remove all queued files."""
+        for filename in self.path.glob('*'):
+            if filename.is_file():
+                filename.unlink()
+        self._backlog.clear()
+        self._claimed.clear()
+
+    def close(self):
+        pass
+
+
+class SqliteQueue:
+    """A SQLite database with one row per domain. Claimed rows are marked with the claim time, so a second pusher does
+    not claim them. Claims of a crashed pusher expire after `claim_timeout` seconds."""
+
+    def __init__(self, path, claim_timeout=3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.claim_timeout = claim_timeout
+        # Transactions are started explicitly, so claims can use BEGIN IMMEDIATE:
+        self.connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS queue ('
+            'id INTEGER PRIMARY KEY, position INTEGER NOT NULL, domain TEXT NOT NULL, data TEXT NOT NULL, '
+            'claimed REAL NOT NULL DEFAULT 0, UNIQUE (position, domain))')
+
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements in one write transaction, rolled back on any error."""
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    def put(self, index, domain, data):
+        with self._transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO queue (position, domain, data, claimed) VALUES (?, ?, ?, 0)',
+                           (index, domain, json.dumps(data)))
+
+    def claim(self, count):
+        """Claim at most `count` unclaimed rows, in the order of the position. The rows are selected through the
+        (position, domain) index and marked as claimed in the same transaction."""
+        with self._transaction() as cursor:
+            now = time.time()
+            rows = cursor.execute(
+                'SELECT id, position, domain, data FROM queue WHERE claimed < ? ORDER BY position, domain LIMIT ?',
+                (now - self.claim_timeout, count)).fetchall()
+            cursor.executemany('UPDATE queue SET claimed = ? WHERE id = ?', [(now, row[0]) for row in rows])
+        return [Record(position, domain, json.loads(data), row_id) for row_id, position, domain, data in rows]
+
+    def ack(self, records):
+        """Delete the rows of the records in a single transaction."""
+        keys = [record.key for record in records if record.key is not None]
+        if keys:
+            with self._transaction() as cursor:
+                cursor.execute(f"DELETE FROM queue WHERE id IN ({','.join('?' * len(keys))})", keys)
+
+    def release(self, records):
+        keys = [record.key for record in records if record.key is not None]
+        if keys:
+            with self._transaction() as cursor:
+                cursor.execute(f"UPDATE queue SET claimed = 0 WHERE id IN ({','.join('?' * len(keys))})", keys)
+
+    def clear(self):
+        with self._transaction() as cursor:
+            cursor.execute('DELETE FROM queue')
+
+    def close(self):
+        self.connection.close()
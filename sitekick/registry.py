@@ -0,0 +1,120 @@
+"""Cached registry of the providers which match this host. Finding the valid providers imports every provider module
+and calls its `is_server_type()`, which runs subprocesses (e.g. `which plesk` and `plesk version`). The result is kept
+in a manifest file next to the queue, so the next runs only import the providers which matched. An entry is probed again
+when its file changed (modification time or size), and all entries are probed again when the manifest is older than
+`config.PROVIDER_REGISTRY_TTL` seconds, so a control panel installed later is still found.
+"""
+import json
+import os
+import pkgutil
+import time
+from importlib import import_module, util
+from pathlib import Path
+
+from sitekick import config
+from sitekick.utils import state_path
+
+MANIFEST_FILENAME = 'providers.json'
+REQUIRED_FUNCTIONS = ('is_server_type', 'get_domains', 'get_domain_info')
+
+
+def provider_files(root_module='providers'):
+    """Return the provider files by name, without importing them. The providers are listed by the import system, so
+    they are also found when the code runs from a zipapp (see `sitekick.build`)."""
+    package = import_module(root_module)
+    return {info.name: Path(util.find_spec(f"{root_module}.{info.name}").origin)
+            for info in pkgutil.iter_modules(package.__path__) if not info.ispkg}
+
+
+def file_signature(filename):
+    """Return the modification time and size of the file: a changed file has a different signature. A file inside a
+    zipapp has the signature of the archive, so all providers are probed again when the archive is replaced."""
+    for path in (filename,) + tuple(filename.parents):
+        if path.is_file():
+            stat = path.stat()
+            return [stat.st_mtime, stat.st_size]
+    raise FileNotFoundError(f"No such file: {filename}")
+
+
+def load_manifest(path=None, ttl=None):
+    """Return the creation time of the manifest and the cached provider entries by name. A missing, corrupt or expired
+    manifest is a new, empty manifest."""
+    path = Path(path or state_path(MANIFEST_FILENAME))
+    ttl = config.PROVIDER_REGISTRY_TTL if ttl is None else ttl
+    try:
+        with path.open() as f:
+            manifest = json.loads(f.read())
+        if time.time() - manifest['created'] < ttl:
+            return manifest['created'], manifest['providers']
+    except Exception:
+        pass
+    return time.time(), {}
+
+
+def save_manifest(providers, created, path=None):
+    """Write the manifest atomically, a crash while writing leaves the previous manifest intact."""
+    path = Path(path or state_path(MANIFEST_FILENAME))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with temp_path.open('w') as f:
+        f.write(json.dumps({'created': created, 'providers': providers}, indent=2))
+    os.replace(str(temp_path), str(path))
+
+
+def probe(root_module, name):
+    """Import the provider and call its `is_server_type()`. Return the module (None when not valid) and its entry."""
+    module, entry = None, {'valid': False}
+    try:
+        module = import_module(f"{root_module}.{name}")
+        # A valid to_sitekick module should have three functions: is_server_type, get_domains and get_domain_info:
+        entry['functions'] = [function for function in REQUIRED_FUNCTIONS if callable(getattr(module, function, None))]
+        for function in REQUIRED_FUNCTIONS:
+            if function not in entry['functions']:
+                raise AttributeError(f"Module {root_module}.{name} has no function {function}")
+        try:
+            entry['valid'] = bool(module.is_server_type())
+        except Exception as e:
+            print(f"{root_module}.{name}.is_server_type(): False ({e})")
+            entry['error'] = str(e)
+    except Exception as e:
+        print(f"Error importing module {root_module}.{name}: {e}")
+        entry['error'] = str(e)
+    return (module if entry['valid'] else None), entry
+
+
+def get_server_modules(root_module='providers', filter=None, manifest_path=None, ttl=None):
+    """Return the valid provider modules which pass the `filter` on their name. Providers with an unchanged file and
+    a cached result are not probed again; only the valid ones are imported. `ttl` 0 disables the cache."""
+    if filter is None:
+        filter = lambda module: True
+    ttl = config.PROVIDER_REGISTRY_TTL if ttl is None else ttl
+    created, cached = load_manifest(manifest_path, ttl) if ttl else (None, {})
+    providers = {}
+    valid_modules = []
+    for name, filename in sorted(provider_files(root_module).items()):
+        signature = file_signature(filename)
+        entry = cached.get(name)
+        if entry is not None and entry.get('signature') == signature:
+            providers[name] = entry
+            if entry['valid'] and filter(name):
+                try:
+                    valid_modules.append(import_module(f"{root_module}.{name}"))
+                except Exception as e:
+                    print(f"Error importing module {root_module}.{name}: {e}")
+                    del providers[name]
+            continue
+        if not filter(name):
+            # Not probed now, probe it when it is needed:
+            continue
+        module, providers[name] = probe(root_module, name)
+        providers[name]['signature'] = signature
+        if module is not None:
+            valid_modules.append(module)
+    if ttl and providers != cached:
+        # Changed providers keep the creation time of the manifest, so every provider is probed again after ttl:
+        try:
+            save_manifest(providers, created, manifest_path)
+        except Exception as e:
+            print(f"Provider registry could not be saved: {e}")
+    return valid_modules
+
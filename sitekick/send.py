@@ -25,18 +25,31 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import json
-import random
 import threading
 import time
-from importlib import import_module
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from urllib.request import urlopen, Request
 
-from sitekick import config
-from sitekick.utils import now, hostname, ip_address, mac_address
+from sitekick import config, registry
+from sitekick.batching import AdaptiveBatcher
+from sitekick.channel import Channel
+from sitekick.checkpoint import Checkpoint
+from sitekick.compression import compress_body
+from sitekick.connection import ConnectionPool
+from sitekick.delta import PayloadCache, load_digests, save_digests, is_unchanged, acknowledge
+from sitekick.metrics import metrics, write_run_report
+from sitekick.pacing import Pacer, host_slot, slot_delay
+from sitekick.push_async import push_domains_info_async, uses_proxy
+from sitekick.queues import Record, open_queue, provider_queue_path
+from sitekick.shards import current_shard, shard_of
+from sitekick.throttle import BACKPRESSURE_STATUSES, FairLimiter, RateController, backoff_delay, governor, \
+    parse_retry_after
+from sitekick.utils import now, identity
 
 DEFAULT_DOMAIN_COUNT_PER_POST = 20  # number of detailed domain info packages to send per post
 DEFAULT_DOMAIN_POST_INTERVAL = 10  # seconds
+DEBUG_DOMAIN_LIMIT = 50  # stop collecting after this many domains, for testing
 
 
 # Get a list of filenames for the providers and see which ones are appropriate:
@@ -52,51 +65,192 @@ def get_providers():
     return providers
 
 
+def collect_domain_info(domain, get_domain_info, attempts=10):
+    """Get the info for a single domain, with `attempts` retries, and add the meta info. Return None when all attempts
+    failed. This is the unit of work for the collector workers, so it must not touch the queue."""
+    provider = get_domain_info.__module__.split('.')[-1]
+    for attempt in range(attempts):
+        try:
+            with metrics.timer('provider_call', provider=provider):
+                domain_info = get_domain_info(domain)
+            meta = {
+                'type': provider,
+                'domain': domain,
+                'hostname': identity.hostname,
+                'ip': identity.ip_address,
+                'timestamp': now(),
+                'mac': identity.mac_address
+            }
+            domain_info['meta'] = meta
+            return domain_info
+        except Exception as e:
+            metrics.count('provider_call_errors', provider=provider)
+            print(
+                f"{now()} Sitekick get_domain_info attempt {attempt + 1} of {attempts} for {domain} failed with exception: {e}")
+            time.sleep((5 ** (attempt / 9)))
+    metrics.count('domains_failed', provider=provider)
+    print(f"{now()} Sitekick get_domain_info for {domain} failed {attempts} times, skipping this domain")
+    return None
+
+
+def collect_in_order(collect, items, workers=1):
+    """Call `collect(item)` for every item, with at most `workers` calls running concurrently, and yield the tuples
+    (item, result) in the order of `items`. The number of submitted but not yet yielded items is bounded, so `items` may
+    be a long or lazy sequence. With a single worker, everything runs in the current thread."""
+    if workers <= 1:
+        for item in items:
+            yield item, collect(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(collect, item)))
+            if len(pending) >= 2 * workers:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
 def get_domains_info(get_domains, get_domain_info, queue_path=None, cleanup=False, show_progress=True,
-                     cutoff_lines=100):
-    """Get domain info from the local server and store the data per domain in a file in `queue_path`.
-    From there, the data is periodically pushed to the Sitekick-server."""
+                     cutoff_lines=100, workers=None, delta=None, channel=None, limit=DEBUG_DOMAIN_LIMIT,
+                     get_domain_fingerprint=None, shards=1, shard=None):
+    """Get domain info from the local server and store the data per domain in the queue at `queue_path`.
+    From there, the data is periodically pushed to the Sitekick-server.
+    `get_domains` may return (or be) any iterable, including a generator: domains are collected while it is still
+    being iterated, so providers can page through large control panel APIs.
+    With `workers` > 1, the info of that many domains is collected concurrently. The files are still written in the
+    order of the domains, so the queue order does not depend on which domain happens to finish first.
+    With `delta`, domains whose info equals the last info accepted by the Sitekick server are not queued.
+    With a `channel`, the info is handed to a parallel pusher in memory and only spilled to the queue when the channel
+    is full. The channel is closed at the end, also when getting the domains fails.
+    Collecting stops after more than `limit` domains, None for no limit.
+    With the provider's `get_domain_fingerprint`, the info of a domain whose fingerprint did not change since the last
+    collection is taken from the cache instead of collected again (see `sitekick.delta.PayloadCache`).
+    With `shards` above 1, only the domains in `shard` (default: the shard of the current hour) are collected, see
+    `sitekick.shards`."""
+    try:
+        with metrics.timer('stage', stage='collect'):
+            _get_domains_info(get_domains, get_domain_info, queue_path, cleanup, show_progress, cutoff_lines,
+                              workers, delta, channel, limit, get_domain_fingerprint, shards, shard)
+    finally:
+        if channel is not None:
+            channel.close()
+
+
+def _get_domains_info(get_domains, get_domain_info, queue_path, cleanup, show_progress, cutoff_lines, workers,
+                      delta, channel, limit, get_domain_fingerprint, shards, shard):
     if queue_path is None:
         queue_path = config.QUEUE_PATH
+    if workers is None:
+        workers = config.COLLECT_WORKERS or 1
+    workers = max(int(workers), 1)
+    if delta is None:
+        delta = config.DELTA_MODE
+    shards = max(int(shards or 1), 1)
+    if shards > 1:
+        shard = current_shard(shards) if shard is None else int(shard) % shards
+        print(f"{now()} Sitekick collects shard {shard} of {shards} shards")
+    digests = load_digests() if delta else {}
+    unchanged_count = 0
     # Get all domains from the local server:
     domains = get_domains() if callable(get_domains) else get_domains
-    Path(queue_path).mkdir(parents=True, exist_ok=True)
+    queue = open_queue(queue_path)
     # Clear the queue location:
     if cleanup:
-        for filename in Path(queue_path).glob('*'):
-            filename.unlink()
-    # Get detailed information per domain and store it in the file system. Skip already seen domains:
+        queue.clear()
+    # Continue an interrupted run of the same domain list (see sitekick.checkpoint). A lazy domain list (a generator)
+    # cannot be fingerprinted before it has been read completely, so it is not checkpointed:
+    checkpoint = None
+    if config.CHECKPOINT_MAX_AGE and isinstance(domains, (list, tuple)):
+        checkpoint = Checkpoint.start(queue_path, domains, resume=not cleanup,
+                                      salt=f"{shard}/{shards}" if shards > 1 else '')
+        if channel is not None:
+            # A record handed to the pusher is only complete when it is spilled to the queue or pushed:
+            channel.on_stored = lambda record: checkpoint.complete(record.domain)
+        if checkpoint.resumed:
+            metrics.count('domains_resumed', len(checkpoint.completed))
+            print(f"{now()} Sitekick resumes run {checkpoint.run_id}, {len(checkpoint.completed)} domains were already"
+                  f" collected")
+    # Get detailed information per domain and store it in the file system. Skip the domains whose info was already
+    # collected, a domain which failed is tried again when it is listed again:
+    domains_seen = set()
     domains_sent = set()
-    for i, domain in enumerate(domains):
-        try:
-            # Clean up the domain name
-            domain = domain.strip().lower()
-            if domain in domains_sent:
+    domain_count = 0
+
+    def unique_domains():
+        # `domains` may be a generator, so count while iterating instead of using len():
+        nonlocal domain_count
+        for i, domain in enumerate(domains):
+            domain_count = i + 1
+            try:
+                # Clean up the domain name
+                domain = domain.strip().lower()
+            except Exception as e:
+                print(f"{now()} Sitekick get_domain_info for {domain} failed with exception: {e}")
+                continue
+            if domain in domains_seen:
                 print(f"{now()} Sitekick get_domain_info for {domain} already retrieved, skipping this domain.")
                 continue
-            domain_info = None
-            for attempt in range(10):
-                try:
-                    domain_info = get_domain_info(domain)
-                    meta = {
-                        'type': get_domain_info.__module__.split('.')[-1],
-                        'domain': domain,
-                        'hostname': hostname,
-                        'ip': ip_address,
-                        'timestamp': now(),
-                        'mac': mac_address
-                    }
-                    domain_info['meta'] = meta
-                    break
-                except Exception as e:
-                    print(
-                        f"{now()} Sitekick get_domain_info attempt {attempt + 1} of 10 for {domain} failed with exception: {e}")
-                    time.sleep((5 ** (attempt / 9)))
+            if shards > 1 and shard_of(domain, shards) != shard:
+                # Collected in the run of another shard:
+                continue
+            if checkpoint is not None and domain in checkpoint.completed:
+                # Collected by the interrupted run:
+                continue
+            yield i, domain
+
+    def spill(record):
+        with metrics.timer('queue_write'):
+            queue.put(record.index, record.domain, record.data)
+
+    # The governor lowers the number of domains collected at the same time when the server is busy:
+    get_domain_info = governor.wrap(get_domain_info)
+    cache = None
+    if get_domain_fingerprint is not None and config.FINGERPRINT_MAX_AGE:
+        cache = PayloadCache(get_domain_info.__module__.split('.')[-1], get_domain_fingerprint)
+        metrics.count('payloads_pruned', cache.prune())
+
+    def collect(item):
+        if cache is None:
+            return collect_domain_info(item[1], get_domain_info)
+        fingerprint = cache.fingerprint(item[1])
+        domain_info = cache.get(item[1], fingerprint)
+        if domain_info is not None:
+            # The domain did not change, the info is still current:
+            metrics.count('domains_cached')
+            domain_info['meta'] = dict(domain_info.get('meta') or {}, timestamp=now())
+            return domain_info
+        domain_info = collect_domain_info(item[1], get_domain_info)
+        if domain_info is not None:
+            cache.put(item[1], fingerprint, domain_info)
+        return domain_info
+
+    results = collect_in_order(collect, unique_domains(), workers)
+    for (i, domain), domain_info in results:
+        try:
             if domain_info is None:
-                print(f"{now()} Sitekick get_domain_info for {domain} failed 10 times, skipping this domain")
                 continue
-            with Path(queue_path, f"{i:08}-{domain}.json").open('w') as f:
-                f.write(json.dumps(domain_info, indent=4))
+            if domain in domains_seen:
+                # A duplicate which was collected at the same time as the first one:
+                print(f"{now()} Sitekick get_domain_info for {domain} already retrieved, skipping this domain.")
+                continue
+            domains_seen.add(domain)
+            if delta and is_unchanged(digests, domain_info):
+                unchanged_count += 1
+                metrics.count('domains_unchanged')
+                if checkpoint is not None:
+                    checkpoint.complete(domain)
+                continue
+            if channel is not None:
+                channel.put(Record(i, domain, domain_info, None), spill)
+            else:
+                with metrics.timer('queue_write'):
+                    queue.put(i, domain, domain_info)
+            if checkpoint is not None and channel is None:
+                checkpoint.complete(domain)
+            metrics.count('domains_collected')
             # Demo: write domain info
             # print('Domain: ', domain)
             # print('Info on domain:')
@@ -108,128 +262,254 @@ def get_domains_info(get_domains, get_domain_info, queue_path=None, cleanup=Fals
                     print('.', end='', flush=True)
             domains_sent.add(domain)
             #### DEBUG, limit # of domains to 50 for testing ####
-            if len(domains_sent) > 50:
+            if limit is not None and len(domains_sent) > limit:
                 break
         except Exception as e:
             print(f"{now()} Sitekick get_domain_info for {domain} failed with exception: {e}")
-    print(f"\n{now()} Sitekick info on {len(domains)} domains stored in {queue_path}")
+    results.close()
+    queue.close()
+    if checkpoint is not None:
+        # The run is complete (or stopped at the limit), the next run starts with the first domain again:
+        checkpoint.finish()
+    metrics.count('domains_listed', domain_count)
+    if channel is not None:
+        metrics.count('domains_spilled', channel.spilled)
+        print(f"\n{now()} Sitekick info on {len(domains_sent)} of {domain_count} domains handed to the pusher,"
+              f" {channel.spilled} spilled to {queue_path}")
+    else:
+        print(f"\n{now()} Sitekick info on {len(domains_sent)} of {domain_count} domains stored in {queue_path}")
+    if delta:
+        print(f"{now()} Sitekick skipped {unchanged_count} unchanged domains")
 
 
 # def push_domains_info(queue_path=QUEUE_PATH, count=DOMAIN_COUNT_PER_POST, interval=DOMAIN_POST_INTERVAL,
 #                       interval_offset=None, attempts=10):
-def push_domains_info(queue_path=None, count=DEFAULT_DOMAIN_COUNT_PER_POST, interval=2,
-                      interval_offset=0, attempts=10):
-    """Every `interval` seconds, get the files from the queue_path and push them to the Sitekick server.
-    The `interval_offset` is used to start pushing after a certain number of seconds, when not specified, use the local
-    ip-address to generate a random offset. This way, the load is spread when a large number of servers (hundreds or
-    even thousands) simultaneously push their data.
-    Push at most `count` files.
+def push_domains_info(queue_path=None, count=DEFAULT_DOMAIN_COUNT_PER_POST, interval=0,
+                      interval_offset=0, attempts=10, channel=None):
+    """Claim the files from the queue at `queue_path` and push them to the Sitekick server.
+    The first POST is sent `interval_offset` seconds after the start. When not specified, it waits for the slot of this
+    host within the `interval`, which is derived from the host name and IP address: the same on every run, and different
+    for every host. This way, the load is spread when a large number of servers (hundreds or even thousands)
+    simultaneously push their data. The next POSTs start `interval` seconds after the previous one, and the POSTs per
+    second and bytes per second are capped on top of that (see `sitekick.pacing`).
+    Start with batches of `count` files, the batch size is adapted to the size of the files and the response time
+    of the Sitekick server (see `sitekick.batching`).
+    With a `channel`, the records are taken from the parallel collector until it closes the channel, then the files
+    it spilled to the queue are pushed. When the Sitekick server is unreachable, the records from the channel are
+    spilled to the queue, for the next run.
+    With `config.PUSH_IN_FLIGHT` above 1, the asynchronous engine keeps that many POSTs in flight at the same time
+    (see `sitekick.push_async`), unless the Sitekick server is reached through a proxy.
+    A 429 or 503 response slows the POSTs down and its Retry-After is honored (see `sitekick.throttle.RateController`),
+    failed POSTs are retried after a backoff with full jitter.
     Continue until no more files are found."""
+    with metrics.timer('stage', stage='push'):
+        _push_domains_info(queue_path, count, interval, interval_offset, attempts, channel)
+
+
+def _push_domains_info(queue_path, count, interval, interval_offset, attempts, channel):
     if queue_path is None:
         queue_path = config.QUEUE_PATH
     if interval_offset is None:
-        # Use the server's IP-address as seed te generate a random offset which is nonetheless repeatable:
-        random.seed(hostname + ip_address + 'push')
-        interval_offset = random.random() * interval
+        # Wait for the slot of this host within the interval, the same on every run:
+        interval_offset = slot_delay(interval, host_slot(interval))
     sitekick_url = config.SITEKICK_PUSH_URL
+    if config.PUSH_IN_FLIGHT > 1 and not uses_proxy(sitekick_url):
+        return push_domains_info_async(queue_path, count, interval_offset, attempts, channel, config.PUSH_IN_FLIGHT,
+                                       interval)
+    compression = config.PUSH_COMPRESSION
+    # In delta mode, remember the digests of the domain info accepted in this run, they are merged into the store:
+    digests = {} if config.DELTA_MODE else None
+    queue = open_queue(queue_path)
+    # Keep the connection to the Sitekick server open between the batches:
+    pool = ConnectionPool()
+    batcher = AdaptiveBatcher(count)
+    # Slow down when the Sitekick server answers 429 or 503, keep the interval between the POSTs and stay below the caps
+    # of the POSTs and bytes per second:
+    rate = RateController()
+    pacer = Pacer(interval=interval)
+    # Claimed records which are not pushed yet, with their serialized data:
+    pending = []
     total_count = 0
-    send_files_previous = []
+    if interval_offset:
+        time.sleep(interval_offset)
     while True:
-        # Start with waiting to let files enter the directory:
-        time_next = (time.time() // interval + 1) * interval + interval_offset
-        # time.sleep(
-        #     max(time_next - time.time(), interval / 2))  # prevent edge cases, always sleep at least half the interval
-        files_in_queue = list(Path(queue_path).glob('*'))
-        files_in_queue.sort(key=lambda file: file.name)
-        send_files = files_in_queue[:count]
-        if not send_files or set(send_files) == set(send_files_previous):
-            # No more files or no new files, stop pushing:
+        if len(pending) < batcher.count:
+            records = []
+            if channel is not None and not channel.finished:
+                # Only wait for the collector when there is nothing to push yet:
+                records = channel.get(batcher.count - len(pending), block=not pending)
+            if not records and (channel is None or channel.finished):
+                records = queue.claim(batcher.count - len(pending))
+            with metrics.timer('json_serialization'):
+                pending.extend((record, json.dumps(record.data)) for record in records)
+        if not pending:
+            # No more files, stop pushing:
             break
-        send_files_previous = send_files
-        data = []
-        for file in send_files:
-            with file.open() as f:
-                data.append(json.loads(f.read()))
-        # Now push the data to the Sitekick server, with a maximum `attempts` number of attempts:
+        # Now push the data to the Sitekick server, with a maximum `attempts` number of attempts. The batch is selected
+        # again for every attempt, so after a failure, a smaller batch is tried:
         for attempt in range(attempts):
-            req = Request(sitekick_url,
-                          method='POST', data=json.dumps({'data': data}).encode(),
-                          headers={'Content-Type': 'application/json',
-                                   'Accept': 'application/json'})
+            send_files = pending[:batcher.select([len(part) for record, part in pending])]
+            body = ('{"data": [' + ', '.join(part for record, part in send_files) + ']}').encode()
+            with metrics.timer('compression'):
+                payload, payload_headers = compress_body(body, compression, config.PUSH_COMPRESSION_DICTIONARY)
+            headers = {'Content-Type': 'application/json', 'Accept': 'application/json', **payload_headers}
+            metrics.count('bytes_uncompressed', len(body))
+            metrics.count('bytes_sent', len(payload))
+            retry_after = None
+            delay = max(rate.reserve(), pacer.reserve(len(payload)))
+            if delay:
+                time.sleep(delay)
+            started = time.time()
             try:
-                response = urlopen(req)
-                if 200 <= response.getcode() < 300:
+                with metrics.timer('post'):
+                    response = pool.request('POST', sitekick_url, body=payload, headers=headers)
+                metrics.count('posts', status=str(response.status))
+                if 200 <= response.status < 300:
+                    batcher.record(time.time() - started)
+                    rate.success()
                     # Remove the files from the queue:
-                    for file in send_files:
-                        file.unlink()
+                    queue.ack([record for record, part in send_files])
+                    if channel is not None:
+                        channel.acknowledged([record for record, part in send_files])
+                    if digests is not None:
+                        acknowledge(digests, [record.data for record, part in send_files])
+                    del pending[:len(send_files)]
                     total_count += len(send_files)
+                    metrics.count('domains_pushed', len(send_files))
                     print(
                         f"{now()} Sitekick pushed another {len(send_files)} of {total_count} files so far"
-                        f" to {sitekick_url}")
+                        f" ({len(body)} bytes) to {sitekick_url}")
                     break
+                if response.status == 415 and payload is not body:
+                    # The endpoint does not accept compressed bodies, send plain bodies from now on:
+                    print(f"{now()} Sitekick push to {sitekick_url} does not support {compression} compression,"
+                          f" sending uncompressed bodies")
+                    compression = None
+                    continue
+                batcher.record(time.time() - started, ok=False)
+                if response.status in BACKPRESSURE_STATUSES:
+                    # The Sitekick server is overloaded, slow down:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    rate.backpressure(retry_after)
                 print(
                     f"{now()} Sitekick push attempt {attempt + 1} of {attempts} to {sitekick_url}"
-                    f" failed with code {response.getcode()}: {response.read()}")
+                    f" failed with code {response.status}: {response.body}"
+                    f"{f' (retry after {retry_after:.0f} s)' if retry_after is not None else ''}")
             except Exception as e:
+                batcher.record(time.time() - started, ok=False)
+                metrics.count('post_errors')
                 print(
                     f"{now()} Sitekick push attempt {attempt + 1} of {attempts} to {sitekick_url}"
                     f" failed with exception: {e}")
-            time.sleep((60 ** (attempt / ((attempts - 1) or 1))))
-            # Exponential backoff, starting with 1 second, ending with 1 minute in the last attempt
+            if attempt < attempts - 1:
+                metrics.count('post_retries')
+                # Exponential backoff with full jitter, so the servers do not retry in lockstep, or the Retry-After:
+                time.sleep(backoff_delay(attempt, retry_after))
+        else:
+            # All attempts failed, leave the files in the queue for the next run and stop pushing:
+            metrics.count('push_failures')
+            queue.release([record for record, part in pending])
+            if channel is not None:
+                # Let the collector spill to the queue from now on, and spill the records in memory:
+                channel.spill_remaining([record for record, part in pending],
+                                        lambda record: queue.put(record.index, record.domain, record.data))
+            break
+    pool.close()
+    queue.close()
+    if digests is not None:
+        save_digests(digests)
     print(f"{now()} Sitekick pushed total {total_count} files to {sitekick_url}")
 
 
 def get_server_modules(root_module='providers', filter=None):
-    """Inspect all server modules and see which ones are valid by calling is_server_type(). When the module is valid,
-    it is returned."""
-    if filter is None:
-        filter = lambda module: True
-    valid_modules = []
-    for filename in Path(__file__).parent.parent.glob(f'{root_module}/*.py'):
-        if filename.stem == '__init__':
-            continue
-        if not filter(filename.stem):
-            continue
-        try:
-            module = import_module(f"{root_module}.{filename.stem}")
-            # A valid to_sitekick module should have three functions: is_server_type, get_domains and get_domain_info:
-            for function in ['is_server_type', 'get_domains', 'get_domain_info']:
-                if not hasattr(module, function):
-                    raise AttributeError(f"Module {root_module}.{filename.stem} has no function {function}")
-            try:
-                if module.is_server_type():
-                    valid_modules.append(module)
-            except Exception as e:
-                print(f"{root_module}.{filename.stem}.is_server_type(): False ({e})")
-        except Exception as e:
-            print(f"Error importing module {root_module}.{filename.stem}: {e}")
-    return valid_modules
+    """Return the valid server modules, for which is_server_type() returns True-ish. The result is cached per host in
+    the provider registry (see `sitekick.registry`), so only the valid modules are imported."""
+    return registry.get_server_modules(root_module, filter)
+
+
+def send_module(module, domain_count_per_post=None, domain_post_interval=None, execute_parallel=False,
+                queue_path=None, limiter=None):
+    """Let the two functions (get_domains_info and push_domains_info) run for a valid server module. The count and
+    interval per post are taken from the module, unless specified. With a `limiter`, the get_domain_info calls share
+    the limiter with the other providers."""
+    count = int(domain_count_per_post if domain_count_per_post is not None \
+                    else getattr(module, 'DOMAIN_COUNT_PER_POST') or DEFAULT_DOMAIN_COUNT_PER_POST)
+    interval = float(domain_post_interval if domain_post_interval is not None \
+                         else getattr(module, 'DOMAIN_POST_INTERVAL') or DEFAULT_DOMAIN_POST_INTERVAL)
+    # The number of domains to collect concurrently, the command line (or config) overrides the module:
+    workers = int(config.COLLECT_WORKERS or getattr(module, 'COLLECT_WORKERS', None) or 1)
+    get_domain_info = module.get_domain_info
+    # Optional: a cheap change stamp per domain, to skip collecting unchanged domains:
+    get_domain_fingerprint = getattr(module, 'get_domain_fingerprint', None)
+    # Collect one shard of the domains per run, unless the module is not sharded (like the debug commands):
+    collect_kwargs = {'workers': workers, 'queue_path': queue_path, 'get_domain_fingerprint': get_domain_fingerprint,
+                      'shards': config.SHARDS if getattr(module, 'SHARDED', True) else 1, 'shard': config.SHARD}
+    if limiter is not None:
+        get_domain_info = limiter.wrap(get_domain_info, module.__name__)
+    # The first POST waits for the slot of this host within the interval:
+    push_kwargs = {'count': count, 'interval': interval, 'interval_offset': None, 'queue_path': queue_path}
+    parallel = execute_parallel if execute_parallel is not None else getattr(module, 'EXECUTE_PARALLEL', True)
+    if parallel:
+        # Default: get domain info and send to sitekick server in parallel, handing the info over in memory:
+        channel = Channel(config.CHANNEL_SIZE)
+        threads = [
+            threading.Thread(target=get_domains_info, args=(module.get_domains, get_domain_info),
+                             kwargs=dict(collect_kwargs, cutoff_lines=1000000000, channel=channel)),
+            threading.Thread(target=push_domains_info, kwargs=dict(push_kwargs, channel=channel))
+        ]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+    else:
+        # Execute serially:
+        get_domains_info(module.get_domains, get_domain_info, **collect_kwargs)
+        push_domains_info(**push_kwargs)
 
 
 # def send_domains(domain_count_per_post=None, domain_post_interval=None, execute_parallel=None):
 def send_domains(domain_count_per_post=None, domain_post_interval=None, execute_parallel=False,
-                 filter_modules=None):
-    # Now let the two functions (get_domains_info and push_domains_info) run for valid server modules:
-    for module in get_server_modules(filter=filter_modules):
-        count = int(domain_count_per_post if domain_count_per_post is not None \
-                        else getattr(module, 'DOMAIN_COUNT_PER_POST') or DEFAULT_DOMAIN_COUNT_PER_POST)
-        interval = float(domain_post_interval if domain_post_interval is not None \
-                             else getattr(module, 'DOMAIN_POST_INTERVAL') or DEFAULT_DOMAIN_POST_INTERVAL)
-        push_kwargs = {'count': count, 'interval': interval}
-        parallel = execute_parallel if execute_parallel is not None else getattr(module, 'EXECUTE_PARALLEL', True)
-        if parallel:
-            # Default: get domain info and send to sitekick server in parallel
-            threads = [
-                threading.Thread(target=get_domains_info, args=(module.get_domains, module.get_domain_info),
-                                 kwargs={'cutoff_lines': 1000000000}),
-                threading.Thread(target=push_domains_info, kwargs=push_kwargs)
-            ]
-            for thread in threads:
-                thread.start()
-
-            for thread in threads:
-                thread.join()
-        else:
-            # Execute serially:
-            get_domains_info(module.get_domains, module.get_domain_info)
-            push_domains_info(**push_kwargs)
+                 filter_modules=None, parallel_providers=None):
+    """Send the domains of all valid server modules, one module after another. With `parallel_providers`, the
+    modules run concurrently, each with its own queue (see `sitekick.queues.provider_queue_path`) and its own count
+    and interval per post. At most `config.MAX_CONCURRENCY` get_domain_info calls run at the same time, shared
+    fairly between the modules. A failing module does not stop the others.
+    At the end, the counters and timers of the run are written as a JSON report and a Prometheus textfile (see
+    `sitekick.metrics`), with the throttling decisions of the governor (see `sitekick.throttle.Governor`)."""
+    metrics.reset()
+    governor.reset()
+    try:
+        _send_domains(domain_count_per_post, domain_post_interval, execute_parallel, filter_modules,
+                      parallel_providers)
+    finally:
+        try:
+            report_path, prometheus_path = write_run_report(throttle=governor.summary())
+            print(f"{now()} Sitekick run report written to {report_path} and {prometheus_path}")
+        except Exception as e:
+            print(f"{now()} Sitekick run report could not be written: {e}")
+
+
+def _send_domains(domain_count_per_post, domain_post_interval, execute_parallel, filter_modules, parallel_providers):
+    if parallel_providers is None:
+        parallel_providers = config.PARALLEL_PROVIDERS
+    modules = get_server_modules(filter=filter_modules)
+    if not parallel_providers or len(modules) < 2:
+        for module in modules:
+            send_module(module, domain_count_per_post, domain_post_interval, execute_parallel)
+        return
+    limiter = FairLimiter(config.MAX_CONCURRENCY)
+
+    def send_provider(module):
+        try:
+            send_module(module, domain_count_per_post, domain_post_interval, execute_parallel,
+                        queue_path=provider_queue_path(config.QUEUE_PATH, module.__name__.split('.')[-1]),
+                        limiter=limiter)
+        except Exception as e:
+            print(f"{now()} Sitekick provider {module.__name__} failed with exception: {e}")
+
+    threads = [threading.Thread(target=send_provider, args=(module,)) for module in modules]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,25 @@
+"""Sharded collection: the domains are split in `config.SHARDS` stable shards by a hash of the domain name, and every
+run collects only one shard. With 24 shards and an hourly run (`install hourly`), the load of the collection is spread
+over the day and every domain is still collected once a day.
+"""
+import hashlib
+import time
+
+SHARD_PERIOD = 3600  # seconds per shard, the shard of a run follows the hour
+
+
+def shard_of(domain, shards):
+    """Return the shard (0 up to `shards`) of the domain. The shard only depends on the domain name, so a domain stays
+    in the same shard on every run and every server."""
+    if shards <= 1:
+        return 0
+    digest = hashlib.sha1(str(domain).strip().lower().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def current_shard(shards, now=None):
+    """Return the shard for a run at `now` (default: the current time): the shards follow each other every
+    `SHARD_PERIOD` seconds, so hourly runs collect all shards in `shards` hours."""
+    if shards <= 1:
+        return 0
+    return int((time.time() if now is None else now) // SHARD_PERIOD) % shards
@@ -1,8 +1,12 @@
 import random
+import time
+from collections.abc import Iterable
 from importlib import import_module
-from pathlib import Path
+from itertools import islice
 from pprint import pprint
 
+from sitekick.registry import file_signature, provider_files
+
 
 def get_server_modules(root_module='providers', filter=None):
     """Inspect all server modules and see which ones are valid by calling is_server_type(). When the module is valid,
@@ -10,25 +14,23 @@ def get_server_modules(root_module='providers', filter=None):
     modules = []
     if filter is None:
         filter = lambda module: True
-    for filename in Path(__file__).parent.parent.glob(f'{root_module}/*.py'):
-        if filename.stem == '__init__':
-            continue
-        if not filter(filename.stem):
+    for name in provider_files(root_module):
+        if not filter(name):
             continue
         try:
-            module = import_module(f"{root_module}.{filename.stem}")
+            module = import_module(f"{root_module}.{name}")
             modules.append(module)
         except Exception as e:
-            print(f"Error importing module {root_module}.{filename.stem}: {e}")
+            print(f"Error importing module {root_module}.{name}: {e}")
     return modules
 
 def test_modules(which_modules=None):
     """Test all modules, or the specified modules."""
     if which_modules is None or which_modules == 'latest':
-        # No module specified; get the most recently changed module:
-        modules = get_server_modules()
-        modules.sort(key=lambda module: Path(module.__file__).stat().st_mtime, reverse=True)
-        modules = modules[:1]
+        # No module specified; get the most recently changed module, without importing the others:
+        files = provider_files()
+        latest = max(files, key=lambda name: file_signature(files[name])[0])
+        modules = get_server_modules(filter=lambda module: module == latest)
     elif which_modules == 'all':
         # Get all modules:
         modules = get_server_modules()
@@ -46,11 +48,22 @@ def test_modules(which_modules=None):
         else:
             print(f"Error in {module.__name__}: no function is_server_type()")
         try:
+            started = time.time()
             domains = module.get_domains()
-            if not isinstance(domains, list):
-                print(f"Error in {module.__name__}.get_domains(): returned value is not a list")
+            if isinstance(domains, (str, bytes, dict)) or not isinstance(domains, Iterable):
+                print(f"Error in {module.__name__}.get_domains(): returned value is not a list or an iterator")
+                domains = []
             else:
-                print(f"Found {len(domains)} domains in {module.__name__}.get_domains()")
+                if not isinstance(domains, list):
+                    # An iterator or generator: the domains are collected while it is iterated, so show how soon the
+                    # first domain is available:
+                    iterator = iter(domains)
+                    domains = list(islice(iterator, 1))
+                    print(f"{module.__name__}.get_domains() returned an iterator, first domain after "
+                          f"{time.time() - started:.3f} seconds")
+                    domains.extend(iterator)
+                print(f"Found {len(domains)} domains in {module.__name__}.get_domains() in "
+                      f"{time.time() - started:.3f} seconds")
                 if len(set(domains)) != len(domains):
                     print(f"{module.__name__}.get_domains(): duplicate domains found, {len(domains) - len(set(domains))} duplicates.")
                 if domains:
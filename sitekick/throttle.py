@@ -0,0 +1,322 @@
+"""Limits on the work done by the collectors and pushers, so the hosting server and the Sitekick server are not
+overloaded."""
+import email.utils
+import functools
+import itertools
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from sitekick import config
+from sitekick.metrics import metrics
+
+IO_PRESSURE_PATH = '/proc/pressure/io'
+MAX_DECISIONS = 100  # throttling decisions kept for the run report
+BACKPRESSURE_STATUSES = (429, 503)  # the Sitekick server asks to slow down
+RETRY_AFTER_JITTER = 0.25  # wait up to this fraction longer than Retry-After, so the servers do not return in lockstep
+
+
+class FairLimiter:
+    """Limit the number of concurrent calls over all owners (e.g. providers) to `limit`. When a slot becomes free, it
+    goes to the waiting owner with the fewest active slots, so a provider with many workers cannot starve the others.
+    Waiters of the same owner are served first come, first served."""
+
+    def __init__(self, limit):
+        self.limit = max(int(limit), 1)
+        self._active = {}
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def _is_next(self, entry):
+        if sum(self._active.values()) >= self.limit:
+            return False
+        return entry == min(self._waiting, key=lambda waiting: (self._active.get(waiting[1], 0), waiting[0]))
+
+    @contextmanager
+    def slot(self, owner):
+        """Wait for a slot for `owner` and hold it while the enclosed code runs."""
+        with self._condition:
+            entry = (next(self._tickets), owner)
+            self._waiting.append(entry)
+            while not self._is_next(entry):
+                self._condition.wait()
+            self._waiting.remove(entry)
+            self._active[owner] = self._active.get(owner, 0) + 1
+            # Another waiter may get a slot as well:
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[owner] -= 1
+                self._condition.notify_all()
+
+    def wrap(self, function, owner):
+        """Return `function`, limited by this limiter on behalf of `owner`."""
+        @functools.wraps(function)
+        def limited(*args, **kwargs):
+            with self.slot(owner):
+                return function(*args, **kwargs)
+        return limited
+
+
+def cpu_count():
+    """Return the number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def read_load():
+    """Return the load average of the last minute, None when it is not available (e.g. on Windows)."""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def read_io_pressure(path=IO_PRESSURE_PATH):
+    """Return the percentage of time in the last 10 seconds in which some tasks waited for I/O (Linux pressure stall
+    information), None when it is not available."""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('some '):
+                    fields = dict(item.split('=', 1) for item in line.split()[1:])
+                    return float(fields['avg10'])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+class Governor:
+    """Keep the collection from hurting the sites on the server. Every `config.GOVERNOR_INTERVAL` seconds, the load
+    average per CPU and the I/O pressure are compared with `config.GOVERNOR_MAX_LOAD` and
+    `config.GOVERNOR_MAX_IO_PRESSURE`. Above a ceiling, the number of domains collected at the same time is halved, down
+    to one; when it is still too high with one domain at a time, a pause (doubling up to `config.GOVERNOR_MAX_PAUSE`
+    seconds) is added before every domain and every subprocess. Below the ceilings, the number is increased by one
+    until the collection runs at full speed again. The decisions are kept for the run report."""
+
+    def __init__(self, load=read_load, io_pressure=read_io_pressure, cpus=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self._read_load = load
+        self._read_io_pressure = io_pressure
+        self.cpus = cpus or cpu_count()
+        self._clock = clock
+        self._sleep = sleep
+        self._condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        """Start a new run at full speed."""
+        with self._condition:
+            self.limit = None  # the number of domains collected at the same time, None: not throttled
+            self.pause = 0.0
+            self.active = 0
+            self.peak = 0
+            self.checked = None
+            self.decisions = []
+            self.paused = 0.0
+            self._condition.notify_all()
+
+    @property
+    def enabled(self):
+        return bool(config.GOVERNOR_MAX_LOAD or config.GOVERNOR_MAX_IO_PRESSURE)
+
+    def _decide(self, action, load, io_pressure):
+        decision = {'time': time.time(), 'action': action, 'limit': self.limit, 'pause': self.pause,
+                    'load_per_cpu': load, 'io_pressure': io_pressure}
+        if len(self.decisions) < MAX_DECISIONS:
+            self.decisions.append(decision)
+        metrics.count('throttle_decisions', action=action)
+        from sitekick.utils import now
+        print(f"{now()} Sitekick governor: load {'-' if load is None else f'{load:.2f}'} per CPU, I/O pressure"
+              f" {'-' if io_pressure is None else f'{io_pressure:.1f}%'}: {action}, domains at the same time:"
+              f" {self.limit or 'unlimited'}, pause: {self.pause:.1f} s")
+
+    def _update(self):
+        """Compare the load with the ceilings, at most once per interval. Call with the condition held."""
+        if not self.enabled:
+            return
+        now = self._clock()
+        if self.checked is not None and now - self.checked < config.GOVERNOR_INTERVAL:
+            return
+        self.checked = now
+        load = self._read_load()
+        load = load / self.cpus if load is not None else None
+        io_pressure = self._read_io_pressure()
+        overloaded = (bool(config.GOVERNOR_MAX_LOAD) and load is not None and load > config.GOVERNOR_MAX_LOAD) or \
+                     (bool(config.GOVERNOR_MAX_IO_PRESSURE) and io_pressure is not None
+                      and io_pressure > config.GOVERNOR_MAX_IO_PRESSURE)
+        if overloaded:
+            if self.limit == 1:
+                self.pause = min(max(self.pause * 2, config.GOVERNOR_PAUSE), config.GOVERNOR_MAX_PAUSE)
+                self._decide('pause', load, io_pressure)
+            else:
+                self.limit = max((self.limit or max(self.peak, self.active, 1)) // 2, 1)
+                self._decide('decrease', load, io_pressure)
+        elif self.pause:
+            self.pause = 0.0
+            self._decide('resume', load, io_pressure)
+        elif self.limit is not None:
+            self.limit += 1
+            if self.limit > self.peak:
+                self.limit = None
+                self._decide('release', load, io_pressure)
+            else:
+                self._decide('increase', load, io_pressure)
+            self._condition.notify_all()
+
+    def pace(self):
+        """Wait for the pause, if any. Called before every subprocess (see `sitekick.utils.cli`)."""
+        with self._condition:
+            self._update()
+            pause = self.pause
+        if pause:
+            metrics.observe('throttle_pause', pause)
+            with self._condition:
+                self.paused += pause
+            self._sleep(pause)
+
+    @contextmanager
+    def slot(self):
+        """Wait until another domain may be collected, and hold the slot while the enclosed code runs."""
+        with self._condition:
+            while True:
+                self._update()
+                if self.limit is None or self.active < self.limit:
+                    break
+                self._condition.wait(config.GOVERNOR_INTERVAL)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            self.pace()
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    def wrap(self, function):
+        """Return `function`, governed by this governor."""
+        @functools.wraps(function)
+        def governed(*args, **kwargs):
+            with self.slot():
+                return function(*args, **kwargs)
+        return governed
+
+    def summary(self):
+        """Return the throttling decisions of the run, for the run report."""
+        with self._condition:
+            return {'cpus': self.cpus, 'max_load_per_cpu': config.GOVERNOR_MAX_LOAD,
+                    'max_io_pressure': config.GOVERNOR_MAX_IO_PRESSURE, 'paused_seconds': self.paused,
+                    'decisions': list(self.decisions)}
+
+
+governor = Governor()
+
+
+@functools.lru_cache(maxsize=None)
+def _which(program):
+    return shutil.which(program)
+
+
+def niced(command):
+    """Return the command, prefixed with `nice` and `ionice` with the configured `config.CHILD_NICE` and
+    `config.CHILD_IONICE_CLASS` (and `config.CHILD_IONICE_LEVEL`), when these tools are available. A command which
+    cannot be found is returned unchanged, so it fails like before."""
+    if not isinstance(command, (list, tuple)) or not command or not _which(str(command[0])):
+        return command
+    prefix = []
+    if config.CHILD_IONICE_CLASS and _which('ionice'):
+        prefix += ['ionice', '-c', str(config.CHILD_IONICE_CLASS)]
+        if int(config.CHILD_IONICE_CLASS) != 3 and config.CHILD_IONICE_LEVEL is not None:
+            # The idle class has no level:
+            prefix += ['-n', str(config.CHILD_IONICE_LEVEL)]
+    if config.CHILD_NICE and _which('nice'):
+        prefix += ['nice', '-n', str(config.CHILD_NICE)]
+    return prefix + list(command)
+
+
+def parse_retry_after(value, now=None):
+    """Return the number of seconds to wait from a `Retry-After` header, in seconds or as an HTTP date, capped at
+    `config.PUSH_MAX_RETRY_AFTER`. None when there is no (valid) header."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if date is None:
+            return None
+        seconds = date.timestamp() - (time.time() if now is None else now)
+    return min(max(seconds, 0.0), config.PUSH_MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt, retry_after=None, rng=random):
+    """Return the seconds to wait before the next attempt: a random time between 0 and the exponential backoff of the
+    attempt (`config.PUSH_BACKOFF_BASE` doubled per attempt, at most `config.PUSH_BACKOFF_MAX`), the "full jitter"
+    backoff. With a `retry_after` from the server, wait at least that long, plus a random part of it."""
+    if retry_after is not None:
+        return retry_after * (1 + rng.uniform(0, RETRY_AFTER_JITTER))
+    return rng.uniform(0, min(config.PUSH_BACKOFF_MAX, config.PUSH_BACKOFF_BASE * 2 ** attempt))
+
+
+class RateController:
+    """Additive increase, multiplicative decrease (AIMD) of the POSTs to the Sitekick server. When the server answers
+    429 or 503, the POSTs in flight (the window) and the rate of POSTs per second are halved, and no POST is started
+    before its `Retry-After`. Every accepted POST increases the rate by `config.PUSH_RATE_INCREASE` POSTs per second and
+    the window by one POST per window. The rate is only limited after the first backpressure: it starts at the rate
+    measured until then."""
+
+    def __init__(self, max_window=1, clock=time.monotonic):
+        self.max_window = max(int(max_window), 1)
+        self.window = float(self.max_window)
+        self.rate = None  # POSTs per second, None: not limited
+        self.hold_until = 0.0
+        self.next_start = 0.0
+        self.backpressure_count = 0
+        self._clock = clock
+        self._starts = deque(maxlen=10)
+
+    def allowed(self):
+        """Return the number of POSTs which may be in flight."""
+        return max(int(self.window), 1)
+
+    def reserve(self):
+        """Reserve the start of the next POST, return the seconds to wait for it."""
+        now = self._clock()
+        start = max(now, self.hold_until, self.next_start)
+        if self.rate:
+            self.next_start = start + 1 / self.rate
+        self._starts.append(start)
+        return start - now
+
+    def _measured_rate(self):
+        if len(self._starts) < 2 or self._starts[-1] <= self._starts[0]:
+            return 1.0
+        return (len(self._starts) - 1) / (self._starts[-1] - self._starts[0])
+
+    def success(self):
+        if self.rate is not None:
+            self.rate += config.PUSH_RATE_INCREASE
+        self.window = min(self.window + 1 / self.window, self.max_window)
+
+    def backpressure(self, retry_after=None):
+        """The server asked to slow down, wait at least `retry_after` seconds before the next POST."""
+        self.backpressure_count += 1
+        self.rate = max((self.rate or self._measured_rate()) / 2, config.PUSH_MIN_RATE)
+        self.window = max(self.window / 2, 1.0)
+        if retry_after:
+            self.hold_until = max(self.hold_until, self._clock() + retry_after)
+        metrics.count('post_backpressure')
@@ -1,34 +1,171 @@
 import datetime
+import functools
 import hashlib
 import hmac
+import json
+import os
+import re
 import socket
 import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
 from uuid import getnode
 
-hostname = socket.gethostname()
-ip_address = socket.gethostbyname(hostname)
-try:
-    mac_address = ':'.join(("%012X" % getnode())[i:i + 2] for i in range(0, 12, 2))
-except:
-    mac_address = None
+from sitekick import config
+from sitekick.metrics import metrics
+from sitekick.queues import queue_location
+from sitekick.throttle import governor, niced
+
+IDENTITY_FILENAME = 'identity.json'
+REDACTION_MEMO_SIZE = 4096  # pseudonyms kept in memory
 
 
 def now():
     return datetime.datetime.now().astimezone().isoformat()
 
 
+def state_path(name):
+    """Return the path of the persistent state file `name`. State is kept next to the queue directory or database, so
+    a custom `--queue-path` also moves the state and the queue itself only contains domain info."""
+    return queue_location(config.QUEUE_PATH).parent / name
+
+
+def resolve(name, timeout):
+    """Return the IP address of the host name, None when it cannot be resolved within `timeout` seconds. The lookup
+    runs in a daemon thread, so a hanging resolver does not block the caller."""
+    result = []
+
+    def lookup():
+        try:
+            result.append(socket.gethostbyname(name))
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=lookup, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def outbound_ip_address():
+    """Return the address of the interface with the default route, without sending anything (UDP connect only selects
+    the route). Falls back to the loopback address."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.connect(('192.0.2.1', 9))
+            return udp.getsockname()[0]
+    except Exception:
+        return '127.0.0.1'
+
+
+class HostIdentity:
+    """The host name, IP address and MAC address of this server, determined on first use instead of at import, with a
+    resolver timeout of `config.RESOLVER_TIMEOUT` seconds. When the resolver does not answer in time, the address of
+    the outbound interface is used. The identity is kept in the process and in a cache file next to the queue, which is
+    refreshed after `config.IDENTITY_REFRESH` seconds or when the host name changed."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._identity = None
+        self._lock = threading.Lock()
+
+    def _cache_path(self):
+        return Path(self.path) if self.path else state_path(IDENTITY_FILENAME)
+
+    def _load(self, hostname):
+        try:
+            with self._cache_path().open() as f:
+                identity = json.loads(f.read())
+            if identity['hostname'] == hostname and time.time() - identity['created'] < config.IDENTITY_REFRESH:
+                return identity
+        except Exception:
+            pass
+        return None
+
+    def _determine(self, hostname):
+        ip_address = resolve(hostname, config.RESOLVER_TIMEOUT) or outbound_ip_address()
+        try:
+            mac_address = ':'.join(("%012X" % getnode())[i:i + 2] for i in range(0, 12, 2))
+        except Exception:
+            mac_address = None
+        identity = {'hostname': hostname, 'ip_address': ip_address, 'mac_address': mac_address, 'created': time.time()}
+        try:
+            path = self._cache_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with temp_path.open('w') as f:
+                f.write(json.dumps(identity))
+            os.replace(str(temp_path), str(path))
+        except Exception:
+            # Not being able to cache the identity is no reason to stop:
+            pass
+        return identity
+
+    def get(self):
+        """Return the identity as a dictionary with the keys hostname, ip_address and mac_address."""
+        with self._lock:
+            if self._identity is None:
+                # Getting the host name does not use the resolver:
+                hostname = socket.gethostname()
+                self._identity = self._load(hostname) or self._determine(hostname)
+            return self._identity
+
+    def reset(self):
+        """Forget the identity of this process, it is determined again on the next use."""
+        with self._lock:
+            self._identity = None
+
+    @property
+    def hostname(self):
+        return self.get()['hostname']
+
+    @property
+    def ip_address(self):
+        return self.get()['ip_address']
+
+    @property
+    def mac_address(self):
+        return self.get()['mac_address']
+
+
+identity = HostIdentity()
+
+
+def __getattr__(name):
+    """Keep `from sitekick.utils import hostname, ip_address, mac_address` working for third-party providers: the
+    identity is only determined when one of these names is imported. The providers in this repository use
+    `identity.hostname` etc. at call time, so importing them does not determine the identity."""
+    if name in ('hostname', 'ip_address', 'mac_address'):
+        return getattr(identity, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ is not available before Python 3.7, determine the identity (cached) at import:
+    hostname, ip_address, mac_address = identity.hostname, identity.ip_address, identity.mac_address
+
+
 def cli(command, include_stderr=True):
     """Execute the specified command as the current user from the command line interface (cli). Specify the command as
      a list with the arguments, the *popen args.
      Return the output as a string. Returns only stdout, if stderr is also needed, set include_stderr=True and both are
     returned as a tuple.
      """
+    # Time the subprocesses per program, e.g. `plesk`:
+    program = os.path.basename(str(command[0] if isinstance(command, (list, tuple)) and command else command))
+    # Wait when the server is too busy, and run the command with a lower CPU and I/O priority (see sitekick.throttle):
+    governor.pace()
     # In Python 3.6, you use stdout=PIPE to capture the output
     try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with metrics.timer('subprocess', command=program):
+            result = subprocess.run(niced(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     except Exception as e:
+        metrics.count('subprocess_errors', command=program)
         print(f"Error executing command: {e}")
         return str(command) + " failed:\n" + str(e)
+    metrics.count('subprocess_output_bytes', len(result.stdout) + len(result.stderr), command=program)
     # The output is in bytes, so you must decode it to a string
     if include_stderr:
         return result.stdout.decode('utf-8') + result.stderr.decode('utf-8')
@@ -51,3 +188,65 @@ def obfuscate(value: str, psk: str, *, length: int = 16) -> str:
 
     mac = hmac.new(psk.encode("utf-8"), value.encode("utf-8"), hashlib.sha256).digest()
     return mac[:length].hex()
+
+
+@functools.lru_cache(maxsize=REDACTION_MEMO_SIZE)
+def pseudonym(value, psk):
+    """Memoized `obfuscate`: many domains share the same owner and administrator, so the same values are pseudonymized
+    over and over. The psk is part of the key, so a different psk gives a different pseudonym."""
+    return obfuscate(value, psk)
+
+
+class Redactor:
+    """Pseudonymize the values of the personal data fields (e.g. `Owner's contact name`), in the text output of a
+    control panel or in a dict. The fields are compiled into a single pattern, so a text is scanned once for all fields.
+    A redactor can also be called as `redactor(key, value)`, to redact the values while parsing (see
+    `providers.plesk.parse_domain_info`)."""
+
+    def __init__(self, fields=None, psk=None):
+        self.fields = tuple(config.GDPR_FIELDS if fields is None else fields)
+        self.psk = config.GDPR_PSK if psk is None else psk
+        self._keys = {field.lower() for field in self.fields}
+        # The longest field first, so a field which is a prefix of another field does not take its place:
+        alternatives = '|'.join(re.escape(field) for field in sorted(self.fields, key=len, reverse=True))
+        self.pattern = re.compile(rf"((?:{alternatives})\s*:?\s*)(.+)", re.IGNORECASE) if self.fields else None
+
+    def __call__(self, key, value):
+        return self.redact_value(key, value)
+
+    def redact_value(self, key, value):
+        """Return the pseudonym of the value when the key is a personal data field, else the value itself."""
+        if value and isinstance(value, str) and key.lower() in self._keys:
+            return pseudonym(value, self.psk)
+        return value
+
+    def redact_text(self, text):
+        """Return the text with the values of the personal data fields (`field: value` or `field   value` lines)
+        replaced by their pseudonyms."""
+        if self.pattern is None or not text:
+            return text
+        return self.pattern.sub(lambda match: match.group(1) + pseudonym(match.group(2), self.psk), text)
+
+    def redact(self, data):
+        """Return a copy of the data (a dict, list or text) with the personal data pseudonymized: the values of the
+        personal data fields, and the fields in the texts."""
+        if isinstance(data, dict):
+            return {key: self.redact_value(key, value) if isinstance(value, str) and key.lower() in self._keys
+                    else self.redact(value) for key, value in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [self.redact(item) for item in data]
+        if isinstance(data, str):
+            return self.redact_text(data)
+        return data
+
+
+_redactors = {}
+
+
+def get_redactor():
+    """Return the redactor for the configured personal data fields and psk."""
+    key = (tuple(config.GDPR_FIELDS), config.GDPR_PSK)
+    redactor = _redactors.get(key)
+    if redactor is None:
+        redactor = _redactors[key] = Redactor(*key)
+    return redactor
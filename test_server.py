@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
-"""Simple HTTP server that echoes incoming API calls."""
+"""Simple HTTP server that echoes incoming API calls. Compressed bodies are decoded before they are echoed."""
 import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
+from sitekick.compression import DICTIONARY_HEADER, decompress_body
+
 
 class EchoHandler(BaseHTTPRequestHandler):
+    # Quiet: do not print the requests and answer with a short JSON status instead of the echo (see sitekick.bench):
+    quiet = False
+
     def _read_body(self):
         length = int(self.headers.get('Content-Length', 0))
         if length <= 0:
@@ -20,6 +25,22 @@ class EchoHandler(BaseHTTPRequestHandler):
 
     def _handle(self):
         body = self._read_body()
+        encoding = self.headers.get('Content-Encoding')
+        try:
+            body = decompress_body(body, encoding, self.headers.get(DICTIONARY_HEADER))
+        except ValueError as e:
+            # Unknown encoding or dictionary: let the client fall back to plain bodies.
+            self._send_response(json.dumps({"error": str(e)}).encode("utf-8"), status=415)
+            return
+        except Exception as e:
+            self._send_response(json.dumps({"error": "invalid %s body: %s" % (encoding, e)}).encode("utf-8"),
+                                status=400)
+            return
+        if self.quiet:
+            self._send_response(json.dumps({"status": "ok", "bytes": len(body)}).encode("utf-8"))
+            return
+        if encoding:
+            print("Decoded %s body: %s bytes" % (encoding, len(body)))
         body_text = body.decode('utf-8', errors='replace')
         if body_text:
             try:
@@ -52,6 +73,8 @@ class EchoHandler(BaseHTTPRequestHandler):
         self._handle()
 
     def log_message(self, format, *args):
+        if self.quiet:
+            return
         # Keep logs concise in console.
         print("%s - - %s" % (self.address_string(), format % args))
 
@@ -1,8 +1,94 @@
+import json
 import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+import pytest
+
 
 # Ensure the repository root is importable so `import sitekick` works when running `pytest`.
 REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
+
+from sitekick.compression import DICTIONARY_HEADER, decompress_body  # noqa: E402
+
+
+class PushServer(ThreadingHTTPServer):
+    """Local Sitekick push endpoint. Records every request and answers with the next status from `statuses` (200 when
+    exhausted), after `delay` seconds. Supports keep-alive, so connection reuse can be checked through `connections`.
+    The highest number of requests handled at the same time is kept in `max_active`."""
+    daemon_threads = True
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.connections = set()
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), PushHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/push"
+
+    @property
+    def domains(self):
+        return [[item['domain'] for item in request['data']] for request in self.requests if request['status'] < 300]
+
+
+class PushHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        encoding = self.headers.get('Content-Encoding')
+        self.server.connections.add(self.client_address)
+        self.server.requests.append({
+            'status': status,
+            'encoding': encoding,
+            'headers': dict(self.headers),
+            'data': json.loads(decompress_body(body, encoding, self.headers.get(DICTIONARY_HEADER)))['data'],
+        })
+        response = json.dumps({'status': status}).encode()
+        self.send_response(status)
+        for name, value in getattr(self.server, 'response_headers', {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def push_server():
+    server = PushServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_governor(monkeypatch):
+    """The tests must not slow down when the machine running them is busy: disable the ceilings of the governor."""
+    from sitekick import config
+    from sitekick.throttle import governor
+    monkeypatch.setattr(config, 'GOVERNOR_MAX_LOAD', None)
+    monkeypatch.setattr(config, 'GOVERNOR_MAX_IO_PRESSURE', None)
+    governor.reset()
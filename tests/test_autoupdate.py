@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import runpy
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+SCRIPT_PATH = Path(__file__).resolve().parents[1] / "domains-to-sitekick.py"
+TIMESTAMP = "2026-02-06T12:00:00.000+00:00"
+
+
+class ReleaseServer(ThreadingHTTPServer):
+    """Local release listing with an ETag, and the files it lists. Records the path and status of every request."""
+    daemon_threads = True
+
+    def __init__(self):
+        self.files = {}
+        self.etag = '"release-1"'
+        self.requests = []
+        self.listing_fields = {}
+        super().__init__(('127.0.0.1', 0), ReleaseHandler)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}/{path}"
+
+    def listing(self):
+        return [dict({"path": str(Path(name).parent), "name": Path(name).name, "_timestamp_": TIMESTAMP,
+                      "content": self.url(f"files/{name}")}, **self.listing_fields.get(name, {}))
+                for name in self.files]
+
+
+class ReleaseHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/releases':
+            if self.headers.get('If-None-Match') == self.server.etag:
+                return self.answer(304)
+            return self.answer(200, json.dumps(self.server.listing()).encode(), {'ETag': self.server.etag})
+        name = self.path[len('/files/'):]
+        if name not in self.server.files:
+            return self.answer(404)
+        self.answer(200, self.server.files[name])
+
+    def answer(self, status, body=b'', headers=None):
+        self.server.requests.append((self.path, status))
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def release_server():
+    server = ReleaseServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def load_code(monkeypatch, release_server):
+    monkeypatch.setattr(socket, "gethostname", lambda: "not-local-testing-host")
+    script = runpy.run_path(str(SCRIPT_PATH), run_name="domains_to_sitekick")
+    load_code = script['load_code']
+    monkeypatch.setitem(load_code.__globals__, 'CODE_ENDPOINT', release_server.url('releases'))
+    return load_code
+
+
+def test_unchanged_release_costs_a_single_304(load_code, release_server, tmp_path):
+    release_server.files = {'sitekick/a.py': b"A = 1\n", 'providers/b.py': b"B = 2\n"}
+    load_code(tmp_path)
+    assert (tmp_path / 'sitekick' / 'a.py').read_bytes() == b"A = 1\n"
+    assert (tmp_path / 'providers' / 'b.py').read_bytes() == b"B = 2\n"
+    assert len(release_server.requests) == 3
+
+    release_server.requests.clear()
+    load_code(tmp_path)
+    assert release_server.requests == [('/releases', 304)]
+
+
+def test_failed_verification_keeps_the_current_code(load_code, release_server, tmp_path):
+    release_server.files = {'sitekick/a.py': b"A = 1\n"}
+    load_code(tmp_path)
+
+    release_server.etag = '"release-2"'
+    release_server.files = {'sitekick/a.py': b"A = 2\n", 'sitekick/c.py': b"C = (\n"}
+    release_server.listing_fields['sitekick/a.py'] = {'_timestamp_': "2026-02-07T12:00:00.000+00:00"}
+    load_code(tmp_path)
+    # The syntax error in c.py rejects the whole set, also the valid a.py:
+    assert (tmp_path / 'sitekick' / 'a.py').read_bytes() == b"A = 1\n"
+    assert not (tmp_path / 'sitekick' / 'c.py').exists()
+    assert sorted(path.name for path in (tmp_path / 'sitekick').iterdir()) == ['a.py']
+
+    # The manifest is not updated, so the next run downloads the (fixed) release again:
+    release_server.files['sitekick/c.py'] = b"C = 3\n"
+    release_server.requests.clear()
+    load_code(tmp_path)
+    assert (tmp_path / 'sitekick' / 'a.py').read_bytes() == b"A = 2\n"
+    assert (tmp_path / 'sitekick' / 'c.py').read_bytes() == b"C = 3\n"
+    assert ('/releases', 200) in release_server.requests
+
+
+def test_listed_sha256_is_verified(load_code, release_server, tmp_path):
+    release_server.files = {'README.md': b"new readme\n"}
+    release_server.listing_fields['README.md'] = {'sha256': hashlib.sha256(b"other").hexdigest()}
+    load_code(tmp_path)
+    assert not (tmp_path / 'README.md').exists()
+
+    release_server.listing_fields['README.md'] = {'sha256': hashlib.sha256(b"new readme\n").hexdigest()}
+    load_code(tmp_path)
+    assert (tmp_path / 'README.md').read_bytes() == b"new readme\n"
+
+
+def test_interrupted_swap_is_completed_by_the_next_run(load_code, release_server, tmp_path, monkeypatch):
+    release_server.files = {'sitekick/a.py': b"A = 1\n", 'sitekick/b.py': b"B = 1\n"}
+    load_code(tmp_path)
+    release_server.etag = '"release-2"'
+    release_server.files = {'sitekick/a.py': b"A = 2\n", 'sitekick/b.py': b"B = 2\n"}
+    for name in release_server.files:
+        release_server.listing_fields[name] = {'_timestamp_': "2026-02-07T12:00:00.000+00:00"}
+    replace = os.replace
+    calls = []
+
+    def crash_after_first_file(source, target):
+        calls.append(target)
+        # The first replace writes the journal, the second swaps in the first file:
+        if len(calls) == 3:
+            raise OSError('killed')
+        replace(source, target)
+
+    monkeypatch.setattr(os, 'replace', crash_after_first_file)
+    load_code(tmp_path)
+    monkeypatch.setattr(os, 'replace', replace)
+    assert (tmp_path / '.autoupdate.swap').exists()
+    assert sorted([(tmp_path / 'sitekick' / name).read_bytes() for name in ('a.py', 'b.py')]) == [b"A = 2\n",
+                                                                                                b"B = 1\n"]
+    # The next run completes the swap before it asks for the listing, which did not change since:
+    release_server.requests.clear()
+    load_code(tmp_path)
+    assert not (tmp_path / '.autoupdate.swap').exists()
+    assert (tmp_path / 'sitekick' / 'a.py').read_bytes() == b"A = 2\n"
+    assert (tmp_path / 'sitekick' / 'b.py').read_bytes() == b"B = 2\n"
+    assert release_server.requests == [('/releases', 304)]
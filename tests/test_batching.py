@@ -0,0 +1,29 @@
+from sitekick.batching import AdaptiveBatcher
+
+
+def test_select_limits_count_and_bytes():
+    batcher = AdaptiveBatcher(3, byte_budget=1000, target_latency=1, max_count=10)
+    assert batcher.select([100] * 5) == 3
+    assert batcher.select([400, 400, 400]) == 2
+    assert batcher.select([5000, 100]) == 1
+    assert batcher.select([100, 5000]) == 1
+    assert batcher.select([]) == 0
+
+
+def test_record_adapts_to_latency_and_errors():
+    batcher = AdaptiveBatcher(8, byte_budget=1000, target_latency=1, max_count=10)
+    batcher.record(0.1)
+    batcher.record(0.1)
+    batcher.record(0.1)
+    assert batcher.count == 10
+    batcher.record(0.7)
+    assert batcher.count == 10
+    batcher.record(2)
+    assert batcher.count == 7
+    assert batcher.bytes == 750
+    batcher.record(0.1, ok=False)
+    assert batcher.count == 3
+    for _ in range(5):
+        batcher.record(0.1, ok=False)
+    assert batcher.count == 1
+    assert batcher.select([100, 100]) == 1
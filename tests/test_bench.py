@@ -0,0 +1,30 @@
+from sitekick import bench
+
+
+def test_run_bench_collects_and_pushes_all_domains(capsys):
+    report = bench.run_bench('60', '2', '5')
+    assert report['domains'] == 60
+    assert report['collect_workers'] == 2
+    # All domains are collected, also beyond the debug limit of the collector:
+    assert report['posts'] >= 1
+    assert report['disk_bytes'] > 60 * 1000
+    assert report['disk_bytes'] > report['wire_bytes'] / 2 > 0
+    assert 0 < report['latency_p50'] <= report['latency_p95'] <= report['latency_p99']
+    output = capsys.readouterr().out
+    assert 'Sitekick bench: 60 domains' in output
+    assert 'POST latency: p50' in output
+    # The per-batch output of the pipeline is not shown:
+    assert 'Sitekick pushed another' not in output
+
+
+def test_run_bench_turns_off_the_caps_and_parses_verbose(capsys, monkeypatch):
+    from sitekick import config
+    monkeypatch.setattr(config, 'PUSH_MAX_REQUESTS_PER_SECOND', 0.01)
+    monkeypatch.setattr(config, 'PUSH_BURST_SECONDS', 1)
+    report = bench.run_bench('10', '1', '1', '0')
+    # Ten POSTs without waiting 100 seconds between them, the cap is restored afterwards:
+    assert report['posts'] >= 2 and report['push_seconds'] < 10
+    assert config.PUSH_MAX_REQUESTS_PER_SECOND == 0.01
+    assert 'Sitekick pushed another' not in capsys.readouterr().out
+    assert [bench.parse_flag(value) for value in ('1', 'yes', 'True', '0', 'false', 'No', '', True, False)] == [
+        True, True, True, False, False, False, False, True, False]
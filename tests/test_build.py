@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import zipfile
+
+from sitekick.build import build_zipapp
+
+LIST_PROVIDERS = '''
+import sys
+sys.path.insert(0, {archive!r})
+import sitekick
+import sitekick.bench
+from sitekick.registry import provider_files
+assert sitekick.__file__.startswith({archive!r}), sitekick.__file__
+# Tracebacks show the path in the archive, not the temporary build directory:
+assert sitekick.bench.run_bench.__code__.co_filename == 'domains-to-sitekick.pyz/sitekick/bench.py'
+print(' '.join(sorted(provider_files())))
+'''
+
+
+def test_zipapp_has_the_bytecode_of_every_module(tmp_path):
+    archive = build_zipapp(tmp_path / 'domains-to-sitekick.pyz')
+    with zipfile.ZipFile(str(archive)) as zip_file:
+        names = set(zip_file.namelist())
+    assert {'__main__.py', '__main__.pyc', 'sitekick/registry.pyc', 'providers/plesk.pyc', 'test_server.pyc'} <= names
+    assert all(name[:-3] + '.pyc' in names for name in names if name.endswith('.py'))
+    assert not any('__pycache__' in name or name.startswith('tests/') for name in names)
+
+
+def test_zipapp_runs_and_finds_its_providers(tmp_path):
+    archive = str(build_zipapp(tmp_path / 'domains-to-sitekick.pyz'))
+    # Isolated mode: only the code inside the archive is importable, not the code of the repository:
+    result = subprocess.run([sys.executable, '-I', archive, '--version'], cwd=str(tmp_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 0, result.stderr
+    assert b'domains-to-sitekick' in result.stdout
+    result = subprocess.run([sys.executable, '-I', '-c', LIST_PROVIDERS.format(archive=archive)], cwd=str(tmp_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 0, result.stderr
+    assert {'debug', 'plesk'} <= set(result.stdout.decode().split())
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from sitekick import send
+from sitekick.channel import Channel
+from sitekick.checkpoint import Checkpoint, checkpoint_path
+
+
+def _collect(queue_path, domains, fail_at=None, channel=None):
+    collected = []
+
+    def get_domain_info(domain):
+        if domain == fail_at:
+            # Like a kill of the process, not caught by the retries:
+            raise KeyboardInterrupt
+        collected.append(domain)
+        return {'domain': domain}
+
+    send.get_domains_info(domains, get_domain_info, queue_path=queue_path, show_progress=False, workers=1,
+                          limit=None, channel=channel)
+    return collected
+
+
+def test_interrupted_run_resumes_where_it_stopped(tmp_path):
+    queue_path = tmp_path / 'domains'
+    domains = [f"domain-{i}.com" for i in range(6)]
+    with pytest.raises(KeyboardInterrupt):
+        _collect(queue_path, domains, fail_at='domain-3.com')
+    checkpoint = Checkpoint.load(checkpoint_path(queue_path))
+    assert checkpoint.completed == {'domain-0.com', 'domain-1.com', 'domain-2.com'}
+    assert _collect(queue_path, domains) == ['domain-3.com', 'domain-4.com', 'domain-5.com']
+    # The domains keep their index, so the files of both runs do not mix:
+    assert sorted(path.name for path in queue_path.glob('*.json')) == [f"{i:08}-domain-{i}.com.json"
+                                                                       for i in range(6)]
+    # The run completed, the next run starts with the first domain:
+    assert not checkpoint_path(queue_path).exists()
+    assert len(_collect(queue_path, domains)) == 6
+
+
+def test_records_in_a_channel_are_not_completed_before_they_are_stored(tmp_path):
+    queue_path = tmp_path / 'domains'
+    domains = [f"domain-{i}.com" for i in range(6)]
+    channel = Channel(2)
+    with pytest.raises(KeyboardInterrupt):
+        _collect(queue_path, domains, fail_at='domain-5.com', channel=channel)
+    # domain-0 and domain-1 were only in the channel (in memory) when the process was killed, the others were spilled:
+    assert Checkpoint.load(checkpoint_path(queue_path)).completed == {'domain-2.com', 'domain-3.com', 'domain-4.com'}
+    # The records the pusher pushed are completed:
+    channel.acknowledged(channel.get(1))
+    assert Checkpoint.load(checkpoint_path(queue_path)).completed == {'domain-0.com', 'domain-2.com', 'domain-3.com',
+                                                                      'domain-4.com'}
+    assert _collect(queue_path, domains, channel=Channel(10)) == ['domain-1.com', 'domain-5.com']
+
+
+def test_checkpoint_of_other_domain_list_or_too_old_is_discarded(tmp_path, monkeypatch):
+    queue_path = f"sqlite://{tmp_path / 'queue.db'}"
+    domains = [f"domain-{i}.com" for i in range(4)]
+    with pytest.raises(KeyboardInterrupt):
+        _collect(queue_path, domains, fail_at='domain-2.com')
+    assert checkpoint_path(queue_path) == tmp_path / 'queue.db.checkpoint'
+    run_id = Checkpoint.load(checkpoint_path(queue_path)).run_id
+    # Another domain list starts a new run:
+    with pytest.raises(KeyboardInterrupt):
+        _collect(queue_path, domains + ['new.com'], fail_at='domain-2.com')
+    checkpoint = Checkpoint.load(checkpoint_path(queue_path))
+    assert checkpoint.run_id != run_id and checkpoint.completed == {'domain-0.com', 'domain-1.com'}
+    # A checkpoint older than the maximum age is not resumed:
+    monkeypatch.setattr(send.config, 'CHECKPOINT_MAX_AGE', 60)
+    monkeypatch.setattr(time, 'time', lambda now=time.time(): now + 61)
+    assert _collect(queue_path, domains + ['new.com']) == ['domain-0.com', 'domain-1.com', 'domain-2.com',
+                                                           'domain-3.com', 'new.com']
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    checkpoint = Checkpoint.start(tmp_path / 'domains', ['a.com', 'b.com'])
+    checkpoint.complete('a.com')
+    checkpoint._file.write('b.c')
+    checkpoint.close()
+    assert Checkpoint.load(checkpoint.path).completed == {'a.com'}
+    resumed = Checkpoint.start(tmp_path / 'domains', ['a.com', 'b.com'])
+    resumed.close()
+    assert resumed.resumed and resumed.run_id == checkpoint.run_id
@@ -6,6 +6,7 @@ from itertools import product
 
 import json
 import runpy
+import shutil
 import socket
 
 import urllib.request
@@ -21,10 +22,20 @@ def _reset_parser_defaults():
         config_path=config.CONFIG_PATH,
         queue_path=config.QUEUE_PATH,
         sitekick_url=config.SITEKICK_PUSH_URL,
+        collect_workers=config.COLLECT_WORKERS,
+        push_compression=config.PUSH_COMPRESSION,
+        parallel_providers=config.PARALLEL_PROVIDERS,
+        max_concurrency=config.MAX_CONCURRENCY,
+        push_in_flight=config.PUSH_IN_FLIGHT,
+        metrics_path=config.METRICS_PATH,
+        max_load=config.GOVERNOR_MAX_LOAD,
+        shards=config.SHARDS,
+        shard=config.SHARD,
         enable_autoupdate=config.ENABLE_AUTOUPDATE,
         system_info=config.SYSTEM_INFO,
         gdpr_compliant=config.GDPR_COMPLIANT,
         gdpr_psk=config.GDPR_PSK,
+        delta_mode=config.DELTA_MODE,
     )
 
 
@@ -34,10 +45,20 @@ def _restore_config():
         "CONFIG_PATH": config.CONFIG_PATH,
         "QUEUE_PATH": config.QUEUE_PATH,
         "SITEKICK_PUSH_URL": config.SITEKICK_PUSH_URL,
+        "COLLECT_WORKERS": config.COLLECT_WORKERS,
+        "PUSH_COMPRESSION": config.PUSH_COMPRESSION,
+        "PARALLEL_PROVIDERS": config.PARALLEL_PROVIDERS,
+        "MAX_CONCURRENCY": config.MAX_CONCURRENCY,
+        "PUSH_IN_FLIGHT": config.PUSH_IN_FLIGHT,
+        "METRICS_PATH": config.METRICS_PATH,
+        "GOVERNOR_MAX_LOAD": config.GOVERNOR_MAX_LOAD,
+        "SHARDS": config.SHARDS,
+        "SHARD": config.SHARD,
         "ENABLE_AUTOUPDATE": config.ENABLE_AUTOUPDATE,
         "SYSTEM_INFO": config.SYSTEM_INFO,
         "GDPR_COMPLIANT": config.GDPR_COMPLIANT,
         "GDPR_PSK": config.GDPR_PSK,
+        "DELTA_MODE": config.DELTA_MODE,
     }
     yield
     for key, value in snapshot.items():
@@ -62,6 +83,7 @@ def test_cli_overrides_apply_to_config(monkeypatch):
         "--config-path", "/tmp/custom-config",
         "--queue-path", "/tmp/queue",
         "--sitekick-url", "http://localhost:9000/push",
+        "--collect-workers", "3",
         "--enable-autoupdate",
         "--no-system-info",
         "--gdpr-compliant",
@@ -73,6 +95,7 @@ def test_cli_overrides_apply_to_config(monkeypatch):
     assert config.CONFIG_PATH == "/tmp/custom-config"
     assert config.QUEUE_PATH == "/tmp/queue"
     assert config.SITEKICK_PUSH_URL == "http://localhost:9000/push"
+    assert config.COLLECT_WORKERS == 3
     assert config.ENABLE_AUTOUPDATE is True
     assert config.SYSTEM_INFO is False
     assert config.GDPR_COMPLIANT is True
@@ -285,10 +308,10 @@ def test_config_file_then_cli_overrides_take_precedence(monkeypatch):
     assert config.GDPR_PSK == "cli-psk"
 
 
-def _run_domains_to_sitekick_with_config(monkeypatch, config_text: str):
+def _run_domains_to_sitekick_with_config(monkeypatch, config_text: str, script_path=None):
     """
-    Helper: writes a temp config.py, sets sys.argv, runs domains-to-sitekick.py via runpy,
-    then restores sys.argv.
+    Helper: writes a temp config.py, sets sys.argv, runs domains-to-sitekick.py (or a copy at `script_path`) via
+    runpy, then restores sys.argv.
     """
     monkeypatch.setattr(socket, "gethostname", lambda: "not-local-testing-host")
     monkeypatch.setattr(plesk, "is_server_type", lambda: False)
@@ -300,7 +323,8 @@ def _run_domains_to_sitekick_with_config(monkeypatch, config_text: str):
             config_file = temp_dir_path / "config.py"
             config_file.write_text(config_text)
 
-            script_path = Path(__file__).resolve().parents[1] / "domains-to-sitekick.py"
+            if script_path is None:
+                script_path = Path(__file__).resolve().parents[1] / "domains-to-sitekick.py"
             sys.argv = [str(script_path), "--config-path", str(config_file), "send"]
 
             runpy.run_path(str(script_path), run_name="__main__")
@@ -323,7 +347,7 @@ def test_autoupdate_disabled_does_not_hit_network(monkeypatch):
 
     calls = {"count": 0}
 
-    def fake_urlopen(req):
+    def fake_urlopen(req, timeout=None):
         calls["count"] += 1
         raise AssertionError("urlopen() should not be called when autoupdate is disabled")
 
@@ -359,7 +383,7 @@ def test_autoupdate_enabled_hits_network_path(monkeypatch, tmp_path):
         def read(self):
             return self._b
 
-    def fake_urlopen(req):
+    def fake_urlopen(req, timeout=None):
         calls["count"] += 1
 
         # 1) CODE_ENDPOINT request -> return list of files
@@ -379,23 +403,15 @@ def test_autoupdate_enabled_hits_network_path(monkeypatch, tmp_path):
 
     monkeypatch.setattr(urllib.request, "urlopen", fake_urlopen)
 
-    # We want root_path to be writable so the script can write downloaded files.
-    # If domains-to-sitekick.py uses root_path = Path(__file__).parent.parent,
-    # it writes into your repo. That's annoying in tests.
-    #
-    # If your script supports --config-path pointing at a directory and reads config.py,
-    # you can set a config variable that influences root_path, but you said you can't change code.
-    # So this test assumes either:
-    # - the script writes into a temp dir because it is run from temp, OR
-    # - the download write is best-effort (errors are caught) and won't fail the test.
-    #
-    # If it DOES write into repo and you want to avoid it, we can patch Path(__file__) via runpy,
-    # but that's messier. Start with this; if it creates a stray file, tell me and we’ll harden it.
-
+    # Run a copy of the script in tmp_path, so the downloaded files and the update manifest are written there instead
+    # of into the repository (the modules are still imported from the repository, which is on sys.path):
+    script_path = tmp_path / "domains-to-sitekick.py"
+    shutil.copyfile(str(Path(__file__).resolve().parents[1] / "domains-to-sitekick.py"), str(script_path))
     _run_domains_to_sitekick_with_config(monkeypatch,
         "ENABLE_AUTOUPDATE = True\n"
         "QUEUE_PATH = '/tmp/q'\n"
-        "SITEKICK_PUSH_URL = 'http://localhost/push'\n"
+        "SITEKICK_PUSH_URL = 'http://localhost/push'\n",
+        script_path=script_path,
     )
 
     assert calls["count"] >= 1
\ No newline at end of file
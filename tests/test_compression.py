@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from sitekick import compression
+
+
+@pytest.mark.parametrize('encoding,dictionary', [('gzip', False), ('deflate', False), ('deflate', True)])
+def test_round_trip(encoding, dictionary):
+    body = json.dumps({'data': [{'domain': f"domain-{i}.com", 'info': 'General\n' + '=' * 29} for i in range(20)]})
+    body = body.encode()
+    compressed, headers = compression.compress_body(body, encoding, dictionary)
+    assert headers['Content-Encoding'] == encoding
+    assert len(compressed) < len(body)
+    assert compression.decompress_body(compressed, encoding, headers.get(compression.DICTIONARY_HEADER)) == body
+
+
+def test_no_compression():
+    assert compression.compress_body(b'{}', None) == (b'{}', {})
+    assert compression.decompress_body(b'{}', None) == b'{}'
+    with pytest.raises(ValueError):
+        compression.decompress_body(b'{}', 'br')
+    with pytest.raises(ValueError):
+        compression.decompress_body(b'{}', 'deflate', 'unknown-dictionary')
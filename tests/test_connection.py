@@ -0,0 +1,43 @@
+import json
+import socket
+import threading
+
+from sitekick.connection import ConnectionPool
+
+
+def test_requests_reuse_the_connection(push_server):
+    pool = ConnectionPool(connect_timeout=5, read_timeout=5)
+    for i in range(3):
+        body = json.dumps({'data': [{'domain': f"domain-{i}.com"}]}).encode()
+        response = pool.request('POST', push_server.url, body=body, headers={'Content-Type': 'application/json'})
+        assert response.status == 200
+        assert json.loads(response.body) == {'status': 200}
+    assert len(push_server.connections) == 1
+    pool.close()
+
+
+def test_reconnects_when_kept_alive_connection_was_closed():
+    """A server that closes every connection after one response, without announcing it (no `Connection: close`)."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+    accepted = []
+
+    def serve():
+        for _ in range(2):
+            connection, _ = listener.accept()
+            accepted.append(connection)
+            connection.recv(65536)
+            connection.sendall(b'HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n')
+            connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    pool = ConnectionPool(connect_timeout=5, read_timeout=5)
+    url = f"http://127.0.0.1:{listener.getsockname()[1]}/"
+    assert pool.request('POST', url, body=b'{}').status == 204
+    assert pool.request('POST', url, body=b'{}').status == 204
+    thread.join(5)
+    assert len(accepted) == 2
+    pool.close()
+    listener.close()
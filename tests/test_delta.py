@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+from sitekick import config
+from sitekick import delta
+
+
+def _domain_info(domain, value, timestamp='2026-01-01T03:00:00+00:00'):
+    return {'domain': domain, 'value': value,
+            'meta': {'type': 'plesk', 'domain': domain, 'timestamp': timestamp}}
+
+
+def test_digest_ignores_timestamp():
+    first = _domain_info('a.com', 1, timestamp='2026-01-01T03:00:00+00:00')
+    second = _domain_info('a.com', 1, timestamp='2026-01-02T03:00:00+00:00')
+    assert delta.payload_digest(first) == delta.payload_digest(second)
+    assert delta.payload_digest(first) != delta.payload_digest(_domain_info('a.com', 2))
+    # The timestamp is left out of a copy, the domain info itself is not changed:
+    assert first['meta']['timestamp'] == '2026-01-01T03:00:00+00:00'
+
+
+def test_unchanged_only_after_acknowledge(monkeypatch):
+    digests = {}
+    assert not delta.is_unchanged(digests, _domain_info('a.com', 1), resend_days=7)
+    delta.acknowledge(digests, [_domain_info('a.com', 1)])
+    assert delta.is_unchanged(digests, _domain_info('a.com', 1, timestamp='later'), resend_days=7)
+    assert not delta.is_unchanged(digests, _domain_info('a.com', 2), resend_days=7)
+    # After the resend period, the unchanged domain is sent again:
+    later = time.time() + 8 * 86400
+    monkeypatch.setattr(delta.time, 'time', lambda: later)
+    assert not delta.is_unchanged(digests, _domain_info('a.com', 1), resend_days=7)
+
+
+def test_digests_are_stored_next_to_the_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'QUEUE_PATH', str(tmp_path / 'domains'))
+    digests = {}
+    delta.acknowledge(digests, [_domain_info('a.com', 1)])
+    delta.save_digests(digests)
+    assert json.loads((tmp_path / 'digests.json').read_text()) == digests
+    assert delta.load_digests() == digests
+    (tmp_path / 'digests.json').write_text('not json')
+    assert delta.load_digests() == {}
+
+
+def test_concurrent_pushers_do_not_put_back_old_digests(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'QUEUE_PATH', str(tmp_path / 'domains'))
+    old = {}
+    delta.acknowledge(old, [_domain_info('a.com', 1), dict(_domain_info('b.com', 1), meta={'type': 'other',
+                                                                                          'domain': 'b.com'})])
+    delta.save_digests(old)
+    # Both pushers start; each only keeps the digests it acknowledged itself:
+    pusher_a, pusher_b = {}, {}
+    delta.acknowledge(pusher_b, [dict(_domain_info('b.com', 2), meta={'type': 'other', 'domain': 'b.com'})])
+    delta.save_digests(pusher_b)
+    delta.acknowledge(pusher_a, [_domain_info('a.com', 2)])
+    delta.save_digests(pusher_a)
+    assert delta.load_digests() == dict(pusher_a, **pusher_b)
+    assert delta.load_digests()['other/b.com'] != old['other/b.com']
+
+
+def test_payload_cache_reuses_info_with_the_same_fingerprint(tmp_path, monkeypatch):
+    cache = delta.PayloadCache('plesk', lambda domain: {'a.com': 'one', 'b.com': None}[domain], path=tmp_path,
+                               max_age=3600)
+    assert cache.fingerprint('a.com') == 'one'
+    assert cache.fingerprint('b.com') is None
+    # Failing fingerprints are unknown fingerprints:
+    assert cache.fingerprint('c.com') is None
+    cache.put('a.com', 'one', _domain_info('a.com', 1))
+    cache.put('b.com', None, _domain_info('b.com', 1))
+    assert (tmp_path / 'plesk' / 'a.com.json').exists() and not (tmp_path / 'plesk' / 'b.com.json').exists()
+    assert cache.get('a.com', 'one') == _domain_info('a.com', 1)
+    assert cache.get('a.com', 'two') is None
+    assert cache.get('a.com', None) is None
+    later = time.time() + 3601
+    monkeypatch.setattr(delta.time, 'time', lambda: later)
+    assert cache.get('a.com', 'one') is None
+
+
+def test_payload_cache_is_not_reused_with_other_collection_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', False)
+    delta.PayloadCache('plesk', lambda domain: 'one', path=tmp_path, max_age=3600).put(
+        'a.com', 'one', _domain_info('a.com', 1))
+    assert delta.PayloadCache('plesk', None, path=tmp_path, max_age=3600).get('a.com', 'one') is not None
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', True)
+    assert delta.PayloadCache('plesk', None, path=tmp_path, max_age=3600).get('a.com', 'one') is None
+    monkeypatch.setattr(config, 'GDPR_PSK', 'other-psk')
+    cache = delta.PayloadCache('plesk', None, path=tmp_path, max_age=3600)
+    cache.put('a.com', 'one', _domain_info('a.com', 2))
+    assert cache.get('a.com', 'one') == _domain_info('a.com', 2)
+    monkeypatch.setattr(config, 'GDPR_PSK', 'another-psk')
+    assert delta.PayloadCache('plesk', None, path=tmp_path, max_age=3600).get('a.com', 'one') is None
+    # The psk itself is not stored:
+    assert 'other-psk' not in (tmp_path / 'plesk' / 'a.com.json').read_text()
+
+
+def test_payload_cache_prunes_expired_entries(tmp_path):
+    cache = delta.PayloadCache('plesk', None, path=tmp_path, max_age=3600)
+    cache.put('a.com', 'one', _domain_info('a.com', 1))
+    cache.put('removed.com', 'one', _domain_info('removed.com', 1))
+    old = time.time() - 3601
+    os.utime(str(tmp_path / 'plesk' / 'removed.com.json'), (old, old))
+    assert cache.prune() == 1
+    assert sorted(path.name for path in (tmp_path / 'plesk').iterdir()) == ['a.com.json']
+    assert delta.PayloadCache('other', None, path=tmp_path, max_age=3600).prune() == 0
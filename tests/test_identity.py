@@ -0,0 +1,65 @@
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from sitekick import utils
+from sitekick.utils import HostIdentity, resolve
+
+
+def test_import_does_not_resolve_the_host():
+    code = ("import socket\n"
+            "def fail(*args): raise AssertionError('resolved at import')\n"
+            "socket.gethostbyname = socket.gethostname = fail\n"
+            "import sitekick.utils, sitekick.send, sitekick.commandline\n")
+    subprocess.run([sys.executable, '-c', code], cwd=str(Path(__file__).resolve().parents[1]), check=True)
+
+
+def test_provider_import_does_not_resolve_the_host():
+    code = ("import socket\n"
+            "def fail(*args): raise AssertionError('resolved at import')\n"
+            "socket.gethostbyname = socket.gethostname = fail\n"
+            "import providers.debug, providers.plesk, providers.server, providers.template, providers.test_body\n")
+    subprocess.run([sys.executable, '-c', code], cwd=str(Path(__file__).resolve().parents[1]), check=True)
+
+
+def test_resolve_gives_up_after_timeout(monkeypatch):
+    monkeypatch.setattr(socket, 'gethostbyname', lambda name: time.sleep(1) or '10.0.0.1')
+    started = time.time()
+    assert resolve('slow.example', 0.1) is None
+    assert time.time() - started < 0.5
+
+
+def test_identity_is_cached_in_file(tmp_path, monkeypatch):
+    path = tmp_path / 'identity.json'
+    lookups = []
+    monkeypatch.setattr(socket, 'gethostname', lambda: 'web-1')
+    monkeypatch.setattr(socket, 'gethostbyname', lambda name: lookups.append(name) or '10.0.0.1')
+    identity = HostIdentity(path)
+    assert (identity.hostname, identity.ip_address) == ('web-1', '10.0.0.1')
+    assert json.loads(path.read_text())['ip_address'] == '10.0.0.1'
+    # A new process uses the cached identity without resolving:
+    assert HostIdentity(path).ip_address == '10.0.0.1'
+    assert lookups == ['web-1']
+    # A renamed host or an expired cache is resolved again:
+    monkeypatch.setattr(socket, 'gethostname', lambda: 'web-2')
+    assert HostIdentity(path).hostname == 'web-2'
+    monkeypatch.setattr(utils.config, 'IDENTITY_REFRESH', 0)
+    HostIdentity(path).get()
+    assert lookups == ['web-1', 'web-2', 'web-2']
+
+
+def test_unresolvable_host_uses_outbound_address(tmp_path, monkeypatch):
+    def fail(name):
+        raise socket.gaierror('no resolver')
+    monkeypatch.setattr(socket, 'gethostbyname', fail)
+    assert HostIdentity(tmp_path / 'identity.json').ip_address == utils.outbound_ip_address()
+
+
+def test_module_names_still_work():
+    from sitekick.utils import hostname, ip_address, mac_address
+    assert hostname == utils.identity.hostname
+    assert ip_address == utils.identity.ip_address
+    assert mac_address == utils.identity.mac_address
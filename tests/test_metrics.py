@@ -0,0 +1,53 @@
+import json
+
+from sitekick import metrics as metrics_module
+from sitekick.metrics import Metrics, percentile
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([3.0], 0.95) == 3.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_counters_and_timers_per_label():
+    metrics = Metrics()
+    metrics.count('posts', status='200')
+    metrics.count('posts', 2, status='200')
+    metrics.count('posts', status='503')
+    for seconds in (0.1, 0.2, 0.3):
+        metrics.observe('post', seconds)
+    with metrics.timer('subprocess', command='plesk'):
+        pass
+    assert metrics.counter('posts', status='200') == 3
+    assert metrics.counter('posts', status='500') == 0
+    stats = metrics.timer_stats('post')
+    assert stats['count'] == 3 and stats['max'] == 0.3 and stats['p50'] == 0.2
+    assert metrics.timer_stats('subprocess', command='plesk')['count'] == 1
+    metrics.reset()
+    assert metrics.timer_stats('post') is None
+
+
+def test_prometheus_text_format():
+    metrics = Metrics()
+    metrics.count('posts', status='200')
+    metrics.observe('provider_call', 0.5, provider='plesk')
+    text = metrics.prometheus()
+    assert '# TYPE sitekick_posts_total counter\nsitekick_posts_total{status="200"} 1\n' in text
+    assert '# TYPE sitekick_provider_call_seconds summary\n' in text
+    assert 'sitekick_provider_call_seconds{provider="plesk",quantile="0.99"} 0.500000\n' in text
+    assert 'sitekick_provider_call_seconds_count{provider="plesk"} 1\n' in text
+    assert text.startswith('# TYPE sitekick_last_run_timestamp_seconds gauge\n')
+
+
+def test_write_run_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_module, 'metrics', Metrics())
+    metrics_module.metrics.count('domains_collected', 3)
+    report_path, prometheus_path = metrics_module.write_run_report(tmp_path, command='send')
+    report = json.loads(report_path.read_text())
+    assert report['run']['command'] == 'send'
+    assert report['counters'] == [{'name': 'domains_collected', 'labels': {}, 'value': 3}]
+    assert 'sitekick_domains_collected_total 3' in prometheus_path.read_text()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['sitekick-run.json', 'sitekick.prom']
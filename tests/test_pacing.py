@@ -0,0 +1,78 @@
+from sitekick import config, send
+from sitekick.pacing import Pacer, TokenBucket, host_slot, slot_delay
+
+
+def test_host_slot_is_deterministic_and_spread():
+    slots = [host_slot(60, seed=f"host-{i}10.0.0.{i}push") for i in range(1000)]
+    assert slots[0] == host_slot(60, seed='host-010.0.0.0push')
+    assert all(0 <= slot < 60 for slot in slots)
+    # Every 6 second part of the minute gets about a tenth of the hosts:
+    assert all(70 < sum(1 for slot in slots if part * 6 <= slot < part * 6 + 6) < 130 for part in range(10))
+    assert host_slot(0, seed='any') == 0
+
+
+def test_slot_delay_waits_for_the_next_slot():
+    assert slot_delay(10, 3, now=1000.0) == 3
+    assert slot_delay(10, 3, now=1004.0) == 9
+    assert slot_delay(10, 3, now=1003.0) == 0
+    assert slot_delay(0, 3, now=1004.0) == 0
+
+
+def test_token_bucket_carries_over_unused_budget():
+    clock = [0.0]
+    bucket = TokenBucket(2, capacity=4, clock=lambda: clock[0])
+    # The bucket starts full, so a burst of the capacity is sent without waiting:
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0]
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    # Idle time refills the bucket, but never above the capacity:
+    clock[0] = 100.0
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0]
+    assert bucket.reserve() == 0.5
+    # A reservation above the capacity is allowed, the next ones wait for the debt:
+    clock[0] = 200.0
+    assert bucket.reserve(10) == 3.0
+
+
+def test_pacer_caps_requests_and_bytes(monkeypatch):
+    monkeypatch.setattr(config, 'PUSH_BURST_SECONDS', 1)
+    clock = [0.0]
+    pacer = Pacer(requests_per_second=2, bytes_per_second=1000, clock=lambda: clock[0])
+    assert pacer.reserve(100) == 0
+    assert pacer.reserve(100) == 0
+    assert pacer.reserve(100) == 0.5
+    # The byte cap is the tightest: 1300 bytes of debt at 1000 bytes per second:
+    assert abs(pacer.reserve(2000) - 1.3) < 1e-9
+
+
+def test_pacer_keeps_the_interval(monkeypatch):
+    monkeypatch.setattr(config, 'PUSH_BURST_SECONDS', 1)
+    clock = [0.0]
+    pacer = Pacer(requests_per_second=2, interval=5, clock=lambda: clock[0])
+    assert pacer.reserve(100) == 0
+    assert pacer.reserve(100) == 5
+    # The next POST starts the interval after the start of the previous one:
+    clock[0] = 7.0
+    assert pacer.reserve(100) == 3
+    # The caps apply on top of the interval:
+    pacer = Pacer(requests_per_second=1, interval=0.5, clock=lambda: clock[0])
+    assert pacer.reserve(100) == 0
+    assert pacer.reserve(100) == 1
+
+
+def test_push_is_paced(tmp_path, monkeypatch, push_server):
+    sleeps = []
+    monkeypatch.setattr(send.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(config, 'PUSH_MAX_REQUESTS_PER_SECOND', 1)
+    monkeypatch.setattr(config, 'PUSH_BURST_SECONDS', 1)
+    monkeypatch.setattr(config, 'PUSH_MAX_BATCH_COUNT', 1)
+    send.get_domains_info([f"domain-{i}.com" for i in range(3)], lambda domain: {'domain': domain},
+                          queue_path=tmp_path, show_progress=False)
+    send.push_domains_info(queue_path=tmp_path, count=1, interval=0, interval_offset=4)
+    assert len(push_server.requests) == 3
+    waits = [seconds for seconds in sleeps if seconds]
+    # The offset, then the second and third POST wait for the requests per second cap (the sleeps are skipped, so the
+    # third POST waits for two requests):
+    assert waits[0] == 4 and len(waits) == 3
+    assert 0.5 < waits[1] <= 1 < waits[2] <= 2
@@ -0,0 +1,257 @@
+import re
+from pathlib import Path
+
+from providers import plesk, test_body
+from sitekick import config
+from sitekick.utils import get_redactor, obfuscate
+
+DOMAIN_INFO = """General
+=============================
+Domain ID:                              7
+Owner's contact name:                   Jane Doe (jane)
+Description:                            First line
+second line
+
+Logrotation info
+==============================
+Log rotation status:                    On
+
+
+--WWW-Root--: /var/www/vhosts/example.com/httpdocs
+
+
+Subscription Information
+==============================
+The domain is subscribed to the service plan "Unlimited".
+The subscription is not locked for syncing.
+"""
+
+WP_TOOLKIT = """ID                                 2
+Administrator's email              admin@example.com
+Full Path                          /var/www/vhosts/example.com/httpdocs
+
+Plugins
+***********************************
+Name                               akismet
+Description                        Used by millions, Akismet is quite possibly the best
+way to protect your blog from spam.
+Blocked                            false
+
+Name                               hello
+Description                        
+Blocked                            false
+
+Themes
+***********************************
+Name                               twentytwentyfive
+Status                             active
+"""
+
+
+def test_parse_domain_info_sections_and_multi_line_values():
+    info, text = plesk.parse_domain_info(DOMAIN_INFO)
+    assert text == DOMAIN_INFO
+    assert info['General'] == {'Domain ID': '7', "Owner's contact name": 'Jane Doe (jane)',
+                               'Description': 'First line\nsecond line'}
+    assert info['Logrotation info']['--WWW-Root--'] == '/var/www/vhosts/example.com/httpdocs'
+    assert info['Subscription Information']['text'].endswith('not locked for syncing.')
+    assert plesk.convert_domain_text_to_json(DOMAIN_INFO.split('\n'))['General']['Domain ID'] == '7'
+
+
+def test_repeated_fields_keep_the_last_value(monkeypatch):
+    root = '--WWW-Root--: /var/www/vhosts/example.com/httpdocs'
+    text = DOMAIN_INFO.replace(root, '--WWW-Root--: /var/www/vhosts/old/httpdocs\n' + root)
+    info, output = plesk.parse_domain_info(text)
+    assert output == text
+    assert info['Logrotation info']['--WWW-Root--'] == '/var/www/vhosts/example.com/httpdocs'
+    assert plesk.convert_domain_text_to_json(text.split('\n')) == info
+    calls = []
+
+    def cli(command, include_stderr=True):
+        calls.append(command)
+        return WP_TOOLKIT if command[1:3] == ['ext', 'wp-toolkit'] else ''
+
+    monkeypatch.setattr(plesk, 'cli', cli)
+    plesk._add_wp_toolkit({}, 'example.com', info, None)
+    assert calls[0][-3:] == ['/httpdocs', '-format', 'raw']
+
+
+def test_parse_wp_toolkit_raw_repeated_items():
+    wp_toolkit, text = plesk.parse_wp_toolkit_raw(WP_TOOLKIT)
+    assert text == WP_TOOLKIT
+    assert wp_toolkit['ID'] == '2'
+    assert [plugin['Name'] for plugin in wp_toolkit['Plugins']] == ['akismet', 'hello']
+    assert wp_toolkit['Plugins'][0]['Description'] == ('Used by millions, Akismet is quite possibly the best\n'
+                                                       'way to protect your blog from spam.')
+    assert wp_toolkit['Plugins'][1] == {'Name': 'hello', 'Description': '', 'Blocked': 'false'}
+    assert wp_toolkit['Themes'] == [{'Name': 'twentytwentyfive', 'Status': 'active'}]
+
+
+def test_redaction_in_the_same_pass_matches_the_regex_substitution(monkeypatch):
+    monkeypatch.setattr(config, 'GDPR_PSK', 'test-psk')
+    sample = test_body.get_domain_info('sitekick.eu')
+
+    def legacy(text):
+        for pattern in (r"(Owner's contact name\s*:\s*)(.+)", r"(Administrator's email\s*:?\s*)(.+)"):
+            text = re.sub(pattern, lambda match: match.group(1) + obfuscate(match.group(2), config.GDPR_PSK), text,
+                          flags=re.IGNORECASE)
+        return text
+
+    info, text = plesk.parse_domain_info(sample['info'], get_redactor())
+    assert text == legacy(sample['info'])
+    assert info['General']["Owner's contact name"] == obfuscate('Administrator (admin)', 'test-psk')
+    wp_toolkit, text = plesk.parse_wp_toolkit_raw(sample['wp_plugins'], get_redactor())
+    assert text == legacy(sample['wp_plugins'])
+    assert 'root@' not in str(wp_toolkit)
+
+
+def test_misaligned_and_padded_personal_data_is_redacted(monkeypatch):
+    monkeypatch.setattr(config, 'GDPR_PSK', 'test-psk')
+    # The email is one column off, so it is taken for a continuation of the ID:
+    text = "ID" + " " * 33 + "2\nAdministrator's email" + " " * 15 + "admin@example.com\n"
+    wp_toolkit, output = plesk.parse_wp_toolkit_raw(text, get_redactor())
+    assert '@' not in output and '@' not in str(wp_toolkit)
+    assert output == get_redactor().redact_text(text)
+    # A misaligned field after a personal data field is pseudonymized once, the same in the text and the structure:
+    text = "Administrator's email" + " " * 15 + "admin@example.com\nOwner's contact name" + " " * 10 + "Jane Doe\n"
+    wp_toolkit, output = plesk.parse_wp_toolkit_raw(text, get_redactor())
+    assert output == get_redactor().redact_text(text)
+    assert wp_toolkit["Administrator's email"] == output.split('\n')[0][36:] + '\n' + output.split('\n')[1]
+    # A value with trailing whitespace has the same pseudonym as with the text substitution:
+    text = "General\n=====\nOwner's contact name:   Jane Doe (jane)  \n"
+    info, output = plesk.parse_domain_info(text, get_redactor())
+    assert output == get_redactor().redact_text(text)
+    assert info['General']["Owner's contact name"] == obfuscate('Jane Doe (jane)  ', 'test-psk')
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def test_bulk_values_have_the_plesk_format():
+    assert [plesk.format_size(size) for size in (0, 5253, 126873600, None)] == ['0 B', '5.13 KB', '121 MB', '0 B']
+    assert plesk.format_date('2023-10-20 12:01:02') == 'Oct 20, 2023'
+    assert [plesk.format_status(status) for status in ('0', '16', '18', None)] == [
+        'OK', 'Suspended by administrator', 'Disabled by backup/restore', None]
+
+
+def fake_plesk(monkeypatch, calls):
+    """Answer the `plesk` commands with the canned query results, without Plesk."""
+    def cli(command, include_stderr=True):
+        calls.append(command)
+        if command[1:3] == ['db', '-sNe']:
+            name = 'domains' if command[3] == plesk.BULK_QUERIES['domains'] else 'limits'
+            return (FIXTURES / f"plesk_bulk_{name}.tsv").read_text(encoding='utf-8')
+        if command[1:] == ['version']:
+            return 'Product version: Plesk Obsidian 18.0.70.2\n'
+        if command[1:3] == ['ext', 'wp-toolkit']:
+            return WP_TOOLKIT
+        raise AssertionError(f"Unexpected command {command}")
+
+    monkeypatch.setattr(plesk, 'cli', cli)
+    monkeypatch.setattr(config, 'PLESK_BULK_SQL', True)
+    monkeypatch.setattr(config, 'PLESK_PARSED_INFO', True)
+    plesk.reset_bulk_info()
+
+
+def test_bulk_mode_reads_all_domains_with_two_queries(monkeypatch):
+    calls = []
+    fake_plesk(monkeypatch, calls)
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', False)
+    try:
+        results = {domain: plesk.get_domain_info(domain)
+                   for domain in ('example.com', 'forward.example', 'xn--bcher-kva.example')}
+    finally:
+        plesk.reset_bulk_info()
+    assert [command[1] for command in calls].count('db') == 2
+    assert [command[1] for command in calls].count('version') == 1
+    # Only the hosted domains have a WordPress toolkit call:
+    assert [command[1] for command in calls].count('ext') == 2
+    info = results['example.com']['info-parsed']
+    assert info['General'] == {'Domain ID': '7', 'Domain name': 'example.com',
+                               "Owner's contact name": 'Jane Doe (jane)', 'Domain status': 'OK',
+                               'Creation date': 'Oct 20, 2024', 'Expiration date': 'Unlimited',
+                               'Disk space limit': '10 GB', 'Size': '121 MB', 'Traffic limit': 'Unlimited'}
+    assert info['Hosting'] == {'Hosting type': 'Physical hosting', 'FTP Login': 'jane_ftp', 'SSL/TLS support': 'On',
+                               'PHP support': 'Yes'}
+    assert results['example.com']['provider-mode'] == 'bulk-sql'
+    assert results['example.com']['php-version'] == 'example.com\tplesk-php82-fpm\n'
+    assert results['example.com']['wp-toolkit']['ID'] == '2'
+    # The text has the format of `plesk bin domain --info`:
+    assert plesk.parse_domain_info(results['example.com']['info'])[0] == info
+    # The fields have the labels of `plesk bin domain --info`, in the same order:
+    cli_info = plesk.parse_domain_info(test_body.get_domain_info('sitekick.eu')['info'])[0]
+    for section in ('General', 'Hosting'):
+        assert [key for key in cli_info[section] if key in info[section]] == list(info[section])
+    forward = results['forward.example']
+    assert forward['info-parsed']['General']['Domain status'] == 'Suspended by administrator'
+    assert forward['info-parsed']['Hosting'] == {'Hosting type': 'Standard forwarding'}
+    assert forward['php-version'] == '' and 'wp-toolkit' not in forward
+    assert results['xn--bcher-kva.example']['info-parsed']['General']['Domain name'] == 'bücher.example'
+    assert results['xn--bcher-kva.example']['info-parsed']['General']['Expiration date'] == 'Jan 1, 2026'
+    assert results['xn--bcher-kva.example']['info-parsed']['Hosting']['PHP support'] == 'No'
+    assert results['xn--bcher-kva.example']['info-parsed']['General']["Owner's contact name"] == 'Tab\tName (bob)'
+    assert set(results['example.com']) >= {'Server', 'provider', 'provider-version', 'plesk-version', 'php-version',
+                                           'domain', 'info', 'info-parsed', 'wp_plugins'}
+
+
+def test_parsed_info_is_only_sent_when_enabled(monkeypatch):
+    calls = []
+    fake_plesk(monkeypatch, calls)
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', False)
+    monkeypatch.setattr(config, 'PLESK_PARSED_INFO', False)
+    try:
+        result = plesk.get_domain_info('example.com')
+    finally:
+        plesk.reset_bulk_info()
+    assert 'info-parsed' not in result and 'wp-toolkit' not in result
+    assert result['info'] and result['wp_plugins'] == WP_TOOLKIT
+
+
+def test_bulk_mode_redacts_and_falls_back_for_unknown_domains(monkeypatch):
+    calls = []
+    fake_plesk(monkeypatch, calls)
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', True)
+    monkeypatch.setattr(config, 'GDPR_PSK', 'test-psk')
+    try:
+        result = plesk.get_domain_info('example.com')
+        try:
+            plesk.get_domain_info('new.example')
+        except AssertionError as e:
+            assert "'domain', '--info', 'new.example'" in str(e)
+        else:
+            raise AssertionError('An unknown domain should be read with plesk bin domain --info')
+    finally:
+        plesk.reset_bulk_info()
+    pseudonym = obfuscate('Jane Doe (jane)', 'test-psk')
+    assert result['info-parsed']['General']["Owner's contact name"] == pseudonym
+    assert 'Jane Doe' not in result['info'] and pseudonym in result['info']
+
+
+def test_bulk_mode_sends_no_email_addresses_with_gdpr(monkeypatch):
+    calls = []
+    fake_plesk(monkeypatch, calls)
+    monkeypatch.setattr(config, 'GDPR_COMPLIANT', True)
+    monkeypatch.setattr(config, 'GDPR_PSK', 'test-psk')
+    try:
+        results = [plesk.get_domain_info(domain) for domain in ('example.com', 'xn--bcher-kva.example')]
+    finally:
+        plesk.reset_bulk_info()
+    for result in results:
+        assert '@' not in str({key: result[key] for key in ('info', 'info-parsed', 'wp_plugins', 'wp-toolkit')})
+
+
+def test_domain_fingerprint_changes_with_the_configuration(tmp_path, monkeypatch):
+    monkeypatch.setattr(plesk, 'VHOSTS_PATH', str(tmp_path))
+    assert plesk.get_domain_fingerprint('example.com') is None
+    conf = tmp_path / 'system' / 'example.com' / 'conf'
+    conf.mkdir(parents=True)
+    (conf / 'last_nginx.conf').write_text('server {}')
+    plugins = tmp_path / 'example.com' / 'httpdocs' / 'wp-content' / 'plugins'
+    plugins.mkdir(parents=True)
+    fingerprint = plesk.get_domain_fingerprint('example.com')
+    assert fingerprint == plesk.get_domain_fingerprint('example.com')
+    (conf / 'last_nginx.conf').write_text('server { listen 443; }')
+    assert plesk.get_domain_fingerprint('example.com') != fingerprint
+    fingerprint = plesk.get_domain_fingerprint('example.com')
+    (plugins / 'akismet').mkdir()
+    assert plesk.get_domain_fingerprint('example.com') != fingerprint
@@ -0,0 +1,82 @@
+import threading
+
+from sitekick import push_async, send
+from sitekick.channel import Channel
+from sitekick.queues import open_queue
+
+
+def _fill_queue(queue_path, domains):
+    send.get_domains_info(domains, lambda domain: {'domain': domain}, queue_path=queue_path, show_progress=False)
+
+
+def test_async_push_keeps_several_posts_in_flight(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_MAX_BATCH_COUNT', 2)
+    push_server.delay = 0.2
+    domains = [f"domain-{i:02}.com" for i in range(12)]
+    _fill_queue(tmp_path, domains)
+    push_async.push_domains_info_async(queue_path=tmp_path, count=2, in_flight=3)
+    assert sorted(domain for batch in push_server.domains for domain in batch) == domains
+    assert push_server.max_active == 3
+    # The connections are kept alive and reused, one per POST in flight:
+    assert len(push_server.connections) == 3
+    assert list(tmp_path.glob('*.json')) == []
+
+
+def test_async_push_leaves_only_failed_batches_in_queue(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_MAX_BATCH_COUNT', 1)
+    push_server.delay = 0.1
+    push_server.statuses = [200, 503]
+    queue_path = f"sqlite://{tmp_path / 'queue.db'}"
+    domains = [f"domain-{i}.com" for i in range(6)]
+    _fill_queue(queue_path, domains)
+    push_async.push_domains_info_async(queue_path=queue_path, count=1, attempts=1, in_flight=2)
+    pushed = [domain for batch in push_server.domains for domain in batch]
+    assert len(pushed) == 1
+    queue = open_queue(queue_path)
+    remaining = [record.domain for record in queue.claim(10)]
+    queue.close()
+    # Every domain is either acknowledged or still in the queue, never both:
+    assert sorted(pushed + remaining) == domains
+
+
+def test_async_push_lets_batches_in_flight_finish_their_retries(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_MAX_BATCH_COUNT', 1)
+    # The first batch retries at once and fails all attempts, while the second batch waits for its second attempt:
+    delays = [0, 0.5, 0, 0]
+    monkeypatch.setattr(push_async, 'backoff_delay', lambda attempt, retry_after=None: delays.pop(0))
+    push_server.delay = 0.1
+    push_server.statuses = [500] * 5
+    queue_path = f"sqlite://{tmp_path / 'queue.db'}"
+    _fill_queue(queue_path, ['domain-0.com', 'domain-1.com'])
+    push_async.push_domains_info_async(queue_path=queue_path, count=1, attempts=3, in_flight=2)
+    pushed = [domain for batch in push_server.domains for domain in batch]
+    # The second batch is accepted at its third attempt, after the first batch gave up:
+    assert len(pushed) == 1 and len(push_server.requests) == 6
+    queue = open_queue(queue_path)
+    remaining = [record.domain for record in queue.claim(10)]
+    queue.close()
+    assert sorted(pushed + remaining) == ['domain-0.com', 'domain-1.com']
+
+
+def test_push_domains_info_uses_async_engine_with_channel(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_IN_FLIGHT', 4)
+    push_server.delay = 0.05
+    domains = [f"domain-{i:02}.com" for i in range(30)]
+    channel = Channel(maxsize=5)
+    threads = [
+        threading.Thread(target=send.get_domains_info, args=(domains, lambda domain: {'domain': domain}),
+                         kwargs={'queue_path': tmp_path, 'show_progress': False, 'channel': channel}),
+        threading.Thread(target=send.push_domains_info, kwargs={'queue_path': tmp_path, 'count': 2,
+                                                                'channel': channel}),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert sorted(domain for batch in push_server.domains for domain in batch) == domains
+    assert push_server.max_active > 1
+    assert list(tmp_path.glob('*.json')) == []
@@ -0,0 +1,49 @@
+import pytest
+
+from sitekick import queues
+
+
+@pytest.fixture(params=['directory', 'sqlite'])
+def queue_path(request, tmp_path):
+    if request.param == 'sqlite':
+        return f"sqlite://{tmp_path / 'queue.db'}"
+    return str(tmp_path / 'domains')
+
+
+def test_open_queue_selects_backend_by_scheme(tmp_path):
+    assert isinstance(queues.open_queue(tmp_path / 'domains'), queues.DirectoryQueue)
+    assert isinstance(queues.open_queue(f"file://{tmp_path / 'files'}"), queues.DirectoryQueue)
+    assert isinstance(queues.open_queue(f"sqlite://{tmp_path / 'queue.db'}"), queues.SqliteQueue)
+    assert queues.queue_location(f"sqlite://{tmp_path / 'queue.db'}") == tmp_path / 'queue.db'
+    with pytest.raises(ValueError):
+        queues.open_queue('redis://localhost/0')
+
+
+def test_claim_in_index_order_and_ack(queue_path):
+    queue = queues.open_queue(queue_path)
+    for index, domain in [(2, 'c.com'), (0, 'a.com'), (1, 'b.com'), (10, 'd.com')]:
+        queue.put(index, domain, {'domain': domain})
+    first = queue.claim(3)
+    assert [record.domain for record in first] == ['a.com', 'b.com', 'c.com']
+    assert [record.index for record in first] == [0, 1, 2]
+    assert first[0].data == {'domain': 'a.com'}
+    # Claimed records are not claimed again:
+    second = queue.claim(3)
+    assert [record.domain for record in second] == ['d.com']
+    queue.ack(first)
+    queue.release(second)
+    assert [record.domain for record in queue.claim(3)] == ['d.com']
+    queue.close()
+
+
+def test_queue_is_shared_between_queue_objects(queue_path):
+    writer = queues.open_queue(queue_path)
+    writer.put(0, 'a.com', {'domain': 'a.com'})
+    reader = queues.open_queue(queue_path)
+    records = reader.claim(10)
+    assert [record.domain for record in records] == ['a.com']
+    reader.ack(records)
+    assert queues.open_queue(queue_path).claim(10) == []
+    writer.put(1, 'b.com', {'domain': 'b.com'})
+    writer.clear()
+    assert queues.open_queue(queue_path).claim(10) == []
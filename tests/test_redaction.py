@@ -0,0 +1,48 @@
+from sitekick import utils
+from sitekick.utils import Redactor, get_redactor, obfuscate, pseudonym
+
+FIELDS = ["Owner's contact name", "Administrator's email"]
+
+
+def test_redact_text_with_a_single_pattern_for_all_fields():
+    redactor = Redactor(FIELDS, 'psk')
+    text = ("Domain name:          example.com\n"
+            "Owner's contact name: Jane Doe (jane)\n"
+            "Administrator's email              jane@example.com\n")
+    assert redactor.redact_text(text) == ("Domain name:          example.com\n"
+                                          f"Owner's contact name: {obfuscate('Jane Doe (jane)', 'psk')}\n"
+                                          f"Administrator's email              {obfuscate('jane@example.com', 'psk')}\n")
+
+
+def test_redact_dicts_recursively():
+    redactor = Redactor(FIELDS, 'psk')
+    data = {'General': {"owner's contact name": 'Jane', 'Domain name': 'example.com'},
+            'Plugins': [{"Administrator's email": 'jane@example.com'}],
+            'info': "Owner's contact name: Jane",
+            'count': 3}
+    assert redactor.redact(data) == {
+        'General': {"owner's contact name": obfuscate('Jane', 'psk'), 'Domain name': 'example.com'},
+        'Plugins': [{"Administrator's email": obfuscate('jane@example.com', 'psk')}],
+        'info': f"Owner's contact name: {obfuscate('Jane', 'psk')}",
+        'count': 3}
+    assert redactor("Owner's contact name", '') == ''
+    assert redactor('Domain name', 'example.com') == 'example.com'
+
+
+def test_pseudonyms_are_memoized_per_psk():
+    pseudonym.cache_clear()
+    Redactor(FIELDS, 'psk-1').redact_text("Owner's contact name: Jane\n" * 100)
+    info = pseudonym.cache_info()
+    assert (info.misses, info.hits) == (1, 99)
+    assert Redactor(FIELDS, 'psk-2')("Owner's contact name", 'Jane') != Redactor(FIELDS, 'psk-1')(
+        "Owner's contact name", 'Jane')
+
+
+def test_get_redactor_follows_the_config(monkeypatch):
+    monkeypatch.setattr(utils.config, 'GDPR_FIELDS', ['Login'])
+    monkeypatch.setattr(utils.config, 'GDPR_PSK', 'psk')
+    redactor = get_redactor()
+    assert get_redactor() is redactor
+    assert redactor.redact_text('Login: jane') == f"Login: {obfuscate('jane', 'psk')}"
+    monkeypatch.setattr(utils.config, 'GDPR_PSK', 'other')
+    assert get_redactor() is not redactor
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import pytest
+
+from sitekick import registry
+
+PROVIDER = '''
+def is_server_type():
+    with open({probes!r}, 'a') as f:
+        f.write('{name}\\n')
+    return {valid}
+
+def get_domains():
+    return []
+
+def get_domain_info(domain):
+    return {{}}
+'''
+
+
+@pytest.fixture
+def providers(tmp_path, monkeypatch):
+    """A provider package `regproviders` with a matching provider `yes` and a non-matching provider `no`."""
+    package = tmp_path / 'regproviders'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    probes = tmp_path / 'probes.txt'
+    for name, valid in [('yes', True), ('no', False)]:
+        (package / f"{name}.py").write_text(PROVIDER.format(probes=str(probes), name=name, valid=valid))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(registry, 'provider_files',
+                        lambda root_module: {path.stem: path for path in package.glob('*.py') if path.stem != '__init__'})
+    yield package, probes, tmp_path / 'providers.json'
+    for name in ('regproviders', 'regproviders.yes', 'regproviders.no'):
+        sys.modules.pop(name, None)
+
+
+def _probed(probes):
+    return sorted(probes.read_text().split()) if probes.exists() else []
+
+
+def test_cached_providers_are_not_probed_again(providers):
+    package, probes, manifest = providers
+    modules = registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    assert [module.__name__ for module in modules] == ['regproviders.yes']
+    assert _probed(probes) == ['no', 'yes']
+    modules = registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    assert [module.__name__ for module in modules] == ['regproviders.yes']
+    assert _probed(probes) == ['no', 'yes']
+
+
+def test_changed_provider_file_is_probed_again(providers):
+    package, probes, manifest = providers
+    registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    later = time.time() + 10
+    os.utime(str(package / 'no.py'), (later, later))
+    registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    assert _probed(probes) == ['no', 'no', 'yes']
+
+
+def test_expired_manifest_probes_all_providers(providers, monkeypatch):
+    package, probes, manifest = providers
+    registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    later = time.time() + 61
+    monkeypatch.setattr(registry.time, 'time', lambda: later)
+    registry.get_server_modules('regproviders', manifest_path=manifest, ttl=60)
+    assert _probed(probes) == ['no', 'no', 'yes', 'yes']
+
+
+def test_filtered_providers_are_not_imported(providers):
+    package, probes, manifest = providers
+    modules = registry.get_server_modules('regproviders', filter=lambda name: name == 'no', manifest_path=manifest,
+                                          ttl=60)
+    assert modules == []
+    assert _probed(probes) == ['no']
+    assert 'regproviders.yes' not in sys.modules
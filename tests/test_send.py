@@ -0,0 +1,264 @@
+import json
+import random
+import threading
+import time
+import types
+
+from sitekick import send
+from sitekick.channel import Channel
+from sitekick.queues import Record
+
+
+def _get_domain_info(domain):
+    return {'domain': domain}
+
+
+def test_collect_in_order_keeps_item_order():
+    def collect(item):
+        time.sleep(random.random() / 100)
+        return item * 2
+
+    results = list(send.collect_in_order(collect, range(40), workers=8))
+    assert results == [(i, i * 2) for i in range(40)]
+
+
+def test_get_domains_info_concurrent_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    domains = ['b.com', 'A.com', 'a.com ', 'c.com', 'd.com']
+    serial_path, concurrent_path = tmp_path / 'serial', tmp_path / 'concurrent'
+    send.get_domains_info(domains, _get_domain_info, queue_path=serial_path, show_progress=False, workers=1)
+    send.get_domains_info(domains, _get_domain_info, queue_path=concurrent_path, show_progress=False, workers=4)
+
+    serial_files = sorted(path.name for path in serial_path.iterdir())
+    concurrent_files = sorted(path.name for path in concurrent_path.iterdir())
+    # Duplicates are skipped, the file names keep the index of the first occurrence:
+    assert serial_files == ['00000000-b.com.json', '00000001-a.com.json', '00000003-c.com.json',
+                            '00000004-d.com.json']
+    assert concurrent_files == serial_files
+    data = json.loads((concurrent_path / '00000001-a.com.json').read_text())
+    assert data['domain'] == 'a.com'
+    assert data['meta']['domain'] == 'a.com'
+
+
+def test_get_domains_info_retries_failed_domains(tmp_path, monkeypatch):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    calls = {}
+
+    def flaky_domain_info(domain):
+        calls[domain] = calls.get(domain, 0) + 1
+        if domain == 'broken.com' or calls[domain] < 3:
+            raise RuntimeError('temporary failure')
+        return {'domain': domain}
+
+    send.get_domains_info(['ok.com', 'broken.com'], flaky_domain_info, queue_path=tmp_path, show_progress=False,
+                          workers=2)
+    assert calls == {'ok.com': 3, 'broken.com': 10}
+    assert [path.name for path in tmp_path.iterdir()] == ['00000000-ok.com.json']
+
+
+def test_get_domains_info_retries_a_failed_domain_when_listed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    calls = {}
+
+    def flaky_domain_info(domain):
+        calls[domain] = calls.get(domain, 0) + 1
+        if domain == 'flaky.com' and calls[domain] <= 10:
+            raise RuntimeError('temporary failure')
+        return {'domain': domain}
+
+    domains = ['flaky.com', 'ok.com', 'flaky.com', 'ok.com', 'flaky.com']
+    send.get_domains_info(domains, flaky_domain_info, queue_path=tmp_path, show_progress=False)
+    # The first occurrence failed all attempts, the second is collected, the third is skipped:
+    assert calls == {'flaky.com': 11, 'ok.com': 1}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['00000001-ok.com.json', '00000002-flaky.com.json']
+
+
+def test_get_domains_info_skips_domains_with_unchanged_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(send.config, 'QUEUE_PATH', str(tmp_path / 'domains'))
+    monkeypatch.setattr(send.config, 'FINGERPRINT_MAX_AGE', 3600)
+    fingerprints = {f"domain-{i}.com": 'v1' for i in range(4)}
+    collected = []
+
+    def get_domain_info(domain):
+        collected.append(domain)
+        return {'domain': domain, 'version': fingerprints[domain]}
+
+    def collect():
+        send.get_domains_info(sorted(fingerprints), get_domain_info, queue_path=tmp_path / 'domains',
+                              show_progress=False, get_domain_fingerprint=fingerprints.get)
+
+    collect()
+    assert len(collected) == 4
+    fingerprints['domain-2.com'] = 'v2'
+    collect()
+    # Only the changed domain is collected again, the others are taken from the cache:
+    assert collected[4:] == ['domain-2.com']
+    queued = {path.name: json.loads(path.read_text()) for path in (tmp_path / 'domains').glob('*.json')}
+    assert queued['00000002-domain-2.com.json']['version'] == 'v2'
+    assert queued['00000001-domain-1.com.json']['meta']['domain'] == 'domain-1.com'
+
+
+def test_push_domains_info_empties_sqlite_queue(tmp_path, monkeypatch, push_server):
+    queue_path = f"sqlite://{tmp_path / 'queue.db'}"
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    send.get_domains_info([f"domain-{i}.com" for i in range(7)], _get_domain_info, queue_path=queue_path,
+                          show_progress=False)
+    send.push_domains_info(queue_path=queue_path, count=3)
+    # Fast responses grow the batches:
+    assert push_server.domains == [['domain-0.com', 'domain-1.com', 'domain-2.com'],
+                                   ['domain-3.com', 'domain-4.com', 'domain-5.com', 'domain-6.com']]
+    # All batches are sent over the same kept-alive connection:
+    assert len(push_server.connections) == 1
+    send.push_domains_info(queue_path=queue_path, count=3)
+    assert len(push_server.requests) == 2
+
+
+def test_push_domains_info_sends_huge_domain_on_its_own(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_BATCH_BYTES', 1000)
+    sizes = {'a.com': 100, 'b.com': 100, 'huge.com': 5000, 'c.com': 100}
+    send.get_domains_info(list(sizes), lambda domain: {'domain': domain, 'info': 'x' * sizes[domain]},
+                          queue_path=tmp_path, show_progress=False)
+    send.push_domains_info(queue_path=tmp_path, count=10)
+    assert push_server.domains == [['a.com', 'b.com'], ['huge.com'], ['c.com']]
+
+
+def test_push_domains_info_falls_back_to_plain_bodies_on_415(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'PUSH_COMPRESSION', 'gzip')
+    push_server.statuses = [415]
+    send.get_domains_info(['a.com', 'b.com'], _get_domain_info, queue_path=tmp_path, show_progress=False)
+    send.push_domains_info(queue_path=tmp_path, count=1)
+    assert [request['encoding'] for request in push_server.requests] == ['gzip', None, None]
+    assert push_server.domains == [['a.com'], ['b.com']]
+    assert list(tmp_path.iterdir()) == []
+
+
+def _collect_and_push_in_parallel(queue_path, domains, channel, get_domain_info=_get_domain_info, **push_kwargs):
+    threads = [
+        threading.Thread(target=send.get_domains_info, args=(domains, get_domain_info),
+                         kwargs={'queue_path': queue_path, 'show_progress': False, 'channel': channel}),
+        threading.Thread(target=send.push_domains_info, kwargs=dict(push_kwargs, queue_path=queue_path,
+                                                                    channel=channel)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+
+def test_push_domains_info_honors_retry_after(tmp_path, monkeypatch, push_server):
+    sleeps = []
+    monkeypatch.setattr(send.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    push_server.statuses = [429]
+    push_server.response_headers = {'Retry-After': '7'}
+    send.metrics.reset()
+    send.get_domains_info([f"domain-{i}.com" for i in range(4)], _get_domain_info, queue_path=tmp_path,
+                          show_progress=False)
+    send.push_domains_info(queue_path=tmp_path, count=2)
+    assert [domain for batch in push_server.domains for domain in batch] == [f"domain-{i}.com" for i in range(4)]
+    # The retry waits at least the Retry-After, with a random part on top of it:
+    backoff = [seconds for seconds in sleeps if seconds][0]
+    assert 7 <= backoff <= 7 * 1.25
+    assert send.metrics.counter('post_backpressure') == 1
+
+
+def test_parallel_push_through_channel(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    domains = [f"domain-{i:02}.com" for i in range(30)]
+    channel = Channel(maxsize=5)
+    # The pusher does not stop before the collector closed the channel, also when the collector is slow:
+    _collect_and_push_in_parallel(tmp_path, domains, channel, lambda domain: time.sleep(0.01) or {'domain': domain},
+                                  count=4)
+    assert sorted(domain for batch in push_server.domains for domain in batch) == domains
+    assert list(tmp_path.glob('*.json')) == []
+
+
+def test_channel_spills_to_queue_when_full():
+    channel = Channel(maxsize=2)
+    spilled = []
+    records = [Record(i, f"domain-{i}.com", {}, None) for i in range(4)]
+    assert [channel.put(record, spilled.append) for record in records] == [True, True, False, False]
+    assert spilled == records[2:]
+    assert channel.spilled == 2
+    channel.close()
+    assert not channel.finished
+    assert channel.get(10) == records[:2]
+    assert channel.finished
+    assert channel.get(10) == []
+
+
+def test_unreachable_endpoint_spills_channel_to_queue(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    push_server.statuses = [503] * 100
+    domains = [f"domain-{i:02}.com" for i in range(12)]
+    _collect_and_push_in_parallel(tmp_path, domains, Channel(maxsize=50), count=4, attempts=2)
+    assert push_server.domains == []
+    assert sorted(path.name for path in tmp_path.glob('*.json')) == [f"{i:08}-domain-{i:02}.com.json"
+                                                                     for i in range(12)]
+
+
+def test_get_domains_info_streams_domains_from_a_generator(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    collected = []
+
+    def get_domains():
+        for page in range(3):
+            for i in range(3):
+                # Collection does not wait for the enumeration, with 2 workers at most 4 domains are ahead:
+                assert len(collected) >= page * 3 - 4
+                yield f"page-{page}-domain-{i}.com"
+
+    def get_domain_info(domain):
+        collected.append(domain)
+        return {'domain': domain}
+
+    send.get_domains_info(get_domains, get_domain_info, queue_path=tmp_path, show_progress=False, workers=2)
+    assert len(collected) == 9
+    assert len(list(tmp_path.glob('*.json'))) == 9
+    assert 'Sitekick info on 9 of 9 domains stored' in capsys.readouterr().out
+
+
+def test_send_domains_runs_providers_concurrently(tmp_path, monkeypatch, push_server):
+    monkeypatch.setattr(send.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(send.config, 'SITEKICK_PUSH_URL', push_server.url)
+    monkeypatch.setattr(send.config, 'QUEUE_PATH', str(tmp_path / 'domains'))
+
+    def provider(name, domains, fail=False):
+        module = types.ModuleType(f"providers.{name}")
+
+        def get_domains():
+            if fail:
+                raise RuntimeError('control panel is down')
+            return domains
+
+        module.get_domains = get_domains
+        module.get_domain_info = lambda domain: {'domain': domain}
+        module.get_domain_info.__module__ = module.__name__
+        module.DOMAIN_COUNT_PER_POST = 2
+        module.DOMAIN_POST_INTERVAL = 1
+        return module
+
+    modules = [provider('one', ['a.one', 'b.one', 'c.one']), provider('broken', [], fail=True),
+               provider('two', ['a.two', 'b.two'])]
+    monkeypatch.setattr(send, 'get_server_modules', lambda filter=None: modules)
+    send.send_domains(parallel_providers=True)
+    pushed = sorted(domain for batch in push_server.domains for domain in batch)
+    assert pushed == ['a.one', 'a.two', 'b.one', 'b.two', 'c.one']
+    types_per_batch = {frozenset(item['meta']['type'] for item in request['data']) for request in push_server.requests}
+    assert types_per_batch == {frozenset(['one']), frozenset(['two'])}
+    # The run report is written next to the queue:
+    report = json.loads((tmp_path / 'sitekick-run.json').read_text())
+    counters = {(counter['name'], tuple(counter['labels'].items())): counter['value'] for counter in report['counters']}
+    assert counters[('domains_collected', ())] == 5
+    assert counters[('domains_pushed', ())] == 5
+    assert {timer['labels'].get('provider') for timer in report['timers'] if timer['name'] == 'provider_call'} == \
+        {'one', 'two'}
+    assert 'sitekick_post_seconds_count' in (tmp_path / 'sitekick.prom').read_text()
+    # The governor is disabled in the tests, so there are no throttling decisions:
+    assert report['run']['throttle']['decisions'] == []
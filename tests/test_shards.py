@@ -0,0 +1,38 @@
+from collections import Counter
+
+from sitekick import send
+from sitekick.shards import current_shard, shard_of
+
+
+def test_shards_are_stable_and_even():
+    domains = [f"domain-{i}.com" for i in range(2400)]
+    shards = Counter(shard_of(domain, 24) for domain in domains)
+    assert set(shards) == set(range(24))
+    assert min(shards.values()) > 60 and max(shards.values()) < 140
+    # The shard only depends on the (cleaned) domain name:
+    assert shard_of(' Domain-7.com', 24) == shard_of('domain-7.com', 24)
+    assert shard_of('domain-7.com', 1) == 0
+
+
+def test_current_shard_follows_the_hour():
+    assert [current_shard(24, now=hour * 3600 + 59) for hour in range(25)] == list(range(24)) + [0]
+    assert current_shard(1) == 0
+
+
+def test_every_domain_is_collected_in_one_shard(tmp_path):
+    domains = [f"domain-{i}.com" for i in range(40)]
+    collected = []
+
+    def get_domain_info(domain):
+        collected.append(domain)
+        return {'domain': domain}
+
+    for shard in range(4):
+        before = len(collected)
+        send.get_domains_info(domains, get_domain_info, queue_path=tmp_path / 'domains', show_progress=False,
+                              limit=None, shards=4, shard=shard)
+        assert {shard_of(domain, 4) for domain in collected[before:]} == {shard}
+    assert sorted(collected) == sorted(domains)
+    # The queue files keep the index in the complete domain list:
+    assert sorted(path.name for path in (tmp_path / 'domains').glob('*.json')) == \
+        sorted(f"{i:08}-domain-{i}.com.json" for i in range(40))
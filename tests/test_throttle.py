@@ -0,0 +1,170 @@
+import itertools
+import random
+import threading
+import time
+
+from sitekick import config, throttle
+from sitekick.throttle import FairLimiter, Governor, RateController, backoff_delay, niced, parse_retry_after, \
+    read_io_pressure
+
+
+def test_fair_limiter_caps_concurrency_and_shares_slots():
+    limiter = FairLimiter(2)
+    lock = threading.Lock()
+    active = {'total': 0, 'max': 0}
+    order = []
+
+    def work(owner):
+        with limiter.slot(owner):
+            with lock:
+                active['total'] += 1
+                active['max'] = max(active['max'], active['total'])
+                order.append(owner)
+            time.sleep(0.01)
+            with lock:
+                active['total'] -= 1
+
+    # The busy provider queues many calls before the quiet provider asks for a slot:
+    threads = [threading.Thread(target=work, args=('busy',)) for _ in range(8)]
+    threads += [threading.Thread(target=work, args=('quiet',)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    assert active['max'] == 2
+    assert sorted(order) == ['busy'] * 8 + ['quiet'] * 2
+    # The quiet provider does not have to wait until all calls of the busy provider are done:
+    assert order.index('quiet') < 6
+
+
+def test_wrap_keeps_module_of_function():
+    limiter = FairLimiter(1)
+    wrapped = limiter.wrap(test_wrap_keeps_module_of_function, 'owner')
+    assert wrapped.__module__ == test_wrap_keeps_module_of_function.__module__
+
+
+def make_governor(monkeypatch, loads, io_pressure=None):
+    monkeypatch.setattr(config, 'GOVERNOR_MAX_LOAD', 1.5)
+    monkeypatch.setattr(config, 'GOVERNOR_MAX_IO_PRESSURE', 40.0)
+    monkeypatch.setattr(config, 'GOVERNOR_INTERVAL', 0)
+    monkeypatch.setattr(config, 'GOVERNOR_PAUSE', 0.5)
+    monkeypatch.setattr(config, 'GOVERNOR_MAX_PAUSE', 2)
+    sleeps = []
+    loads = iter(loads)
+    governor = Governor(load=lambda: next(loads), io_pressure=lambda: io_pressure, cpus=2, sleep=sleeps.append)
+    return governor, sleeps
+
+
+def test_governor_decreases_pauses_and_releases(monkeypatch):
+    # Load per CPU: 2 CPUs, so a load of 4 is 2 per CPU, above the ceiling of 1.5:
+    governor, sleeps = make_governor(monkeypatch, [1, 4, 4, 4, 4, 1, 1, 1, 1, 1])
+    governor.peak = 4
+    governor.pace()
+    assert governor.limit is None and not governor.decisions
+    governor.pace()
+    assert governor.limit == 2
+    governor.pace()
+    assert governor.limit == 1 and not sleeps
+    governor.pace()
+    governor.pace()
+    # One domain at a time is still too much, so the pause doubles up to the maximum:
+    assert sleeps == [0.5, 1.0]
+    governor.pace()
+    assert governor.pause == 0 and governor.limit == 1
+    for _ in range(4):
+        governor.pace()
+    assert governor.limit is None
+    actions = [decision['action'] for decision in governor.decisions]
+    assert actions == ['decrease', 'decrease', 'pause', 'pause', 'resume', 'increase', 'increase', 'increase',
+                       'release']
+    summary = governor.summary()
+    assert summary['paused_seconds'] == 1.5 and summary['decisions'][0]['load_per_cpu'] == 2.0
+
+
+def test_governor_watches_io_pressure_and_limits_slots(monkeypatch):
+    governor, sleeps = make_governor(monkeypatch, itertools.repeat(0), io_pressure=75.0)
+    monkeypatch.setattr(config, 'GOVERNOR_INTERVAL', 60)
+    governor.peak = 2
+    active = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    @governor.wrap
+    def collect():
+        with lock:
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+        time.sleep(0.01)
+        with lock:
+            active['now'] -= 1
+
+    threads = [threading.Thread(target=collect) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert governor.limit == 1 and active['max'] == 1
+    assert governor.decisions[0]['action'] == 'decrease' and governor.decisions[0]['io_pressure'] == 75.0
+
+
+def test_read_io_pressure(tmp_path):
+    path = tmp_path / 'io'
+    path.write_text('some avg10=12.50 avg60=3.00 avg300=1.00 total=100\n'
+                    'full avg10=5.00 avg60=1.00 avg300=0.50 total=50\n')
+    assert read_io_pressure(str(path)) == 12.5
+    assert read_io_pressure(str(tmp_path / 'missing')) is None
+
+
+def test_niced_prefixes_found_commands(monkeypatch):
+    monkeypatch.setattr(config, 'CHILD_NICE', 10)
+    monkeypatch.setattr(config, 'CHILD_IONICE_CLASS', 3)
+    tools = {'python3': '/usr/bin/python3', 'nice': '/usr/bin/nice', 'ionice': '/usr/bin/ionice'}
+    monkeypatch.setattr(throttle, '_which', tools.get)
+    assert niced(['python3', '-V']) == ['ionice', '-c', '3', 'nice', '-n', '10', 'python3', '-V']
+    # A missing command fails like before, without the prefix:
+    assert niced(['no-such-program']) == ['no-such-program']
+    monkeypatch.setattr(config, 'CHILD_NICE', 0)
+    monkeypatch.setattr(config, 'CHILD_IONICE_CLASS', None)
+    assert niced(['python3', '-V']) == ['python3', '-V']
+
+
+def test_parse_retry_after(monkeypatch):
+    monkeypatch.setattr(config, 'PUSH_MAX_RETRY_AFTER', 900)
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('99999') == 900
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=1445412480) == 30
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412480) == 0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+
+
+def test_backoff_delay_full_jitter(monkeypatch):
+    monkeypatch.setattr(config, 'PUSH_BACKOFF_BASE', 1)
+    monkeypatch.setattr(config, 'PUSH_BACKOFF_MAX', 60)
+    rng = random.Random(1)
+    delays = [backoff_delay(attempt, rng=rng) for attempt in range(10) for _ in range(50)]
+    assert all(0 <= delay <= min(60, 2 ** (i // 50)) for i, delay in enumerate(delays))
+    # Spread over the whole range instead of the same time for every server:
+    assert min(delays[-50:]) < 10 and max(delays[-50:]) > 50
+    assert 30 <= backoff_delay(0, retry_after=30, rng=rng) <= 37.5
+
+
+def test_rate_controller_aimd(monkeypatch):
+    monkeypatch.setattr(config, 'PUSH_MIN_RATE', 0.01)
+    monkeypatch.setattr(config, 'PUSH_RATE_INCREASE', 0.5)
+    clock = [0.0]
+    rate = RateController(max_window=8, clock=lambda: clock[0])
+    # Not limited before the first backpressure, 4 POSTs per second:
+    for _ in range(5):
+        assert rate.reserve() == 0
+        clock[0] += 0.25
+    assert rate.allowed() == 8
+    rate.backpressure(retry_after=10)
+    assert rate.allowed() == 4 and rate.rate == 2
+    assert rate.reserve() == 10
+    assert rate.reserve() == 10.5
+    rate.backpressure()
+    assert rate.allowed() == 2 and rate.rate == 1
+    for _ in range(4):
+        rate.success()
+    assert rate.rate == 3 and rate.allowed() == 3